@@ -0,0 +1,45 @@
+"""
+batching.py
+
+Shows how the longest time a move may wait for others to be proposed
+with it (the batch_delay of PartTimeNetworkLayer) trades commit latency
+for moves per instance. Runs the delayed network of pipeline.py with
+every player other than the leader broadcasting a move every round
+(heavy load), and with rounds 2 ms apart and a move every 5 rounds
+(light load). The leader only holds moves back while they arrive fast
+enough to fill a batch within the delay: under heavy load the longer
+delays do, and fill larger batches at the cost of latency, while under
+light load no delay holds moves back at all.
+
+For each run prints the number of batches the leader proposed, their
+mean and largest sizes, and the median and 99th percentile time in
+milliseconds the oldest move of a batch waited in the leader's outbox.
+
+Usage: python benchmarks/batching.py [WINDOW]
+"""
+
+import sys
+
+import harness
+from pipeline import throughput
+
+if __name__ == '__main__':
+    window = 4
+    if len(sys.argv) > 1:
+        window = int(sys.argv[1])
+
+    print '%6s %8s %9s %8s %8s %8s %8s %8s %8s %8s %6s' % ('load',
+        'delay ms', 'moves/s', 'rnd p50', 'rnd p99', 'batches', 'mean',
+        'max', 'wait p50', 'wait p99', 'order')
+    for load, every, round_time in (('heavy', 1, 0), ('light', 5, .002)):
+        for delay in (0, .001, .005, .02):
+            t = throughput(window, every=every, round_time=round_time,
+                           n_rounds=300 * every, batch_delay=delay)
+            b = t['batches']
+            print '%6s %8.0f %9.0f %8.1f %8.1f %8d %8.1f %8d %8.2f %8.2f %6s' % (
+                load, 1e3 * delay, t['rate'],
+                harness.percentile(t['latencies'], 50),
+                harness.percentile(t['latencies'], 99), b['batches'],
+                b['mean_size'], b['max_size'], 1e3 * b['median_wait'],
+                1e3 * b['p99_wait'], t['in_order'])
+            sys.stdout.flush()
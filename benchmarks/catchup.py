@@ -0,0 +1,108 @@
+"""
+catchup.py
+
+Shows how a PartTimeNetworkLayer that missed messages catches up. Three
+players play a game; one of them then stops for a number of rounds and
+loses everything sent to it meanwhile, as on a dropped connection, while
+the other two carry on. It is then stepped again, and asks the others
+for the values it missed: as runs of values while they still keep them,
+or as a snapshot of the game and the values after it once it is further
+behind than that. Reports how far behind it was, how long it took to
+catch up, how it was caught up, whether its game ended up the same as
+the others', and the time of the get_messages calls of the players
+serving the catch-up, before and during it.
+
+Usage: python benchmarks/catchup.py [LAG ...]
+"""
+
+import sys, time
+
+import harness
+from network_layers import PartTimeNetworkLayer
+from game_utils import GameState, Message, Direction
+from timers import Histogram, monotonic
+
+N_PLAYERS = 3
+
+def run(lag, history=64, snapshot_every=32, max_rounds=20000):
+    """
+    Returns the number of instances the lagging player was behind, the
+    seconds and rounds it took to catch up (None if it did not), its
+    catch-up statistics, whether every game ended up the same, and
+    histograms of the get_messages times of the other players before and
+    during the catch-up.
+    """
+    layers = harness.start_layers(PartTimeNetworkLayer, N_PLAYERS,
+                                  batch_delay=0, history=history,
+                                  snapshot_every=snapshot_every)
+    games = []
+    for layer in layers:
+        game = GameState((600, 600), n_players=N_PLAYERS)
+        game.timestamp = lambda: 0.0
+        game.start()
+        layer.restore(game)
+        games.append(game)
+    normal = Histogram()
+    serving = Histogram()
+    moves = [0]
+
+    def step(r, active, frames=None):
+        # the players still playing take turns to move
+        if r is not None and r % 3 == 0:
+            p = active[(r // 3) % 2]
+            layers[p].broadcast_message(
+                Message.move(p, (float(moves[0]), 1.0), Direction.east))
+            moves[0] += 1
+        for i in active:
+            start = monotonic()
+            for m in layers[i].get_messages():
+                games[i].move(m.player, m.pos, m.direction, 0)
+            layers[i].snapshot(games[i])
+            if frames is not None and i != N_PLAYERS - 1:
+                frames.record(monotonic() - start)
+
+    everyone = range(N_PLAYERS)
+    lagging = layers[-1]
+    try:
+        with harness.quiet():
+            for r in range(300):
+                step(r, everyone)
+            for r in range(lag):
+                step(r, everyone[:-1], normal)
+            # everything sent to the lagging player meanwhile is lost
+            for s in lagging.poller.ready():
+                if s in lagging.socks and s.fileno() is not None:
+                    list(lagging._read_all(s, lagging.socks.index(s)))
+            behind = layers[0].instance - lagging.instance
+
+            start = time.time()
+            done = None
+            for r in range(max_rounds):
+                step(r, everyone, serving)
+                if lagging.instance >= layers[0].instance - 1 and \
+                   not layers[0].serving:
+                    done = (time.time() - start, r + 1)
+                    break
+            # let the last moves resolve everywhere
+            for r in range(200):
+                step(None, everyone)
+        same = len(set(g.snapshot() for g in games)) == 1
+        stats = lagging.catchup_stats()
+    finally:
+        harness.stop_layers(layers)
+    return behind, done, stats, same, normal, serving
+
+if __name__ == '__main__':
+    lags = [30, 150, 1500]
+    if len(sys.argv) > 1:
+        lags = map(int, sys.argv[1:])
+
+    print '%6s %8s %10s %8s %10s %6s %10s %10s' % ('lag', 'behind',
+        'catchup ms', 'rounds', 'snapshots', 'same', 'p99 us', 'serve p99')
+    for lag in lags:
+        behind, done, stats, same, normal, serving = run(lag)
+        seconds, rounds = done or (float('nan'), 0)
+        print '%6d %8d %10.1f %8d %10d %6s %10.0f %10.0f' % (lag, behind,
+            1e3 * seconds, rounds, stats['snapshots'], same,
+            1e6 * normal.percentile(99), 1e6 * serving.percentile(99))
+        sys.stdout.flush()
@@ -0,0 +1,66 @@
+"""
+codec.py
+
+Compares the two wire formats of game messages: the GameMsg protobuf of
+protocol version 1 and the fixed-size struct of version 2. Reports how
+many moves, kills and exits each can serialize and deserialize per
+second, and the size of each on the wire.
+
+Usage: python benchmarks/codec.py [MESSAGES]
+"""
+
+import sys, time, random
+
+import harness
+from game_utils import Message, Direction
+
+def sample_messages(n):
+    """
+    Returns a list of `n' random moves, half of them with a tick, like a
+    game would send.
+    """
+    msgs = []
+    for i in range(n):
+        pos = (float(random.randint(0, 600)), float(random.randint(0, 600)))
+        tick = i if i % 2 else None
+        msgs.append(Message.move(random.randint(0, 7), pos,
+                                 random.choice(list(Direction)), tick))
+    return msgs
+
+def rates(msgs, version):
+    """
+    Returns the number of messages per second serialized and deserialized
+    in the wire format of the given protocol version.
+    """
+    start = time.time()
+    data = [msg.serialize(version) for msg in msgs]
+    encode = len(msgs) / (time.time() - start)
+    start = time.time()
+    for d in data:
+        Message.deserialize(d)
+    decode = len(msgs) / (time.time() - start)
+    return encode, decode, sum(map(len, data)) / float(len(data))
+
+if __name__ == '__main__':
+    n_msgs = 100000
+    if len(sys.argv) > 1:
+        n_msgs = int(sys.argv[1])
+
+    random.seed(0)
+    samples = [('move', sample_messages(n_msgs)),
+               ('kill', [Message.kill(i % 8) for i in range(n_msgs)]),
+               ('exit', [Message.exit(i % 8) for i in range(n_msgs)])]
+
+    print '%-6s %-9s %14s %14s %8s' % ('type', 'format', 'encode msg/s',
+                                        'decode msg/s', 'bytes')
+    for name, msgs in samples:
+        base = None
+        for label, version in (('protobuf', Message.PROTOBUF),
+                               ('struct', Message.STRUCT)):
+            encode, decode, size = rates(msgs, version)
+            print '%-6s %-9s %14.0f %14.0f %8.1f' % (name, label, encode,
+                                                      decode, size)
+            if base is None:
+                base = encode, decode
+        print '%-6s %-9s %13.1fx %13.1fx' % ('', 'speedup', encode / base[0],
+                                              decode / base[1])
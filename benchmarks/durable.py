@@ -0,0 +1,182 @@
+"""
+durable.py
+
+Compares the rate at which Acceptor state can be saved to disk with the
+two-file DurableObjectHandler of paxos/durable.py, which rewrites the
+state of every open instance on each save, and with the DurableLog,
+which appends one record per promise or accept, fsyncing every record
+or committing groups of them with one fsync.
+
+Then compares the rates at which records holding large values are
+written and read back, without fsyncs, in the unversioned format (MD5,
+joined into one string, read back with four reads) and in the current
+one with each checksum (written with writev, read back with one read).
+
+Each save is the record of an accept of a batch of moves in one of
+WINDOW open instances. Saves are only as slow as the disk under DIR
+(by default the current directory); on a RAM disk fsync costs nothing.
+
+Usage: python benchmarks/durable.py [DIR]
+"""
+
+import sys, os, time, shutil, tempfile, struct, hashlib
+import cPickle as pickle
+
+import harness
+from paxos import durable
+from paxos.durable import DurableObjectHandler, DurableLog
+from paxos.essential import ProposalID
+from game_utils import Message, Direction
+
+# the open instances, and the moves accepted in each
+WINDOW = 8
+MOVES = 8
+
+def records(n):
+    """
+    Returns `n' acceptor records of (instance, promised_id, accepted_id,
+    accepted_value).
+    """
+    value = tuple(Message.move(i, (float(i), 0.), Direction.east)
+                  .serialize(Message.STRUCT) for i in range(MOVES))
+    return [(i, ProposalID(1, 1), ProposalID(1, 1), value)
+            for i in range(n)]
+
+def two_files(dirname, recs):
+    handler = DurableObjectHandler(dirname, 'acceptor')
+    state = {}
+    start = time.time()
+    for rec in recs:
+        state[rec[0]] = rec[1:]
+        # instances resolved long ago are no longer kept
+        state.pop(rec[0] - WINDOW, None)
+        handler.save(state)
+    elapsed = time.time() - start
+    handler.close()
+    return elapsed, len(recs)
+
+def log(dirname, recs, group):
+    wal = DurableLog(dirname, 'acceptor', group_commit=group > 1)
+    start = time.time()
+    for i, rec in enumerate(recs):
+        wal.append(rec)
+        if (i + 1) % group == 0:
+            wal.commit()
+    wal.commit()
+    elapsed = time.time() - start
+    wal.close()
+    return elapsed, wal.syncs
+
+def check(dirname, recs):
+    """
+    Returns True if the log in `dirname' recovers to `recs'.
+    """
+    wal = DurableLog(dirname, 'acceptor')
+    ok = wal.recovered == recs
+    wal.close()
+    return ok
+
+def old_write(fd, serial_number, pyobject):
+    """
+    Writes a record the way durable.write did before the format was
+    versioned.
+    """
+    os.lseek(fd, 0, os.SEEK_SET)
+    data_pickle = pickle.dumps(pyobject, pickle.HIGHEST_PROTOCOL)
+    data_serial = struct.pack('>Q', serial_number)
+    data_length = struct.pack('>Q', len(data_pickle))
+    m = hashlib.md5()
+    m.update(data_serial)
+    m.update(data_length)
+    m.update(data_pickle)
+    os.write(fd, ''.join([m.digest(), data_serial, data_length,
+                          data_pickle]))
+
+def old_read(fd):
+    """
+    Reads a record the way durable.read did before the format was
+    versioned.
+    """
+    os.lseek(fd, 0, os.SEEK_SET)
+    md5hash = os.read(fd, 16)
+    data1 = os.read(fd, 8)
+    data2 = os.read(fd, 8)
+    data3 = os.read(fd, struct.unpack('>Q', data2)[0])
+    m = hashlib.md5()
+    m.update(data1)
+    m.update(data2)
+    m.update(data3)
+    assert m.digest() == md5hash
+    return pickle.loads(data3)
+
+def codec(fd, size, checksum, n):
+    """
+    Returns the MB/s at which records holding a `size' byte value are
+    written to and read back from `fd', in the unversioned format if
+    `checksum' is None.
+    """
+    value = os.urandom(size)
+    start = time.time()
+    for i in range(n):
+        if checksum is None:
+            old_write(fd, i, value)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            durable.write_all(fd, durable.encode_record(i, value, checksum))
+    written = time.time() - start
+    start = time.time()
+    for i in range(n):
+        if checksum is None:
+            old_read(fd)
+        else:
+            durable.read(fd)
+    read = time.time() - start
+    mb = float(size) * n / (1 << 20)
+    return mb / written, mb / read
+
+if __name__ == '__main__':
+    parent = sys.argv[1] if len(sys.argv) > 1 else '.'
+    n = 2000
+
+    print '%-22s %10s %8s %12s %10s' % ('scheme', 'saves/s', 'fsyncs',
+                                         'bytes/save', 'recovers')
+    for name, group in [('two files', None), ('log, fsync each', 1),
+                        ('log, group of 8', 8), ('log, group of 64', 64)]:
+        dirname = tempfile.mkdtemp(dir=parent)
+        try:
+            recs = records(n)
+            if group is None:
+                elapsed, syncs = two_files(dirname, recs)
+                ok = DurableObjectHandler(dirname, 'acceptor').recovered \
+                    is not None
+            else:
+                elapsed, syncs = log(dirname, recs, group)
+                ok = check(dirname, recs)
+            size = sum(os.path.getsize(os.path.join(dirname, f))
+                       for f in os.listdir(dirname))
+            # each save rewrites one of the two files whole
+            per_save = float(size) / n if group else float(size) / 2
+            print '%-22s %10.0f %8d %12.0f %10s' % (name, n / elapsed, syncs,
+                                                     per_save, ok)
+        finally:
+            shutil.rmtree(dirname)
+        sys.stdout.flush()
+
+    print
+    print '%-10s %10s %12s %12s' % ('format', 'value', 'write MB/s',
+                                    'read MB/s')
+    dirname = tempfile.mkdtemp(dir=parent)
+    try:
+        fd = os.open(os.path.join(dirname, 'records'),
+                     os.O_CREAT | os.O_RDWR)
+        for size in (1 << 10, 1 << 16, 1 << 20):
+            for name, checksum in [('md5 v1', None), ('md5', durable.MD5),
+                                   ('crc32', durable.CRC32),
+                                   ('adler32', durable.ADLER32)]:
+                written, read = codec(fd, size, checksum,
+                                      max(20, (64 << 20) // size // 4))
+                print '%-10s %10d %12.0f %12.0f' % (name, size, written, read)
+                sys.stdout.flush()
+        os.close(fd)
+    finally:
+        shutil.rmtree(dirname)
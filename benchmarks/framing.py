@@ -0,0 +1,69 @@
+"""
+framing.py
+
+Compares the throughput of the buffered message framing in
+WrappedSocket.recv with the framing it replaced, which read the 8 byte
+length and then the message with one recv each. Messages of a few sizes
+are written over a socket pair in bursts and read back until the
+socket is drained, the way the network layers read each frame.
+
+Usage: python benchmarks/framing.py [MESSAGES]
+"""
+
+import sys, os, time, struct
+import socket as sock
+
+import harness
+from network_utils import WrappedSocket
+
+class UnbufferedSocket(WrappedSocket):
+    """
+    The old framing: one recv for the length and one for the message.
+    """
+    def recv(self, buf_len=1024):
+        data = self.socket.recv(8)
+        if not data: return
+        assert len(data) == 8
+        msglen = struct.unpack("!Q", data)[0]
+        data = self.socket.recv(msglen)
+        assert len(data) == msglen
+        return data
+
+def throughput(socket_class, size, n_msgs, burst=32):
+    """
+    Returns the number of messages of `size' bytes per second of reading
+    through a socket_class, written `burst' at a time.
+    """
+    a, b = sock.socketpair()
+    b.setblocking(0)
+    reader = socket_class(b)
+    frame = struct.pack('!Q', size) + os.urandom(size)
+    chunk = frame * burst
+    received = 0
+    elapsed = 0.0
+    while received < n_msgs:
+        a.sendall(chunk)
+        # only the reading is timed
+        start = time.time()
+        try:
+            while True:
+                reader.recv(1024)
+                received += 1
+        except IOError:
+            pass
+        elapsed += time.time() - start
+    a.close()
+    b.close()
+    return received / elapsed
+
+if __name__ == '__main__':
+    n_msgs = 200000
+    if len(sys.argv) > 1:
+        n_msgs = int(sys.argv[1])
+
+    print '%8s %16s %16s %8s' % ('size', 'unbuffered msg/s', 'buffered msg/s',
+                                 'speedup')
+    for size in (16, 64, 256, 1024):
+        old = throughput(UnbufferedSocket, size, n_msgs)
+        new = throughput(WrappedSocket, size, n_msgs)
+        print '%8d %16.0f %16.0f %8.2f' % (size, old, new, new / old)
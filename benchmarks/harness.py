@@ -0,0 +1,118 @@
+"""
+harness.py
+
+Shared helpers for the benchmarks. Network layers are run in a single
+process over the socket pairs built by network_utils.local_connections
+and are stepped round robin, one get_messages call per player per
+round, the way each player's game loop would call it once per frame.
+"""
+
+import sys, os, time
+
+# the benchmarks live one directory below the game modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from network_utils import local_connections
+from game_utils import Message, Direction
+
+class quiet(object):
+    """
+    Context manager that silences the debugging output of the game and
+    the network layers.
+    """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def start_layers(layer_class, n_players, **kwargs):
+    """
+    Start `n_players' network layers of the given class connected to each
+    other inside this process.
+    Returns: the list of started layers, indexed by player number.
+    """
+    layers = [layer_class(connection=c, **kwargs)
+              for c in local_connections(n_players)]
+    with quiet():
+        for layer in layers:
+            layer.start()
+    return layers
+
+def stop_layers(layers):
+    """
+    Stop the layers and close their sockets.
+    """
+    for layer in layers:
+        layer.stop()
+        for s in layer.socks:
+            if s and hasattr(s, 'socket'):
+                s.socket.close()
+
+def step(layers, delivered, r=0):
+    """
+    Run round `r': call get_messages once on every layer, and record in
+    `delivered' the time and round each (player, pos) message was first
+    delivered to each layer.
+    """
+    for i, layer in enumerate(layers):
+        for msg in layer.get_messages():
+            key = (msg.player, msg.pos)
+            if key not in delivered[i]:
+                delivered[i][key] = (time.time(), r)
+
+def measure_commits(layers, n_moves, gap=5, max_rounds=2000, warmup=200):
+    """
+    Broadcast `n_moves' moves, one every `gap' rounds, from players other
+    than the leader, and run rounds until every layer has delivered all
+    of them or `max_rounds' rounds have been run. Moves that were not
+    delivered everywhere are left out of the latencies.
+    Returns: a tuple of the list of commit latencies in seconds (from the
+        broadcast until the last layer delivered the move), the list of
+        commit latencies in rounds, and the total number of rounds run.
+    """
+    n = len(layers)
+    delivered = [dict() for layer in layers]
+    sent = {}
+    with quiet():
+        # let a leader get elected
+        for r in range(warmup):
+            step(layers, delivered)
+
+        r = 0
+        while r < max_rounds:
+            if r % gap == 0 and len(sent) < n_moves:
+                k = len(sent)
+                # player 1 starts out as the leader
+                player = (2 + k % (n - 1)) % n
+                key = (player, (float(k), float(r)))
+                sent[key] = (time.time(), r)
+                layers[player].broadcast_message(
+                    Message.move(player, key[1], Direction.east))
+            step(layers, delivered, r)
+            r += 1
+            if len(sent) == n_moves and \
+               all(len(d) >= n_moves and all(k in d for k in sent)
+                   for d in delivered):
+                break
+
+    seconds = []
+    rounds = []
+    for key, (t, sent_round) in sent.items():
+        done = [d.get(key) for d in delivered]
+        if None in done:
+            continue
+        seconds.append(max(done)[0] - t)
+        rounds.append(max(d[1] for d in done) - sent_round + 1)
+    return seconds, rounds, r
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile (0-100) of a list of numbers.
+    """
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * p // 100)]
@@ -0,0 +1,48 @@
+"""
+multipaxos.py
+
+Compares the commit latency of PartTimeNetworkLayers running classic
+Paxos, where every instance starts with a prepare round, with Multi-Paxos,
+where a stable leader only runs the accept round. Latencies are measured
+in rounds of get_messages calls and in wall clock time, with every
+player's layer run in this process.
+
+Usage: python benchmarks/multipaxos.py [PLAYERS ...]
+"""
+
+import sys
+
+import harness
+from network_layers import PartTimeNetworkLayer
+
+def commit_latency(n_players, multi_paxos, n_moves=20):
+    """
+    Returns the commit latencies in seconds and in rounds of `n_moves'
+    moves with `n_players' PartTimeNetworkLayers.
+    """
+    # no batching deadline, so that only the protocol is measured
+    layers = harness.start_layers(PartTimeNetworkLayer, n_players,
+                                  multi_paxos=multi_paxos, batch_delay=0)
+    try:
+        seconds, rounds, total = harness.measure_commits(layers, n_moves)
+    finally:
+        harness.stop_layers(layers)
+    return seconds, rounds
+
+if __name__ == '__main__':
+    counts = [3, 5, 8]
+    if len(sys.argv) > 1:
+        counts = map(int, sys.argv[1:])
+
+    n_moves = 20
+    print '%8s %8s %12s %12s %14s %10s' % ('players', 'mode', 'commit ms',
+        'commit p99', 'commit rounds', 'committed')
+    for n in counts:
+        for mode, multi_paxos in (('classic', False), ('multi', True)):
+            seconds, rounds = commit_latency(n, multi_paxos, n_moves)
+            print '%8d %8s %12.2f %12.2f %14.1f %10s' % (
+                n, mode, 1e3 * harness.percentile(seconds, 50),
+                1e3 * harness.percentile(seconds, 99),
+                harness.percentile(rounds, 50),
+                '%d/%d' % (len(seconds), n_moves))
+            sys.stdout.flush()
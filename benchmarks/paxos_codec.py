@@ -0,0 +1,96 @@
+"""
+paxos_codec.py
+
+Compares the encoding of Paxos messages before and after proposal ids
+and values became typed protobuf fields. The old encoding pickled the
+ProposalIDs into the proposal_id and previous_id strings and the list of
+game messages into the value string. Reports the messages per second
+each can build and serialize, and parse and decode, for accepts
+carrying batches of moves of a few sizes and for heartbeats.
+
+Usage: python benchmarks/paxos_codec.py [MESSAGES]
+"""
+
+import sys, time, cPickle
+
+import harness
+import paxosmsg_pb2 as pxb
+from paxos.essential import ProposalID
+from game_utils import Message, Direction
+from network_layers import paxos_msg, paxos_ids, paxos_value
+
+def pickled_msg(mtype, proposal_id=None, previous_id=None, value=None):
+    """
+    Returns a Paxos message encoded the old way.
+    """
+    msg = pxb.msg()
+    msg.type = mtype
+    if proposal_id:
+        msg.proposal_id = cPickle.dumps(proposal_id)
+    if previous_id:
+        msg.previous_id = cPickle.dumps(previous_id)
+    if value is not None:
+        msg.value = cPickle.dumps(value)
+    return msg
+
+def unpickled(msg):
+    """
+    Decodes a Paxos message encoded the old way.
+    """
+    proposal_id = previous_id = value = None
+    if msg.proposal_id:
+        proposal_id = ProposalID._make(cPickle.loads(str(msg.proposal_id)))
+    if msg.previous_id:
+        previous_id = ProposalID._make(cPickle.loads(str(msg.previous_id)))
+    if msg.value:
+        value = cPickle.loads(str(msg.value))
+    return proposal_id, previous_id, value
+
+def typed(msg):
+    """
+    Decodes a Paxos message with typed fields.
+    """
+    proposal_id, previous_id = paxos_ids(msg)
+    return proposal_id, previous_id, paxos_value(msg)
+
+def rates(make, decode, args, n_msgs):
+    """
+    Returns the messages per second encoded and decoded by the given
+    functions, and the size of a message in bytes.
+    """
+    start = time.time()
+    for i in xrange(n_msgs):
+        msg = make(*args)
+        msg.from_uid = 1
+        msg.instance = i
+        data = msg.SerializeToString()
+    encode = n_msgs / (time.time() - start)
+    start = time.time()
+    for i in xrange(n_msgs):
+        msg = pxb.msg()
+        msg.ParseFromString(data)
+        decode(msg)
+    return encode, n_msgs / (time.time() - start), len(data)
+
+if __name__ == '__main__':
+    n_msgs = 20000
+    if len(sys.argv) > 1:
+        n_msgs = int(sys.argv[1])
+
+    proposal_id = ProposalID(12, 3)
+    cases = [('heartbeat', (pxb.HEARTBEAT, proposal_id))]
+    for batch in (1, 8, 64):
+        value = [Message.move(2, (float(i), 10.0), Direction.east, i)
+                 .serialize(Message.STRUCT) for i in range(batch)]
+        cases.append(('accept x%d' % batch,
+                      (pxb.ACCEPT, proposal_id, None, value)))
+
+    print '%-11s %-7s %12s %12s %7s' % ('message', 'format', 'encode msg/s',
+                                         'decode msg/s', 'bytes')
+    for name, args in cases:
+        old = rates(pickled_msg, unpickled, args, n_msgs)
+        new = rates(paxos_msg, typed, args, n_msgs)
+        print '%-11s %-7s %12.0f %12.0f %7d' % ((name, 'pickle') + old)
+        print '%-11s %-7s %12.0f %12.0f %7d' % (('', 'typed') + new)
+        print '%-11s %-7s %11.1fx %11.1fx' % ('', 'speedup', new[0] / old[0],
+                                              new[1] / old[1])
@@ -0,0 +1,145 @@
+"""
+persistence.py
+
+Measures the commit latency that logging promises and accepts to disk
+adds to PartTimeNetworkLayers (the durable_dir argument), and checks
+that the disk writes stay off the game loop: the time of each
+get_messages call is recorded alongside the commit latency, and the
+persister's statistics show how many records shared each fsync and how
+long records waited to be on the disk.
+
+The players are stepped in lock step, and each pass of the leader hands
+its persister the records of that pass, whose fsync is done before the
+next pass; so records rarely overlap and nearly every fsync carries one.
+A second run shows what group commit does once commits overlap: several
+acceptors share one persister, each handing it a record as soon as its
+last one is on the disk, as a player would with many instances waiting
+on the disk at once. It reports how many records shared each fsync and
+how long each acceptor waited for its record, against one acceptor
+alone.
+
+The logs are written under DIR, by default the current directory;
+fsync is only as slow as the disk under it, and costs nothing on a RAM
+disk.
+
+Usage: python benchmarks/persistence.py [DIR] [PLAYERS ...]
+"""
+
+import sys, shutil, tempfile
+
+import harness
+from network_layers import PartTimeNetworkLayer, LOG_ACCEPTOR
+from network_utils import Persister, Poller
+from paxos.durable import DurableLog
+from timers import Histogram, monotonic
+
+def run(n_players, durable_dir, n_moves=100, gap=2):
+    """
+    Returns the commit latencies in seconds, a histogram of the time of
+    the get_messages calls, and the persister statistics of the leader
+    (or None when not persisting).
+    """
+    layers = harness.start_layers(PartTimeNetworkLayer, n_players,
+                                  durable_dir=durable_dir)
+    frames = Histogram()
+    # time every get_messages call the harness makes
+    for layer in layers:
+        def timed(get_messages=layer.get_messages):
+            start = monotonic()
+            msgs = get_messages()
+            frames.record(monotonic() - start)
+            return msgs
+        layer.get_messages = timed
+    try:
+        seconds, rounds, r = harness.measure_commits(layers, n_moves, gap,
+                                                     max_rounds=20000)
+        stats = layers[1].persist_stats()
+    finally:
+        harness.stop_layers(layers)
+    return seconds, frames, stats
+
+def shared(n_acceptors, durable_dir, n_records=1000):
+    """
+    Returns the commit latencies in seconds of `n_records' accept records
+    from `n_acceptors' acceptors sharing one persister, each handing it a
+    record as soon as its last one is on the disk, the seconds they took
+    and the persister statistics.
+    """
+    persister = Persister(DurableLog(durable_dir, 'shared', group_commit=True))
+    poller = Poller([persister])
+    latencies = []
+    # the ticket of each acceptor's record on its way to the disk, and
+    # when it was handed over
+    tickets = [None] * n_acceptors
+    started = [None] * n_acceptors
+    instance = 0
+    start = monotonic()
+    try:
+        while len(latencies) < n_records:
+            flushed = persister.flushed()
+            for a in range(n_acceptors):
+                if tickets[a] is not None:
+                    if tickets[a] > flushed:
+                        continue
+                    latencies.append(monotonic() - started[a])
+                instance += 1
+                started[a] = monotonic()
+                tickets[a] = persister.submit(
+                    [(LOG_ACCEPTOR, instance, (1, a), (1, a), ('move',))])
+            poller.ready(1)
+            persister.clear()
+        elapsed = monotonic() - start
+        stats = persister.stats()
+    finally:
+        poller.close()
+        persister.close()
+    return latencies, elapsed, stats
+
+if __name__ == '__main__':
+    parent = '.'
+    counts = [3, 5]
+    args = sys.argv[1:]
+    if args and not args[0].isdigit():
+        parent = args.pop(0)
+    if args:
+        counts = map(int, args)
+
+    n_moves = 100
+    print '%7s %8s %10s %10s %10s %10s %10s %10s %10s %9s' % ('players',
+        'durable', 'committed', 'commit ms', 'p99 ms', 'call us', 'p99 us',
+        'fsyncs', 'recs/sync', 'lag p99')
+    for n in counts:
+        for durable in (False, True):
+            dirname = tempfile.mkdtemp(dir=parent) if durable else None
+            try:
+                seconds, frames, stats = run(n, dirname, n_moves)
+            finally:
+                if dirname:
+                    shutil.rmtree(dirname)
+            if stats:
+                persisted = '%10d %10.1f %9.2f' % (stats['commits'],
+                    stats['records_per_commit'], 1e3 * stats['p99_lag'])
+            else:
+                persisted = '%10s %10s %9s' % ('-', '-', '-')
+            print '%7d %8s %10s %10.2f %10.2f %10.0f %10.0f %s' % (n, durable,
+                '%d/%d' % (len(seconds), n_moves), 1e3 * harness.percentile(seconds, 50),
+                1e3 * harness.percentile(seconds, 99),
+                1e6 * frames.percentile(50), 1e6 * frames.percentile(99),
+                persisted)
+            sys.stdout.flush()
+
+    print
+    print '%9s %10s %10s %10s %10s %10s %10s' % ('acceptors', 'records',
+        'records/s', 'commit ms', 'p99 ms', 'fsyncs', 'recs/sync')
+    for n in (1, 2, 4, 8, 16):
+        dirname = tempfile.mkdtemp(dir=parent)
+        try:
+            latencies, elapsed, stats = shared(n, dirname)
+        finally:
+            shutil.rmtree(dirname)
+        print '%9d %10d %10.0f %10.2f %10.2f %10d %10.1f' % (n,
+            len(latencies), len(latencies) / elapsed,
+            1e3 * harness.percentile(latencies, 50),
+            1e3 * harness.percentile(latencies, 99), stats['commits'],
+            stats['records_per_commit'])
+        sys.stdout.flush()
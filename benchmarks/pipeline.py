@@ -0,0 +1,190 @@
+"""
+pipeline.py
+
+Shows how the throughput and commit latency of PartTimeNetworkLayers
+change with the number of Paxos instances the leader may have open at
+once. Messages between players are held back for a few rounds, as on a
+network whose round trip takes several frames, and rounds are run until
+every move has been delivered everywhere.
+
+In the steady run every player other than the leader broadcasts a move
+every round, so moves arrive faster than one instance can be resolved.
+With a window of one, moves wait for the instance in flight to be
+resolved and go out in ever larger batches; with more, each round's
+moves can be proposed right away, so they commit in fewer rounds. Every
+window keeps up with the moves, so moves per round is the same for all
+of them, and moves per second only measures how long the rounds take
+to simulate: that falls as the window grows, since more, smaller
+instances mean more Paxos messages for the same moves, which is shown
+as the CPU time per move. In the backlog run every move is broadcast
+in the first round, so the moves per round show how fast a window
+drains a queue of full batches.
+
+Also checks that every player delivered the same moves in the same
+order.
+
+Usage: python benchmarks/pipeline.py [WINDOW ...]
+"""
+
+import sys, time
+
+import harness
+from network_layers import PartTimeNetworkLayer
+from network_utils import local_connections, WrappedSocket, NORMAL
+from game_utils import Message, Direction
+
+class DelayedSocket(object):
+    """
+    Wraps a WrappedSocket so that messages sent through it are only
+    written `delay' rounds after they were sent.
+    """
+    def __init__(self, socket, clock, delay):
+        """
+        Args:
+            socket - the WrappedSocket to wrap
+            clock - a list holding the current round
+            delay - the number of rounds to hold messages for
+        """
+        self.socket = socket
+        self.clock = clock
+        self.delay = delay
+        self.held = []
+
+    def __getattr__(self, name):
+        return getattr(self.socket, name)
+
+    def send(self, msg, lane=NORMAL):
+        self.held.append((self.clock[0] + self.delay, msg, lane))
+        return True
+
+    def queued(self):
+        # held messages count as queued so that the layer flushes them
+        return self.socket.queued() or len(self.held)
+
+    def flush(self):
+        due = 0
+        while due < len(self.held) and self.held[due][0] <= self.clock[0]:
+            self.socket.send(*self.held[due][1:])
+            due += 1
+        del self.held[:due]
+        return self.socket.flush()
+
+def start_layers(n_players, clock, delay, **kwargs):
+    """
+    Start `n_players' PartTimeNetworkLayers whose messages to each other
+    are delayed by `delay' rounds.
+    """
+    connections = []
+    for player, socks, addrs, board_size, version in \
+            local_connections(n_players):
+        socks = [DelayedSocket(s, clock, delay)
+                 if isinstance(s, WrappedSocket) else s for s in socks]
+        connections.append((player, socks, addrs, board_size, version))
+    layers = [PartTimeNetworkLayer(connection=c, **kwargs)
+              for c in connections]
+    with harness.quiet():
+        for layer in layers:
+            layer.start()
+    return layers
+
+def throughput(window, n_players=5, delay=3, n_rounds=300, max_rounds=5000,
+               every=1, burst=1, round_time=0, **kwargs):
+    """
+    Run `n_rounds' rounds in which every player other than the leader
+    broadcasts `burst' moves every `every' rounds, and then rounds until
+    they have all been delivered everywhere or `max_rounds' have been
+    run. Each round is run `round_time' seconds after the previous one,
+    or right away if it is 0. Other keyword arguments are passed on to
+    the layers.
+    Returns: a dictionary of the moves delivered per second ('rate') and
+        per round ('per_round'), the CPU seconds taken per move
+        ('cpu_per_move'), the commit latencies in rounds from the
+        broadcast until the last player delivered the move ('latencies'),
+        the mean number of moves per instance ('per_instance'), the
+        number of moves sent and delivered ('sent', 'done'), whether
+        every player delivered them in the same order ('in_order') and
+        the leader's batch statistics ('batches').
+    """
+    clock = [0]
+    layers = start_layers(n_players, clock, delay, window=window, **kwargs)
+    delivered = [[] for layer in layers]
+    sent = {}
+    done_round = {}
+    try:
+        with harness.quiet():
+            # let a leader get elected
+            for r in range(200):
+                clock[0] += 1
+                for layer in layers:
+                    layer.get_messages()
+
+            start = time.time()
+            cpu = time.clock()
+            r = 0
+            while r < max_rounds:
+                if round_time:
+                    time.sleep(round_time)
+                clock[0] += 1
+                if r < n_rounds and r % every == 0:
+                    # player 1 starts out as the leader
+                    for p in range(n_players):
+                        if p != 1:
+                            for b in range(burst):
+                                pos = (float(r * burst + b), float(p))
+                                layers[p].broadcast_message(
+                                    Message.move(p, pos, Direction.east))
+                                sent[(p, pos)] = r
+                for i, layer in enumerate(layers):
+                    for m in layer.get_messages():
+                        key = (m.player, m.pos)
+                        delivered[i].append(key)
+                        done_round[key] = r
+                r += 1
+                if r >= n_rounds and \
+                   all(len(d) >= len(sent) for d in delivered):
+                    break
+            elapsed = time.time() - start
+            cpu = time.clock() - cpu
+        instances = layers[0].instance - 1
+        batches = layers[1].batch_stats()
+    finally:
+        for layer in layers:
+            layer.stop()
+            for s in layer.socks:
+                if isinstance(s, DelayedSocket):
+                    s.socket.socket.close()
+    done = min(len(d) for d in delivered)
+    latencies = [done_round[k] - sent[k] + 1 for k in sent if k in done_round]
+    in_order = all(d == delivered[0] for d in delivered)
+    return {'rate': done / elapsed,
+            'per_round': float(done) / r,
+            'cpu_per_move': cpu / max(done, 1),
+            'latencies': latencies,
+            'per_instance': float(done) / instances,
+            'sent': len(sent),
+            'done': done,
+            'in_order': in_order,
+            'batches': batches}
+
+if __name__ == '__main__':
+    windows = [1, 2, 4, 8, 16]
+    if len(sys.argv) > 1:
+        windows = map(int, sys.argv[1:])
+
+    runs = [('steady', {}), ('backlog', {'n_rounds': 1, 'burst': 300})]
+    print '%8s %8s %11s %9s %11s %11s %11s %11s %12s %6s' % ('run',
+        'window', 'moves/round', 'moves/s', 'cpu us/move', 'rounds p50',
+        'rounds p99', 'moves/inst', 'delivered', 'same')
+    for name, kwargs in runs:
+        for window in windows:
+            # no batching deadline, so that moves only wait while the
+            # window is full
+            t = throughput(window, batch_delay=0, **kwargs)
+            print '%8s %8d %11.1f %9.0f %11.0f %11.1f %11.1f %11.2f %12s %6s' \
+                % (name, window, t['per_round'], t['rate'],
+                   1e6 * t['cpu_per_move'],
+                   harness.percentile(t['latencies'], 50),
+                   harness.percentile(t['latencies'], 99),
+                   t['per_instance'], '%d/%d' % (t['done'], t['sent']),
+                   t['in_order'])
+            sys.stdout.flush()
@@ -0,0 +1,72 @@
+"""
+players.py
+
+Shows how the per-frame cost of the game engine and the commit latency
+of the Paxos network layer scale with the number of players. Frame
+costs come from headless matches on boards that grow with the number
+of players. Commit latencies come from PartTimeNetworkLayers connected
+inside one process, so the time per round includes running every
+player's layer one after the other.
+
+Usage: python benchmarks/players.py [PLAYERS ...]
+"""
+
+import sys
+
+import harness
+from headless import play_match
+from network_layers import PartTimeNetworkLayer
+
+def board_for(n_players):
+    """
+    Returns a square board big enough that the players start at least
+    as far apart as sixteen players on the standard 600x600 board.
+    """
+    side = max(600, 36 * n_players + 20)
+    return (side, side)
+
+def frame_costs(n_players, matches=5, max_frames=2000):
+    """
+    Returns the mean and 99th percentile frame time in seconds of a few
+    headless matches with `n_players' players.
+    """
+    times = []
+    with harness.quiet():
+        for seed in range(matches):
+            result = play_match(seed, max_frames=max_frames,
+                                n_players=n_players, size=board_for(n_players))
+            times.extend(result['frame_times'])
+    return sum(times) / len(times), harness.percentile(times, 99)
+
+def commit_latency(n_players, n_moves=10):
+    """
+    Returns the commit latencies in seconds and in rounds of `n_moves'
+    moves with `n_players' PartTimeNetworkLayers.
+    """
+    # no batching deadline, so that only the protocol is measured
+    layers = harness.start_layers(PartTimeNetworkLayer, n_players,
+                                  batch_delay=0)
+    try:
+        seconds, rounds, total = harness.measure_commits(layers, n_moves)
+    finally:
+        harness.stop_layers(layers)
+    return seconds, rounds
+
+if __name__ == '__main__':
+    counts = [4, 8, 16, 32, 64]
+    if len(sys.argv) > 1:
+        counts = map(int, sys.argv[1:])
+
+    n_moves = 10
+    print '%8s %10s %14s %14s %14s %14s %10s' % ('players', 'board',
+        'frame mean us', 'frame p99 us', 'commit ms', 'commit rounds',
+        'committed')
+    for n in counts:
+        mean, p99 = frame_costs(n)
+        seconds, rounds = commit_latency(n, n_moves)
+        print '%8d %10s %14.1f %14.1f %14.2f %14.1f %10s' % (
+            n, '%dx%d' % board_for(n), 1e6 * mean, 1e6 * p99,
+            1e3 * harness.percentile(seconds, 50),
+            harness.percentile(rounds, 50),
+            '%d/%d' % (len(seconds), n_moves))
+        sys.stdout.flush()
@@ -0,0 +1,114 @@
+"""
+snapshots.py
+
+Shows how snapshots of the game keep the durable log of
+PartTimeNetworkLayers bounded. Plays games of increasing length with
+the log kept whole and with a snapshot every SNAPSHOT instances
+(64 by default), then reports the size of the leader's log and how long
+a restarted player takes to recover from it: reading the log, restoring
+the game from the last snapshot and replaying the moves resolved after
+it. Also checks that the recovered game matches the one that was
+played.
+
+The logs are written under DIR, by default the current directory.
+
+Usage: python benchmarks/snapshots.py [DIR] [SNAPSHOT]
+"""
+
+import sys, os, time, shutil, tempfile
+
+import harness
+from network_layers import PartTimeNetworkLayer, LOG_DECIDED, LOG_SNAPSHOT
+from paxos.durable import DurableLog
+from game_utils import GameState, Message, Direction
+
+N_PLAYERS = 3
+
+def new_game():
+    game = GameState((600, 600), n_players=N_PLAYERS)
+    game.timestamp = lambda: 0.0
+    game.start()
+    return game
+
+def play(dirname, n_moves, snapshot_every):
+    """
+    Play `n_moves' moves, applying them to a game per player.
+    Returns: the leader's game.
+    """
+    layers = harness.start_layers(PartTimeNetworkLayer, N_PLAYERS,
+                                  durable_dir=dirname,
+                                  snapshot_every=snapshot_every)
+    games = [new_game() for layer in layers]
+    sent = 0
+    r = 0
+    try:
+        with harness.quiet():
+            while sent < n_moves or \
+                  any(len(l.decided) or len(l.outbox) for l in layers):
+                if sent < n_moves and r % 2 == 0:
+                    p = sent % N_PLAYERS
+                    layers[p].broadcast_message(
+                        Message.move(p, (float(sent), 1.0), Direction.east))
+                    sent += 1
+                for layer, game in zip(layers, games):
+                    for m in layer.get_messages():
+                        game.move(m.player, m.pos, m.direction, 0)
+                    layer.snapshot(game)
+                r += 1
+            # let the last instances resolve everywhere
+            for i in range(200):
+                for layer, game in zip(layers, games):
+                    for m in layer.get_messages():
+                        game.move(m.player, m.pos, m.direction, 0)
+    finally:
+        harness.stop_layers(layers)
+    return games[1]
+
+def recover(dirname):
+    """
+    Recover the leader's game from its log the way a restarted layer
+    would.
+    Returns: the recovered game and the number of log records read.
+    """
+    log = DurableLog(dirname, 'acceptor-1')
+    game = new_game()
+    decided = {}
+    for record in log.recovered:
+        if record[0] == LOG_SNAPSHOT:
+            game.restore(record[2])
+        elif record[0] == LOG_DECIDED:
+            decided[record[1]] = record[2]
+    for instance in sorted(decided):
+        for data in decided[instance]:
+            m = Message.deserialize(data)
+            game.move(m.player, m.pos, m.direction, 0)
+    log.close()
+    return game, len(log.recovered)
+
+if __name__ == '__main__':
+    parent = '.'
+    every = 64
+    args = sys.argv[1:]
+    if args and not args[0].isdigit():
+        parent = args.pop(0)
+    if args:
+        every = int(args[0])
+
+    print '%8s %10s %10s %10s %12s %10s' % ('moves', 'snapshot', 'log KB',
+        'records', 'recovery ms', 'matches')
+    for n_moves in (250, 1000, 4000):
+        for snapshot_every in (None, every):
+            dirname = tempfile.mkdtemp(dir=parent)
+            try:
+                played = play(dirname, n_moves, snapshot_every or 1 << 30)
+                size = os.path.getsize(os.path.join(dirname,
+                                                    'acceptor-1.wal'))
+                start = time.time()
+                game, records = recover(dirname)
+                elapsed = time.time() - start
+            finally:
+                shutil.rmtree(dirname)
+            print '%8d %10s %10.1f %10d %12.2f %10s' % (n_moves,
+                snapshot_every or 'never', size / 1024., records,
+                1e3 * elapsed, game.snapshot() == played.snapshot())
+            sys.stdout.flush()
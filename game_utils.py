@@ -7,17 +7,28 @@ and Game State. Direction defines the cardinal directions and allows
 a player to extrapolate in a given direction given a location. Message
 encapsulates the inter-client communication. It has multiple Message
 types that can be created and serialized and deserialized for sending
-over the wire via protocol buffers. Game State is an object that has
-the state of the game that each of the players holds. It has various
-information about the state of the board and methods for initializing
-the game and running it. There are three other functions in
-game_utils.py that are used for drawing the lines for the game.
+over the wire, either via protocol buffers or packed into a fixed-size
+struct, depending on the protocol version of the game. Game State is
+an object that has the state of the game that each of the players
+holds. It has various information about the state of the board and
+methods for initializing the game and running it. Game State keeps a
+Trail Index, a grid of buckets over the board that lets collision
+detection look only at the trail segments near the local player. There
+are three other functions in game_utils.py that are used for drawing
+the lines for the game.
 """
 
-import sys, random, time, copy, math
+import sys, random, time, math, zlib, struct
+from array import array
 from enum import Enum
 import player_pb2 as pb
-import pygame
+
+# pygame is only needed for drawing, so the game engine can also run on
+# machines without it (see headless.py)
+try:
+    import pygame
+except ImportError:
+    pygame = None
 
 class Direction(Enum):
     """
@@ -52,14 +63,26 @@ class Message(object):
     """
     The Message class encapsulates all of the inter-client communication
     that is exposed above the level of the Netwok Layer.
+
+    Messages can be serialized in either of two wire formats, chosen by
+    the protocol version the players agreed on in the StartMsg: version 1
+    is the GameMsg protobuf, and version 2 packs each message into a
+    fixed-size struct. deserialize tells the two apart by their first
+    byte, which is always 0x08 for a GameMsg.
     """
+    __slots__ = ('player', 'pos', 'direction', 'mtype', 'tick')
+
     class Type(Enum):
         start = 1
         move = 2
         kill = 3
         exit = 4
 
-    def __init__(self, player, pos, direction, mtype):
+    # the protocol versions, which name the wire formats
+    PROTOBUF = 1
+    STRUCT = 2
+
+    def __init__(self, player, pos, direction, mtype, tick=None):
         """
         This constructor should not be called directly. Instead, use
         Message.start, Message.move, or Message.kill.
@@ -69,6 +92,7 @@ class Message(object):
         self.pos = pos
         self.direction = direction
         self.mtype = mtype
+        self.tick = tick
 
     @staticmethod
     def start(player):
@@ -78,12 +102,13 @@ class Message(object):
         return Message(player, None, None, Message.Type.start)
 
     @staticmethod
-    def move(player, pos, direction):
+    def move(player, pos, direction, tick=None):
         """
         Returns a new move message for when the given player moves in the given
-        direction at the given position.
+        direction at the given position. Games running in tick mode also give
+        the tick at which the move happened.
         """
-        return Message(player, pos, direction, Message.Type.move)
+        return Message(player, pos, direction, Message.Type.move, tick)
 
     @staticmethod
     def kill(player):
@@ -102,10 +127,20 @@ class Message(object):
     @staticmethod
     def deserialize(msg_str):
         """
-        Create a Message from its serialized protobuf form.
-        Args: msg_str - The protobuf string
+        Create a Message from its serialized form, in either wire format.
+        Args: msg_str - The serialized string
         Returns: the deserialized Message
         """
+        kind = ord(msg_str[0]) if msg_str else 0
+        if kind & _STRUCT_FLAG:
+            mtype = _message_types[kind & _TYPE_MASK]
+            if mtype is Message.Type.move:
+                kind, player, x, y, d, tick = _MOVE.unpack(msg_str)
+                if not kind & _TICK_FLAG:
+                    tick = None
+                return Message(player, (x, y), _directions[d], mtype, tick)
+            return Message(_PLAYER.unpack(msg_str)[1], None, None, mtype)
+
         network_msg = pb.GameMsg()
         network_msg.ParseFromString(msg_str)
         player = network_msg.player_no
@@ -116,13 +151,29 @@ class Message(object):
         if network_msg.HasField('dir'):
             direction = Direction(network_msg.dir)
         mtype = Message.Type(network_msg.mtype)
-        return Message(player, pos, direction, mtype)
+        tick = None
+        if network_msg.HasField('tick'):
+            tick = network_msg.tick
+        return Message(player, pos, direction, mtype, tick)
 
-    def serialize(self):
+    def serialize(self, version=PROTOBUF):
         """
-        Serializes the message as a protobuf.
+        Serializes the message.
+        Args: version - the protocol version whose wire format to use
         Returns: A string representing the message.
         """
+        if version >= Message.STRUCT:
+            kind = _STRUCT_FLAG | self.mtype.value
+            if self.mtype is not Message.Type.move:
+                return _PLAYER.pack(kind, self.player)
+            tick = self.tick
+            if tick is None:
+                tick = 0
+            else:
+                kind |= _TICK_FLAG
+            return _MOVE.pack(kind, self.player, self.pos[0], self.pos[1],
+                              self.direction.value, tick)
+
         network_msg = pb.GameMsg()
         network_msg.mtype = self.mtype.value
         network_msg.player_no = self.player
@@ -131,42 +182,305 @@ class Message(object):
             network_msg.pos.y = self.pos[1]
         if self.direction:
             network_msg.dir = self.direction.value
+        if self.tick is not None:
+            network_msg.tick = self.tick
         return network_msg.SerializeToString()
 
+# Direction members indexed by value, for turning stored values back into
+# Directions without an Enum lookup
+_directions = tuple(Direction)
+# and likewise for Message types
+_message_types = (None,) + tuple(Message.Type)
+
+# The struct wire format. The first byte holds the message type, a flag
+# set in every struct message (a GameMsg always starts with 0x08) and a
+# flag for whether a move has a tick. Moves are followed by the player,
+# the position as single floats (as in the GameMsg), the direction and
+# the tick; other messages only by the player.
+_STRUCT_FLAG = 0x80
+_TICK_FLAG = 0x40
+_TYPE_MASK = 0x0f
+_MOVE = struct.Struct('!BHffBI')
+_PLAYER = struct.Struct('!BH')
+
+class Trail(object):
+    """
+    The history of one player's turns, stored as parallel typed arrays of
+    x, y, direction and time rather than as a list of dicts. Point i of
+    the trail is (xs[i], ys[i]) and the last point is the player's moving
+    head. Only the first len(trail) entries of each array are meaningful;
+    the arrays are preallocated and double in size when they fill up.
+    """
+    __slots__ = ('xs', 'ys', 'dirs', 'times', 'n')
+
+    def __init__(self, capacity=16):
+        """
+        Initialize an empty Trail with room for `capacity' points.
+        """
+        self.xs = array('d', [0.0]) * capacity
+        self.ys = array('d', [0.0]) * capacity
+        self.dirs = array('b', [0]) * capacity
+        self.times = array('d', [0.0]) * capacity
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def _index(self, i):
+        if i < 0:
+            i += self.n
+        if i < 0 or i >= self.n:
+            raise IndexError('trail index out of range')
+        return i
+
+    def pos(self, i):
+        """
+        Returns the (x,y) location tuple of point i.
+        """
+        i = self._index(i)
+        return (self.xs[i], self.ys[i])
+
+    def dir(self, i):
+        """
+        Returns the Direction taken at point i.
+        """
+        return _directions[self.dirs[self._index(i)]]
+
+    def time(self, i):
+        """
+        Returns the time at which point i was reached.
+        """
+        return self.times[self._index(i)]
+
+    def set(self, i, pos, direction, time):
+        """
+        Overwrite point i with the given location, Direction and time.
+        """
+        i = self._index(i)
+        self.xs[i], self.ys[i] = pos
+        self.dirs[i] = direction.value
+        self.times[i] = time
+
+    def append(self, pos, direction, time):
+        """
+        Add a new point to the end of the trail, growing the arrays if
+        they are full.
+        """
+        if self.n == len(self.xs):
+            self.xs.extend(self.xs)
+            self.ys.extend(self.ys)
+            self.dirs.extend(self.dirs)
+            self.times.extend(self.times)
+        self.n += 1
+        self.set(self.n - 1, pos, direction, time)
+
+    def segments(self):
+        """
+        Yields the ((x1,y1), (x2,y2)) endpoints of each segment of the
+        trail, oldest first.
+        """
+        xs, ys = self.xs, self.ys
+        for i in range(self.n - 1):
+            yield (xs[i], ys[i]), (xs[i+1], ys[i+1])
+
+    def clear(self, capacity=16):
+        """
+        Remove every point from the trail and release its storage.
+        """
+        self.__init__(capacity)
+
+class TrailIndex(object):
+    """
+    Spatial index over the committed trail segments of every player. The
+    board is divided into square cells and each segment is recorded in
+    every cell its bounding box touches, so a collision query only has to
+    look at the segments stored in the cells around the queried segment.
+    Two segments can only intersect if their bounding boxes share a cell,
+    so the candidates returned always include every segment that
+    GameState._intersect would report a collision with. Segments are
+    recorded by player and the index i of their first point in that
+    player's Trail.
+    """
+    def __init__(self, size, cell_size=20):
+        """
+        Initialize an empty TrailIndex.
+        Args:
+            size - a length,width tuple of the game board size
+            cell_size - the side length of each cell in px
+        """
+        self.cell_size = float(cell_size)
+        self.cols = max(1, int(math.ceil(size[0] / self.cell_size)))
+        self.rows = max(1, int(math.ceil(size[1] / self.cell_size)))
+        # cell number -> {player: [i, ...]}
+        self.cells = {}
+        # player -> set of cell numbers holding that player's segments
+        self.player_cells = {}
+
+    def _cells(self, a, b):
+        """
+        Returns the numbers of all cells covered by the bounding box of the
+        segment between points a and b. Points off the board are clamped to
+        the border cells.
+        """
+        c = self.cell_size
+        x1 = min(max(int(math.floor(min(a[0], b[0]) / c)), 0), self.cols - 1)
+        x2 = min(max(int(math.floor(max(a[0], b[0]) / c)), 0), self.cols - 1)
+        y1 = min(max(int(math.floor(min(a[1], b[1]) / c)), 0), self.rows - 1)
+        y2 = min(max(int(math.floor(max(a[1], b[1]) / c)), 0), self.rows - 1)
+        return [y * self.cols + x for y in range(y1, y2 + 1)
+                for x in range(x1, x2 + 1)]
+
+    def add(self, player, i, a, b):
+        """
+        Record segment i, between points a and b, of the given player's
+        trail.
+        """
+        if a == b:
+            return
+        owned = self.player_cells.setdefault(player, set())
+        for n in self._cells(a, b):
+            self.cells.setdefault(n, {}).setdefault(player, []).append(i)
+            owned.add(n)
+
+    def remove(self, player):
+        """
+        Forget every segment belonging to the given player.
+        """
+        for n in self.player_cells.pop(player, ()):
+            cell = self.cells[n]
+            del cell[player]
+            if not cell:
+                del self.cells[n]
+
+    def near(self, a, b):
+        """
+        Yields a (player, i) pair for each segment that shares a cell with
+        the segment between points a and b. A segment may be yielded more
+        than once.
+        """
+        for n in self._cells(a, b):
+            cell = self.cells.get(n)
+            if cell:
+                for p, segments in cell.iteritems():
+                    for i in segments:
+                        yield p, i
+
+    def clear(self):
+        """
+        Forget every segment.
+        """
+        self.cells = {}
+        self.player_cells = {}
+
+def spawn_points(size, n_players, margin=10):
+    """
+    Spread the players evenly around a loop `margin' px inside the edge
+    of the board, starting in the top left corner, each facing clockwise
+    along the loop. Four players on a square board start in the corners.
+    Returns: a list of ((x,y), Direction) tuples, one per player.
+    """
+    w = size[0] - 2 * margin
+    h = size[1] - 2 * margin
+    # the sides of the loop, clockwise from the top left corner
+    sides = [((margin, margin), Direction.east, w),
+             ((margin + w, margin), Direction.south, h),
+             ((margin + w, margin + h), Direction.west, w),
+             ((margin, margin + h), Direction.north, h)]
+    perimeter = 2 * (w + h)
+    points = []
+    for i in range(n_players):
+        dist = i * perimeter // n_players
+        for start, d, length in sides:
+            if dist < length:
+                break
+            dist -= length
+        points.append((d.extrapolate(start, dist), d))
+    return points
+
+def _pack_array(a):
+    """
+    Returns the contents of an array as a big-endian string.
+    """
+    if sys.byteorder == 'little' and a.itemsize > 1:
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+def _unpack_array(typecode, data, offset, n):
+    """
+    Reads `n' items of the given type packed by _pack_array from `data'
+    at `offset'. Returns the array and the offset just past it.
+    """
+    a = array(typecode)
+    end = offset + n * a.itemsize
+    a.fromstring(data[offset:end])
+    if sys.byteorder == 'little' and a.itemsize > 1:
+        a.byteswap()
+    return a, end
+
 class GameState(object):
     """
     Internal representation of game state
     """
-    def __init__(self, size=(600,600), speed=100):
+
+    # the clock used to advance the players, may be replaced to run the
+    # game on simulated time
+    timestamp = time.time
+
+    # if set, told about every advance, move and kill (see replay.py)
+    recorder = None
+
+    def __init__(self, size=(600,600), speed=100, tick_rate=None, n_players=4):
         """
         Initialize GameState object.
         Args:
             size - a length,width tuple of the game board size
             speed - the speed of the players in px/sec
+            tick_rate - if given, the game runs in tick mode: it advances
+                in whole ticks, `tick_rate' per second, and positions are
+                whole pixels. speed must be a multiple of tick_rate.
+            n_players - the number of players in the game
         """
-        self.players_left = [0,1,2,3]
-
-        start_pos = [(10, 10), (size[0]-10, 10),
-                     (size[0]-10, size[0]-10), (10, size[0]-10)]
+        self.players_left = range(n_players)
 
-        start_dir = [Direction.east, Direction.south,
-                     Direction.west, Direction.north]
-
-        self.state = [[{'pos': p, 'dir': d}] for p,d in
-                      zip(start_pos, start_dir)]
+        self.state = []
+        for p, d in spawn_points(size, n_players):
+            trail = Trail()
+            trail.append(p, d, 0)
+            self.state.append(trail)
 
         self.width, self.height = size
         self.speed = speed
+        self.index = TrailIndex(size)
+
+        self.tick_rate = tick_rate
+        self.tick = 0
+        self.start_time = 0
+        if tick_rate:
+            assert speed % tick_rate == 0, 'speed must be a multiple of tick_rate'
+            self.step = speed // tick_rate
 
     def start(self):
         """
         Start the game by copying the initial position of each player into
         the last slot of their state array.
         """
-        start_time = time.time()
+        self.start_time = self.timestamp()
+        self.tick = 0
+        self.index.clear()
+        start = 0 if self.tick_rate else self.start_time
         for p in self.players_left:
-            self.state[p].append(copy.copy(self.state[p][0]))
-            self.state[p][-1]['time'] = start_time
+            trail = self.state[p]
+            trail.append(trail.pos(0), trail.dir(0), start)
+
+    def now(self):
+        """
+        Returns the current game time: the tick number in tick mode, or
+        the clock time otherwise. This is the time moves are recorded at.
+        """
+        if self.tick_rate:
+            return self.tick
+        return self.timestamp()
 
     def update(self, player):
         """
@@ -176,26 +490,62 @@ class GameState(object):
         Returns:
             True if the local player should die, False otherwise
         """
-        cur_time = time.time()
-
         last_pos = None
         if player in self.players_left:
-            last_pos = self.state[player][-1]['pos']
+            last_pos = self.state[player].pos(-1)
 
-        # update positions
-        for p in self.players_left:
-            pos = self.state[p][-1]['pos']
-            d = self.state[p][-1]['dir']
-            t = self.state[p][-1]['time']
-            self.state[p][-1]['pos'] = d.extrapolate(pos, (cur_time - t) * self.speed)
-            self.state[p][-1]['time'] = cur_time
+        self.advance()
 
         # do not do collision detection if already dead
         if player not in self.players_left:
             return False
 
-        # check for local player death
-        cur_pos = self.state[player][-1]['pos']
+        return self.collides(player, last_pos)
+
+    def advance(self, when=None):
+        """
+        Move each player's position forward to the current time, or to
+        `when' if it is given. In tick mode, the game moves forward by the
+        whole ticks that have passed since the start of the game, and
+        `when' is a tick.
+        """
+        if self.tick_rate:
+            if when is None:
+                when = int((self.timestamp() - self.start_time) * self.tick_rate)
+            self.tick = max(self.tick, when)
+            for p in self.players_left:
+                trail = self.state[p]
+                t = trail.time(-1)
+                # moves stamped with a later tick wait for us to catch up
+                if t < self.tick:
+                    d = trail.dir(-1)
+                    trail.set(-1, d.extrapolate(trail.pos(-1), (self.tick - t) * self.step),
+                              d, self.tick)
+            if self.recorder:
+                self.recorder.advance(self.tick)
+            return
+
+        cur_time = self.timestamp() if when is None else when
+        for p in self.players_left:
+            trail = self.state[p]
+            d = trail.dir(-1)
+            t = trail.time(-1)
+            trail.set(-1, d.extrapolate(trail.pos(-1), (cur_time - t) * self.speed),
+                      d, cur_time)
+        if self.recorder:
+            self.recorder.advance(cur_time)
+
+    def collides(self, player, last_pos):
+        """
+        Check whether a player ran into a wall or a trail on the way from
+        `last_pos' to their current position.
+        Args:
+            player - the player number, who must still be alive
+            last_pos - the player's position before the last advance
+        Returns:
+            True if the player should die, False otherwise
+        """
+        cur_pos = self.state[player].pos(-1)
 
         # check b{ounds
         if cur_pos[0] < 0 or cur_pos[1] < 0 or \
@@ -203,20 +553,19 @@ class GameState(object):
             print 'bounds'
             return True
 
-        # check trail collision
+        # check trail collision against the committed segments near us
+        for p2, i in self.index.near(last_pos, cur_pos):
+            trail = self.state[p2]
+            if self._intersect(trail.pos(i), trail.pos(i+1), last_pos, cur_pos):
+                return True
+
+        # and against the moving head segment of every other player
         for p2 in self.players_left:
-            r = range(len(self.state[p2])-1)
-
-            # modify range for colliding with self
-            if player == p2:
-                r = range(len(self.state[p2])-2)
-
-            # test collision with each segment
-            for i in r:
-                a = self.state[p2][i]['pos']
-                b = self.state[p2][i+1]['pos']
-                if self._intersect(a, b, last_pos, cur_pos):
-                    return True
+            trail = self.state[p2]
+            if p2 == player or len(trail) < 2:
+                continue
+            if self._intersect(trail.pos(-2), trail.pos(-1), last_pos, cur_pos):
+                return True
         # don't die
         return False
 
@@ -268,11 +617,16 @@ class GameState(object):
         Update the last point in the player's history and then create a
         new last point.
         """
-        if self.state[player]:
-            self.state[player][-1]['pos'] = pos
-            self.state[player][-1]['dir'] = direction
-            self.state[player][-1]['time'] = time
-            self.state[player].append(copy.copy(self.state[player][-1]))
+        trail = self.state[player]
+        if trail:
+            trail.set(-1, pos, direction, time)
+            trail.append(pos, direction, time)
+            # the segment ending at the turn will no longer move
+            if len(trail) >= 3:
+                i = len(trail) - 3
+                self.index.add(player, i, trail.pos(i), pos)
+            if self.recorder:
+                self.recorder.move(player, pos, direction, time)
 
     def kill(self, player):
         """
@@ -280,7 +634,69 @@ class GameState(object):
         """
         if player in self.players_left:
             self.players_left.remove(player)
-            self.state[player] = []
+            self.state[player].clear()
+            self.index.remove(player)
+            if self.recorder:
+                self.recorder.kill(player)
+
+    def snapshot(self):
+        """
+        Returns the state of the game (the players left, the current tick
+        and every trail) packed into a string. The board size, speed and
+        tick rate are not included.
+        """
+        header = struct.pack('!dIH', self.start_time, self.tick,
+                             len(self.players_left))
+        parts = [header, _pack_array(array('H', self.players_left))]
+        parts.append(struct.pack('!H', len(self.state)))
+        for trail in self.state:
+            n = len(trail)
+            parts.append(struct.pack('!I', n))
+            for column in (trail.xs, trail.ys, trail.dirs, trail.times):
+                parts.append(_pack_array(column[:n]))
+        return ''.join(parts)
+
+    def restore(self, data):
+        """
+        Replace the state of the game with one packed by snapshot().
+        """
+        self.start_time, self.tick, n_left = struct.unpack_from('!dIH', data)
+        offset = struct.calcsize('!dIH')
+        players_left, offset = _unpack_array('H', data, offset, n_left)
+        self.players_left = list(players_left)
+        n_trails, = struct.unpack_from('!H', data, offset)
+        offset += 2
+        self.state = []
+        self.index.clear()
+        for p in range(n_trails):
+            n, = struct.unpack_from('!I', data, offset)
+            offset += 4
+            trail = Trail()
+            columns = []
+            for typecode in 'ddbd':
+                column, offset = _unpack_array(typecode, data, offset, n)
+                columns.append(column)
+            if n:
+                trail.xs, trail.ys, trail.dirs, trail.times = columns
+                trail.n = n
+            self.state.append(trail)
+            # every segment but the moving head is committed
+            for i in range(n - 2):
+                self.index.add(p, i, trail.pos(i), trail.pos(i+1))
+
+    def checksum(self):
+        """
+        Returns a CRC32 of the players left and every trail. In tick mode
+        two peers that applied the same moves at the same ticks have the
+        same checksum at the same tick, so it can be compared to detect
+        divergence.
+        """
+        crc = zlib.crc32(array('i', self.players_left).tostring())
+        for trail in self.state:
+            n = len(trail)
+            for column in (trail.xs, trail.ys, trail.dirs, trail.times):
+                crc = zlib.crc32(column[:n].tostring(), crc)
+        return crc & 0xffffffff
 
 def draw_dashed_line(surf, x1, y1, x2, y2, color, width=1, dash_length=2):
     dl = dash_length
@@ -318,3 +734,110 @@ def line(surf, x1, y1, x2, y2, color, dashed=False, width=1):
         draw_dashed_line(surf, x1, y1, x2, y2, color, width)
     else:
         draw_solid_line(surf, x1, y1, x2, y2, color, width)
+
+def segment_rect(x1, y1, x2, y2, width=1):
+    """
+    Returns the pygame Rect covering the line drawn between the given
+    points, padded for the line width and rounding.
+    """
+    pad = width + 1
+    return pygame.Rect(min(x1, x2) - pad, min(y1, y2) - pad,
+                       abs(x2 - x1) + 2 * pad + 1, abs(y2 - y1) + 2 * pad + 1)
+
+class TrailRenderer(object):
+    """
+    Draws the game incrementally. Committed trail segments never move, so
+    they are drawn once onto an off-screen surface. Each frame only the
+    moving head segment of each player is drawn on the display, and only
+    the rectangles that changed are pushed to the screen.
+    """
+    def __init__(self, game, display, colors, background, player):
+        """
+        Initialize a TrailRenderer.
+        Args:
+            game - the GameState to draw
+            display - the display surface
+            colors - the color of each player, indexed by player number
+            background - the background color of the field
+            player - the local player number, whose trail is dashed
+        """
+        self.game = game
+        self.display = display
+        self.colors = colors
+        self.background = background
+        self.player = player
+        self.trails = pygame.Surface(display.get_size(), 0, display)
+        self.trails.fill(background)
+        # player -> rects of the committed segments drawn on self.trails
+        self.drawn = {}
+        # rects of the head segments drawn on the display last frame
+        self.heads = []
+        self.started = False
+
+    def _draw(self, surf, p, a, b):
+        x1, y1 = int(a[0]), int(a[1])
+        x2, y2 = int(b[0]), int(b[1])
+        line(surf, x1, y1, x2, y2, self.colors[p], p == self.player)
+        return segment_rect(x1, y1, x2, y2)
+
+    def _erase(self, p):
+        """
+        Erase the committed trail of player p from the trail surface and
+        redraw the parts of the other trails that shared its pixels.
+        Returns the erased rects.
+        """
+        rects = self.drawn.pop(p)
+        redraw = set()
+        for r in rects:
+            self.trails.fill(self.background, r)
+            redraw.update(self.game.index.near((r.left, r.top),
+                                               (r.right, r.bottom)))
+        for p2, i in redraw:
+            if p2 in self.drawn and i < len(self.drawn[p2]):
+                trail = self.game.state[p2]
+                self._draw(self.trails, p2, trail.pos(i), trail.pos(i+1))
+        return rects
+
+    def render(self):
+        """
+        Draw the current frame and update the changed parts of the screen.
+        """
+        pygame.display.update(self.draw())
+
+    def draw(self):
+        """
+        Draw the current frame without updating the screen.
+        Returns: the list of rects of the display that changed.
+        """
+        restore = list(self.heads)
+        if not self.started:
+            self.started = True
+            restore = [self.display.get_rect()]
+
+        # wipe the trails of players who died since the last frame
+        for p in self.drawn.keys():
+            if p not in self.game.players_left:
+                restore.extend(self._erase(p))
+
+        # draw segments committed since the last frame
+        for p in self.game.players_left:
+            trail = self.game.state[p]
+            rects = self.drawn.setdefault(p, [])
+            for i in range(len(rects), len(trail)-2):
+                r = self._draw(self.trails, p, trail.pos(i), trail.pos(i+1))
+                rects.append(r)
+                restore.append(r)
+
+        # copy the changed trails and last frame's heads to the display
+        for r in restore:
+            self.display.blit(self.trails, r, r)
+
+        # draw the moving heads
+        self.heads = []
+        for p in self.game.players_left:
+            trail = self.game.state[p]
+            if len(trail) >= 2:
+                self.heads.append(self._draw(self.display, p,
+                                             trail.pos(-2), trail.pos(-1)))
+
+        return restore + self.heads
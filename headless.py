@@ -0,0 +1,209 @@
+"""
+headless.py
+
+Runs games without a display so the game engine and the network layers
+can be exercised on machines without pygame. Time is simulated, so each
+match runs as fast as the engine can step it. Every player in the match
+is checked for collisions locally and the local player is driven by a
+simple bot. Many matches can be run in parallel across a process pool,
+and the runner reports games/sec, frame-time statistics and the
+outcome of each match.
+
+Usage: python headless.py [MATCHES] [PROCESSES]
+"""
+
+import sys, os, time, random, multiprocessing
+
+from network_layers import RandomNoNetworkLayer
+from game_utils import GameState, Direction, Message
+from replay import ReplayWriter
+
+class SimulatedClock(object):
+    """
+    A clock that only moves when it is told to, for use as
+    GameState.timestamp.
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def tick(self, dt):
+        self.now += dt
+
+def bot_move(game, player, turn_prob=.02):
+    """
+    Returns a move message turning the player left or right with
+    probability `turn_prob', or None.
+    """
+    if player not in game.players_left or random.random() >= turn_prob:
+        return None
+    trail = game.state[player]
+    d = trail.dir(-1)
+    new_dir = Direction((d.value + random.choice([1, 3])) % 4)
+    tick = game.tick if game.tick_rate else None
+    return Message.move(player, trail.pos(-1), new_dir, tick)
+
+def run_headless(game, network, player, dt=1/60., max_frames=100000,
+                 replay=None):
+    """
+    Run a game to completion on simulated time without rendering.
+    Args:
+        game - the GameState to run
+        network - the network layer to exchange messages through
+        player - the local player number, which is driven by bot_move
+        dt - the simulated time between frames in seconds
+        max_frames - the number of frames after which the game is stopped
+        replay - if given, the file to record a replay of the game to
+    Returns:
+        A dictionary with the number of frames played, the frame times in
+        seconds, and the (frame, player) order in which players died.
+    """
+    clock = SimulatedClock()
+    game.timestamp = clock
+    game.start()
+    network.restore(game)
+    recorder = ReplayWriter(replay, game) if replay else None
+
+    frame_times = []
+    deaths = []
+    frames = 0
+    timer = time.time
+    while game.players_left and frames < max_frames:
+        start = timer()
+        clock.tick(dt)
+
+        # handle network input
+        for msg in network.get_messages():
+            if msg.mtype == Message.Type.move:
+                when = game.now() if msg.tick is None else msg.tick
+                game.move(msg.player, msg.pos, msg.direction, when)
+            elif msg.mtype == Message.Type.kill:
+                if msg.player in game.players_left:
+                    deaths.append((frames, msg.player))
+                game.kill(msg.player)
+            elif msg.mtype == Message.Type.exit and recorder:
+                recorder.exit(msg.player)
+        network.snapshot(game)
+
+        # the bot stands in for local input
+        msg = bot_move(game, player)
+        if msg:
+            network.broadcast_message(msg)
+
+        # advance everyone and check every player for collisions
+        last = dict((p, game.state[p].pos(-1)) for p in game.players_left)
+        game.advance()
+        for p in list(game.players_left):
+            if game.collides(p, last[p]):
+                deaths.append((frames, p))
+                game.kill(p)
+                network.broadcast_message(Message.kill(p))
+
+        frame_times.append(timer() - start)
+        frames += 1
+
+    network.stop()
+    if recorder:
+        recorder.close()
+    return {'frames': frames, 'frame_times': frame_times, 'deaths': deaths}
+
+def play_match(seed, max_frames=100000, tick_rate=None, n_players=4,
+               size=(600,600), replay=None):
+    """
+    Play a single match of `n_players' players on a board of the given
+    size against a RandomNoNetworkLayer with the given random seed, in
+    tick mode if `tick_rate' is given, recording a replay to the file
+    `replay' if it is given. Returns the result of run_headless
+    plus the winner (the last player to die, or the players left when the
+    game was stopped) and the wall clock time the match took.
+    """
+    random.seed(seed)
+    game = GameState(size, tick_rate=tick_rate, n_players=n_players)
+    network = RandomNoNetworkLayer(0, game)
+    start = time.time()
+    result = run_headless(game, network, 0, max_frames=max_frames,
+                          replay=replay)
+    result['elapsed'] = time.time() - start
+    if game.players_left:
+        result['winner'] = list(game.players_left)
+    elif result['deaths']:
+        result['winner'] = [result['deaths'][-1][1]]
+    else:
+        result['winner'] = []
+    return result
+
+def _quiet():
+    """Silence the debugging output of the game in worker processes."""
+    sys.stdout = open(os.devnull, 'w')
+
+def _summarize(seed):
+    """
+    Play a match in a worker process and return a summary small enough to
+    send back to the parent cheaply.
+    """
+    result = play_match(seed)
+    times = sorted(result['frame_times'])
+    return {'seed': seed,
+            'frames': result['frames'],
+            'elapsed': result['elapsed'],
+            'winner': result['winner'],
+            'deaths': result['deaths'],
+            'frame_total': sum(times),
+            'frame_max': times[-1] if times else 0,
+            'frame_p50': times[len(times) // 2] if times else 0,
+            'frame_p99': times[len(times) * 99 // 100] if times else 0}
+
+def run_matches(n_matches, processes=None, first_seed=0):
+    """
+    Play `n_matches' headless matches across a pool of `processes' worker
+    processes (one per core by default).
+    Returns: a tuple of the list of match summaries and the wall clock
+        time taken to play all of them.
+    """
+    pool = multiprocessing.Pool(processes, _quiet)
+    start = time.time()
+    try:
+        summaries = pool.map(_summarize,
+                             range(first_seed, first_seed + n_matches))
+    finally:
+        pool.close()
+        pool.join()
+    return summaries, time.time() - start
+
+def report(summaries, elapsed):
+    """
+    Print games/sec, frame-time statistics and outcomes for a set of
+    match summaries.
+    """
+    frames = sum(s['frames'] for s in summaries)
+    frame_total = sum(s['frame_total'] for s in summaries)
+    wins = {}
+    for s in summaries:
+        key = tuple(s['winner'])
+        wins[key] = wins.get(key, 0) + 1
+    p50s = sorted(s['frame_p50'] for s in summaries)
+    p99s = sorted(s['frame_p99'] for s in summaries)
+
+    print 'Matches:', len(summaries), 'in', elapsed, 'sec'
+    print 'Games/sec:', len(summaries) / elapsed
+    print 'Frames/sec:', frames / elapsed
+    print 'Mean frames per match:', float(frames) / len(summaries)
+    print 'Mean frame time (usec):', 1e6 * frame_total / frames
+    print 'Median per-match p50 frame time (usec):', 1e6 * p50s[len(p50s) // 2]
+    print 'Worst per-match p99 frame time (usec):', 1e6 * p99s[-1]
+    print 'Max frame time (usec):', 1e6 * max(s['frame_max'] for s in summaries)
+    print 'Outcomes (winner: matches):'
+    for key in sorted(wins):
+        print '   ', list(key), wins[key]
+
+if __name__ == '__main__':
+    n_matches = 1000
+    processes = None
+    if len(sys.argv) > 1:
+        n_matches = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        processes = int(sys.argv[2])
+    summaries, elapsed = run_matches(n_matches, processes)
+    report(summaries, elapsed)
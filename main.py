@@ -6,16 +6,23 @@ that starts the game, sets up the game window, sets up the networking
 layer, and runs the main game loop.
 """
 
-import sys, time
+import sys, time, argparse
 
 # Pygame is used to create the game window and render the game
 import pygame
 
 # provides the network abstraction for the game
 from network_layers import NaiveNetworkLayer as network
+from network_layers import ProcessNetworkLayer
 
 # manages the state of the game and handles updates
-from game_utils import GameState, Direction, Message, line
+from game_utils import GameState, Direction, Message, TrailRenderer, line
+
+# records games for debugging
+from replay import ReplayWriter
+
+# paces the game loop and times the phases of each frame
+from timers import FramePacer, FrameTimers
 
 # Map keyboard input to directions
 keyboard_directions = {pygame.K_w: Direction.north,
@@ -33,94 +40,183 @@ player_colors = [pygame.Color('red'),
                  pygame.Color('green'),
                  pygame.Color('yellow')]
 
+def make_player_colors(n_players):
+    """
+    Returns a list of `n_players' colors. The first four are the usual
+    player colors and the rest are spread around the color wheel.
+    """
+    colors = player_colors[:n_players]
+    extra = n_players - len(colors)
+    for i in range(extra):
+        color = pygame.Color(0, 0, 0)
+        color.hsva = (360.0 * (i + .5) / extra, 70, 100, 100)
+        colors.append(color)
+    return colors
+
 # The background color of the field
 background_color = pygame.Color('black')
 
-def run_game(game, network, display):
+def run_game(game, network, display, player=None, incremental=True,
+             replay=None, timers=None, pacer=None):
     """
     The main game loop. Waits for the network layer to signal the start of
-    the game then runs an iteration of the game loop 60 times per second.
+    the game then runs an iteration of the game loop 60 times per second,
+    or as often as `pacer', a FramePacer, says if it is given.
     The game loop polls for local input, which it submits to the network for
     verification, then it polls for input from the network layer and updates
     the game state accordingly. Finally it renders the frame. The game loop
     exits when there are no players left in the game.
+
+    Between frames the loop waits in the network layer (see
+    NetworkLayer.wait), which answers the other players as their
+    messages arrive instead of once a frame.
+
+    If `player' is None, the network layer is started here. Otherwise it
+    must already have been started and `player' is the local player.
+
+    If `incremental' is True, frames are drawn with a TrailRenderer, which
+    only redraws the parts of the screen that changed. Otherwise every
+    segment is redrawn every frame.
+
+    If `replay' is given, a replay of the game is recorded to that file
+    (see replay.py).
+
+    The phases of each frame are timed by `timers', a FrameTimers, or by
+    a new one if it is not given, and the timings are printed when the
+    game ends.
     """
 
     # wait for the game to start
-    player = network.start()
+    if player is None:
+        player = network.start()
     game.start()
+    # a network layer restarted from its log puts the game back the way
+    # it was at its last snapshot
+    network.restore(game)
+    recorder = ReplayWriter(replay, game) if replay else None
+    colors = make_player_colors(len(game.state))
+    renderer = None
+    if incremental:
+        renderer = TrailRenderer(game, display, colors,
+                                 background_color, player)
+
+    if timers is None:
+        timers = FrameTimers()
+    if pacer is None:
+        pacer = FramePacer()
+    pacer.reset()
+
+    # messages the network layer delivered while waiting for a frame
+    early = []
+
+    def serve_network(seconds):
+        """
+        Wait out `seconds' in the network layer, so that messages are
+        answered as they arrive rather than at the next frame; any it
+        delivers meanwhile are kept for the next frame.
+        """
+        end = time.time() + seconds
+        left = seconds
+        while left > 0:
+            network.wait(left)
+            early.extend(network.get_messages())
+            left = end - time.time()
 
     # main game loop
-    run_time_max = 0
-    run_time_min = 1
-    run_time_total = 0
-    frames = 0
     running = True
     send_exit = True
     while running:
         start = time.time()
+        timers.start_frame()
         # handle network input
-        for msg in network.get_messages():
+        messages = early + list(network.get_messages())
+        del early[:]
+        for msg in messages:
             print "Got message", msg.mtype, "in ", player
             if msg.mtype == Message.Type.move:
-                game.move(msg.player, msg.pos, msg.direction, start)
+                when = start
+                if game.tick_rate:
+                    when = game.tick if msg.tick is None else msg.tick
+                game.move(msg.player, msg.pos, msg.direction, when)
             elif msg.mtype == Message.Type.kill:
                 game.kill(msg.player)
             elif msg.mtype == Message.Type.exit:
+                if recorder:
+                    recorder.exit(msg.player)
                 running = False
+        network.snapshot(game)
+        timers.mark('network')
 
         # handle local events
-        for event in pygame.event.get():
+        events = pygame.event.get()
+        for event in events:
             if event.type == pygame.QUIT:
                 network.broadcast_message(Message.kill(player))
+                network.stop()
+                if recorder:
+                    recorder.close()
+                timers.dump()
                 sys.exit(0)
             elif event.type == pygame.KEYDOWN and player in game.players_left:
                 key = event.key
                 d = keyboard_directions.get(key)
-                if d == None or d == game.state[player][-1]['dir']:
+                if d == None or d == game.state[player].dir(-1):
                     continue
-                pos = game.state[player][-1]['pos']
-                msg = Message.move(player, pos, Direction(d))
+                pos = game.state[player].pos(-1)
+                tick = game.tick if game.tick_rate else None
+                msg = Message.move(player, pos, Direction(d), tick)
                 network.broadcast_message(msg)
+        timers.mark('events')
 
         if game.update(player):
             game.kill(player)
             network.broadcast_message(Message.kill(player))
+        timers.mark('update')
 
         # rendering
-        display.fill(background_color)
-        for p in game.players_left:
-            for i in range(len(game.state[p])-1):
-                x1, y1 = game.state[p][i]['pos']
-                x2, y2 = game.state[p][i+1]['pos']
-                line(display,
-                     int(x1), int(y1),
-                     int(x2), int(y2),
-                     player_colors[p], p == player)
-        pygame.display.flip()
+        if renderer:
+            dirty = renderer.draw()
+            timers.mark('render')
+            pygame.display.update(dirty)
+        else:
+            display.fill(background_color)
+            for p in game.players_left:
+                trail = game.state[p]
+                xs, ys = trail.xs, trail.ys
+                for i in range(len(trail)-1):
+                    line(display,
+                         int(xs[i]), int(ys[i]),
+                         int(xs[i+1]), int(ys[i+1]),
+                         colors[p], p == player)
+            timers.mark('render')
+            pygame.display.flip()
+        timers.mark('flip')
 
         # exiting
         if len(game.players_left) == 0 and send_exit:
             send_exit = False
             network.broadcast_message(Message.exit(player))
+        network.flush()
+        timers.end_frame()
 
-        # try to maintain 60 fps
-        run_time = time.time() - start
-        if run_time < run_time_min:
-            run_time_min = run_time
-        if run_time > run_time_max:
-            run_time_max = run_time
-        run_time_total += run_time
-        frames += 1
-        sleep_time = max(1 / 60 - run_time, 0)
-        time.sleep(sleep_time)
+        # wait for the next frame, slowing down if nothing is happening
+        pacer.wait(bool(messages or events), serve_network)
 
     print("GAME OVER")
     network.stop()
+    if recorder:
+        recorder.close()
 
-    print 'Effective frame rate:', frames/run_time_total
-    print 'Max frame rate:', 1/run_time_min
-    print 'Min frame rate:', 1/run_time_max
+    stats = pacer.stats()
+    print 'Effective frame rate:', stats['rate']
+    print 'Max frame rate:', stats['max_rate']
+    print 'Min frame rate:', stats['min_rate']
+    print 'Busy:', stats['busy']
+    print 'Idle frames:', stats['idle_frames']
+    stats = network.send_stats()
+    print 'Send calls per frame:', stats['sends_per_flush']
+    print 'Bytes sent per frame:', stats['bytes_per_flush']
+    timers.dump()
     sys.exit()
 
 if __name__ == '__main__':
@@ -128,27 +224,57 @@ if __name__ == '__main__':
     Initialize the components of the game and start the game loop.
     First check that the user is beginning the game properly.
 
-    Currently, the first player to start the game has to input 1
-    as the player number and the IP and PORT to set up the game
-    on. All other players connect with that same IP and PORT, and
-    use player numbers 2-3. No more than 4 players in a game.
+    The first player to start the game hosts it, choosing the number
+    of players and the size of the board, and the IP to connect to is
+    printed. All other players connect to that IP and are told the
+    number of players and board size by the host.
 
-    Usage: python main.py [IP]
+    Usage: python main.py [-n PLAYERS] [-s WIDTH HEIGHT] [-r FILE]
+                          [-t SECONDS] [-f FPS] [--idle-fps FPS]
+                          [--tick-rate TICKS] [-p] [IP]
 
     (If IP not given, it is assumed you are setting up the connections)
     """
-    # set up game display
-    pygame.init()
-    size = (600,600)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('host', nargs='?', default=None)
+    parser.add_argument('-n', '--players', type=int, default=4)
+    parser.add_argument('-s', '--size', type=int, nargs=2, default=[600, 600])
+    parser.add_argument('-r', '--replay', default=None,
+                        help='record a replay of the game to this file')
+    parser.add_argument('-t', '--timers', type=float, default=None,
+                        help='print frame phase timings this often')
+    parser.add_argument('-f', '--fps', type=int, default=60,
+                        help='the target frame rate')
+    parser.add_argument('--idle-fps', type=int, default=30,
+                        help='the frame rate when nothing is happening '
+                        '(0 to always run at the target rate)')
+    parser.add_argument('--tick-rate', type=int, default=None,
+                        help='run the game in whole ticks, this many a '
+                        'second (a divisor of 100); every player must '
+                        'use the same rate')
+    parser.add_argument('-p', '--process', action='store_true',
+                        help='run the network layer in its own process')
+    args = parser.parse_args()
     speed = 100
-    game = GameState(size,speed)
-    display = pygame.display.set_mode(size)
+    if args.tick_rate is not None and \
+       (args.tick_rate <= 0 or speed % args.tick_rate):
+        parser.error('the tick rate must divide the speed, %d' % speed)
 
-    # ensure proper usage and parse user input
-    if len(sys.argv) > 1:
-        # conect to given host
-        network = network(sys.argv[1])
+    # set up the network, which decides the players and the board
+    if args.process:
+        network = ProcessNetworkLayer(network, args.host, args.players,
+                                      tuple(args.size))
     else:
-        network = network()
+        network = network(args.host, args.players, tuple(args.size))
+    player = network.start()
+
+    # set up game display
+    pygame.init()
+    size = network.board_size
+    game = GameState(size,speed,args.tick_rate,network.n_players)
+    display = pygame.display.set_mode(size)
 
-    run_game(game, network, display)
+    timers = FrameTimers(dump_every=args.timers)
+    pacer = FramePacer(args.fps, args.idle_fps)
+    run_game(game, network, display, player, replay=args.replay,
+             timers=timers, pacer=pacer)
@@ -5,20 +5,22 @@ This has the main NetworkLayer class. This is inherited by the
 RandomNoNetworkLayer, which was used for development of the game, the
 NaiveNetworkLayer, which is the network layer that has no agreement
 algorithm, and PartTimeNetworkLayer, which is the network layer that
-uses Paxos for agreement. The utilities that this file uses are
+uses Paxos for agreement. ProcessNetworkLayer runs either of the last
+two in a separate process. The utilities that this file uses are
 defined in player_pb2, paxosmsg_pb2, and network_utils (the first two
 are auto- generated by the protocol buffer package--the important part
 is the protobuf structure that creates them, as defined in the .proto
 files).
 """
 
-import time, random
+import time, random, multiprocessing, collections
 import socket as sock
 import player_pb2 as pb
 import paxosmsg_pb2 as pxb
-from select import select
-import cPickle
 import time
+import paxos.functional
+from paxos.durable import DurableLog
+from paxos.essential import ProposalID
 
 from game_utils import GameState, Direction, Message
 
@@ -34,6 +36,17 @@ class NetworkLayer(object):
     be subclassed to be used.
     """
 
+    # the Poller watching the sockets, set up in _connect
+    poller = None
+    socks = None
+
+    # counts of flushes, send calls, bytes sent and messages broadcast
+    send_counts = None
+
+    # the protocol version agreed on in _connect, which decides the wire
+    # format of game messages
+    proto_version = Message.PROTOBUF
+
     def broadcast_message(self, msg):
         """
         Broadcast a message to other players.
@@ -54,6 +67,87 @@ class NetworkLayer(object):
         """
         return []
 
+    def flush(self):
+        """
+        Send the messages queued for each player. Called once per frame.
+        """
+        if not self.socks:
+            return
+        counts = self.send_counts
+        counts['flushes'] += 1
+        for i, s in enumerate(self.socks):
+            if s and s.queued():
+                try:
+                    counts['bytes'] += s.flush()
+                except sock.error:
+                    print 'lost connection to', i
+                    self._drop(i)
+                counts['sends'] += 1
+
+    def send_stats(self):
+        """
+        Returns a dictionary of the number of flushes, send calls, bytes
+        sent and messages broadcast, the send calls and bytes per flush,
+        the number of sends refused because a queue was full, and the
+        number of bytes queued now.
+        """
+        counts = dict(self.send_counts or
+                      {'flushes': 0, 'sends': 0, 'bytes': 0, 'messages': 0})
+        flushes = counts['flushes'] or 1
+        counts['sends_per_flush'] = float(counts['sends']) / flushes
+        counts['bytes_per_flush'] = float(counts['bytes']) / flushes
+        socks = [s for s in self.socks or [] if s]
+        counts['refused'] = sum(s.refused for s in socks)
+        counts['queued'] = sum(s.queued() for s in socks)
+        return counts
+
+    def queue_depths(self):
+        """
+        Returns, for each player, the bytes queued to send to them in the
+        URGENT, NORMAL and BULK lanes, or None if they are disconnected.
+        """
+        return [list(s.depths) if s else None for s in self.socks or []]
+
+    def congested(self):
+        """
+        Returns True if a player's queue is too full to take any more
+        normal or bulk messages.
+        """
+        return any(s and not s.has_room() for s in self.socks or [])
+
+    def snapshot(self, game):
+        """
+        Called by the game loop once it has applied the messages of a
+        frame, so that a layer that logs the game can save a snapshot of
+        it. Does nothing by default.
+        Args:
+            game - the GameState the delivered messages were applied to
+        Return:
+            True if a snapshot was taken, False otherwise.
+        """
+        return False
+
+    def restore(self, game):
+        """
+        Called by the game loop once the game has started, so that a layer
+        restarted from a log can put the game back the way it was at the
+        last snapshot. The messages delivered after the snapshot are
+        delivered again by get_messages. Does nothing by default.
+        Return:
+            True if the game was restored, False otherwise.
+        """
+        return False
+
+    def wait(self, timeout):
+        """
+        Block until there may be messages to get or `timeout' seconds have
+        passed.
+        """
+        if self.poller:
+            self.poller.ready(timeout)
+        else:
+            time.sleep(timeout)
+
     def start(self):
         """
         Perform setup and block until the game is supposed to begin.
@@ -63,9 +157,57 @@ class NetworkLayer(object):
 
     def stop(self):
         """
-        Perform teardown
+        Perform teardown, sending any messages still queued
         """
-        pass
+        self.flush()
+
+    def _connect(self):
+        """
+        Set up the connections to the other players: use the given
+        connection if there is one, otherwise join the game hosted at
+        self.HOST, or host a game if there is no HOST.
+        """
+        if self.connection:
+            (self.player, self.socks, self.addrs, self.board_size,
+             self.proto_version) = self.connection
+        elif (self.HOST):
+            (self.player, self.socks, self.addrs, self.board_size,
+             self.proto_version) = \
+                establish_tcp_connections(self.HOST)
+        else:
+            (self.player, self.socks, self.addrs, self.board_size,
+             self.proto_version) = \
+                coordinate_tcp_connections(self.n_players, self.board_size)
+        self.n_players = len(self.socks)
+        self.poller = Poller(self.socks)
+        self.send_counts = {'flushes': 0, 'sends': 0, 'bytes': 0,
+                            'messages': 0}
+
+    def _drop(self, i):
+        """
+        Forget the connection to player i.
+        """
+        if self.socks[i]:
+            self.poller.unregister(self.socks[i])
+            self.socks[i] = None
+
+    def _read_all(self, s, i):
+        """
+        Returns the list of messages waiting on socket s, the connection to
+        player i, and drops the connection if the player has hung up.
+        """
+        msgs = []
+        try:
+            data = s.recv(1024)
+            while data is not None:
+                msgs.append(data)
+                data = s.recv(1024)
+        except IOError:
+            return msgs
+        # recv only returns None once the connection is closed
+        print 'lost connection to', i
+        self._drop(i)
+        return msgs
 
 class RandomNoNetworkLayer(NetworkLayer):
     """
@@ -105,8 +247,9 @@ class RandomNoNetworkLayer(NetworkLayer):
                     p = possible_players[random.randint(0,len(possible_players)-1)]
                 new_dir = Direction(random.randint(0,2))
                 new_t = time.time()
-                new_pos = self.game.state[p][-1]['pos']
-                yield Message.move(p, new_pos, new_dir)
+                new_pos = self.game.state[p].pos(-1)
+                new_tick = self.game.tick if self.game.tick_rate else None
+                yield Message.move(p, new_pos, new_dir, new_tick)
 
     def start(self):
         """Start the game immediately"""
@@ -117,63 +260,238 @@ class NaiveNetworkLayer(NetworkLayer):
     A NetworkLayer implementation that uses simple message passing with
     no agreement algorithm for game state. Should show liveness but might
     show inconsistencies.
+
+    Nothing else would resend a move a player's full queue refused, so
+    it waits in a backlog for that player and is queued, in order, once
+    flushing makes room; the layer counts as congested meanwhile.
     """
 
-    def __init__(self, HOST=None):
+    def __init__(self, HOST=None, n_players=N_PLAYERS, board_size=BOARD_SIZE,
+                 connection=None):
+        """
+        Args:
+            HOST - the address of the game to join, or None to host a game
+            n_players - the number of players in a hosted game
+            board_size - the (width, height) of the board of a hosted game
+            connection - an already established connection tuple, as
+                returned by establish_tcp_connections, to use instead
+        """
         self.HOST = HOST
+        self.n_players = n_players
+        self.board_size = board_size
+        self.connection = connection
         # These get initialized in start
         self.player = None
         self.socks = None
         self.addrs = None
+        # the moves each player's queue had no room for yet
+        self.backlog = None
 
     def broadcast_message(self, msg):
         """
-        Send messages to all of the players
+        Queue a message for all of the players. Kills and exits go ahead
+        of moves. A move a player's queue is too full to take waits in
+        that player's backlog, behind any already waiting there.
+        Returns False if a player's queue was too full to take the
+        message now.
         """
-        network_msg = msg.serialize()
-        for i, s in enumerate(self.socks):
+        network_msg = msg.serialize(self.proto_version)
+        lane = NORMAL if msg.mtype == Message.Type.move else URGENT
+        queued = True
+        for s, backlog in zip(self.socks, self.backlog):
+            if s and (lane == URGENT or not backlog) and \
+               s.send(network_msg, lane):
+                continue
             if s:
-                try:
-                    s.send(network_msg)
-                except sock.error:
-                    print 'lost connection to', i
-                    self.socks[i] = None
-        return True
+                backlog.append((network_msg, lane))
+                queued = False
+        self.send_counts['messages'] += 1
+        return queued
+
+    def flush(self):
+        """
+        Queue what the players' backlogs have room for, then send.
+        """
+        for i, backlog in enumerate(self.backlog or []):
+            s = self.socks[i]
+            if not s:
+                backlog.clear()
+            while backlog and s.send(*backlog[0]):
+                backlog.popleft()
+        NetworkLayer.flush(self)
+
+    def congested(self):
+        """
+        Returns True if a player's queue is too full to take any more
+        normal or bulk messages, or moves wait in a backlog.
+        """
+        return any(self.backlog or []) or NetworkLayer.congested(self)
 
     def get_messages(self):
         """
-        Get messages from all of the players
+        Get messages from the players that have sent any
         """
         msgs = []
-        net_msg = pb.GameMsg()
-        for s in self.socks:
-            if s:
-                try:
-                    data = s.recv(1024)
-                    if data:
-                        msgs.append(Message.deserialize(data))
-                except IOError:
-                    continue
+        for s in self.poller.ready():
+            for data in self._read_all(s, self.socks.index(s)):
+                msgs.append(Message.deserialize(data))
+        self.flush()
         return msgs
 
     def start(self):
         """
         Start up the TCP connections between all of the players for messaging. This is
         handled through the network util functions. We return the player number of the
-        player who we set up. 4 players must join to continue.
+        player who we set up. All players must join to continue.
         """
-        if (self.HOST):
-            self.player, self.socks, self.addrs = establish_tcp_connections(self.HOST)
-        else:
-            self.player, self.socks, self.addrs = coordinate_tcp_connections()
+        self._connect()
+        self.backlog = [collections.deque() for s in self.socks]
         return self.player
 
+def paxos_msg(mtype, proposal_id=None, previous_id=None, value=None):
+    """
+    Returns a new Paxos message.
+    Args:
+        mtype - the pxb message type
+        proposal_id - the ProposalID the message is about, if any
+        previous_id - the previously accepted or promised ProposalID
+        value - the sequence of serialized game messages, or None
+    """
+    msg = pxb.msg()
+    msg.type = mtype
+    if proposal_id:
+        msg.proposal_number, msg.proposal_uid = proposal_id
+    if previous_id:
+        msg.previous_number, msg.previous_uid = previous_id
+    if value is not None:
+        msg.has_value = True
+        msg.values.extend(value)
+    return msg
+
+def paxos_ids(msg):
+    """
+    Returns the proposal id and previous id of a Paxos message as
+    ProposalIDs, or None for those it does not have.
+    """
+    proposal_id = previous_id = None
+    if msg.HasField('proposal_number'):
+        proposal_id = ProposalID(msg.proposal_number, msg.proposal_uid)
+    if msg.HasField('previous_number'):
+        previous_id = ProposalID(msg.previous_number, msg.previous_uid)
+    return proposal_id, previous_id
+
+def paxos_value(msg):
+    """
+    Returns the value of a Paxos message as a tuple of serialized game
+    messages, or None if it has none.
+    """
+    if not msg.has_value:
+        return None
+    return tuple(msg.values)
+
+# Paxos messages that are not tied to the instance they were sent in:
+# requests can be proposed in any instance, heartbeats and accept nacks
+# are about the leader, whose proposal id covers every instance, and
+# catch-up messages say themselves which instances they are about
+INSTANCE_FREE = (pxb.REQUEST, pxb.HEARTBEAT, pxb.NACK_ACCEPT,
+                 pxb.CATCHUP, pxb.VALUES, pxb.SNAPSHOT)
+
+# messages sent with the sender's current instance, which tell how far
+# along the sender is
+POSITIONAL = (pxb.REQUEST, pxb.HEARTBEAT, pxb.CATCHUP)
+
+# the default number of Paxos instances a leader may have open at once
+WINDOW = 8
+
+# the default most moves in a batch, and longest a move may wait in
+# seconds for others to join its batch
+BATCH_SIZE = 64
+BATCH_DELAY = .005
+
+# the default number of instances between snapshots of the game
+SNAPSHOT_EVERY = 256
+
+# the kinds of records in the durable log: the promise and accept state
+# of an instance, the resolved value of an instance, and a snapshot of
+# the game taken before an instance, which starts a compacted log
+LOG_ACCEPTOR, LOG_DECIDED, LOG_SNAPSHOT = range(1, 4)
+
+# the default number of resolved values kept for players that fall
+# behind, besides those since the last snapshot of the game
+HISTORY = 1024
+
+# how long in seconds the current instance may stay unresolved while
+# another player is past it before asking for the values missed, the
+# most instances whose values go in one catch-up message, and the most
+# catch-up messages queued for a player per frame
+CATCHUP_AFTER = .25
+CATCHUP_CHUNK = 32
+CATCHUP_PER_FRAME = 4
+
 class PartTimeNetworkLayer(NetworkLayer):
     """
     A NetworkLayer implementation that uses Paxos }:-) for consistency with stable leaders and heartbeats.
+
+    Each batch of moves is agreed on in its own Paxos instance. In
+    Multi-Paxos mode (the default) a leader's successful prepare covers
+    every later instance for as long as it stays leader: acceptors keep
+    their promise from one instance to the next, and the leader sends
+    each new batch straight to the accept round.
+
+    The leader does not wait for one instance to be resolved before
+    proposing in the next: up to `window' instances can be open at once,
+    each with its own node. Resolved values are delivered strictly in
+    instance order.
     """
-    def __init__(self, HOST=None):
+
+    # messages for instances this far ahead of the current one are held
+    # back until it catches up
+    max_open = 64
+
+    def __init__(self, HOST=None, n_players=N_PLAYERS, board_size=BOARD_SIZE,
+                 connection=None, multi_paxos=True, window=WINDOW,
+                 batch_size=BATCH_SIZE, batch_delay=BATCH_DELAY,
+                 durable_dir=None, snapshot_every=SNAPSHOT_EVERY,
+                 history=HISTORY):
+        """
+        Args:
+            HOST - the address of the game to join, or None to host a game
+            n_players - the number of players in a hosted game
+            board_size - the (width, height) of the board of a hosted game
+            connection - an already established connection tuple, as
+                returned by establish_tcp_connections, to use instead
+            multi_paxos - whether leadership carries over between
+                instances, or every instance starts with a prepare round
+            window - how many instances the leader may have open at once
+            batch_size - the most moves proposed in one instance
+            batch_delay - the longest a move may wait in the leader's
+                outbox for others to be proposed with it, in seconds; it
+                only waits while moves arrive fast enough to fill a batch
+                in that time
+            durable_dir - a directory of this game's own to log promises
+                and accepts in before they are sent, so that they are
+                kept if the player crashes, or None to keep them only in
+                memory. The resolved values are logged too, so that a
+                restarted player can replay them.
+            snapshot_every - how many instances apart to take a
+                snapshot of the game, for players that fall too far
+                behind, and with a durable_dir to save it and drop the
+                log records from before it
+            history - how many of the latest resolved values to keep
+                for players that fall behind, besides those since the
+                last snapshot
+        """
         self.HOST = HOST
+        self.n_players = n_players
+        self.board_size = board_size
+        self.connection = connection
+        self.multi_paxos = multi_paxos
+        self.window = window
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.durable_dir = durable_dir
+        self.snapshot_every = snapshot_every
+        self.history_size = history
         # These get initialized in start
         self.player = None
         self.socks = None
@@ -183,34 +501,43 @@ class PartTimeNetworkLayer(NetworkLayer):
         """
         Send messages to all of the players
         """
-        message_dict[(msg.pos, msg.direction)] = time.time()
-        self.outbox.append(msg.serialize())
+        data = msg.serialize(self.proto_version)
+        # keyed by the bytes proposed, so that resolving an instance does
+        # not have to decode its values to find them
+        message_dict[data] = time.time()
+        self.outbox.append(data)
+        if msg.mtype != Message.Type.move:
+            self.urgent = True
+        return True
 
-    def _broadcast_message(self, msg):
+    def _broadcast_message(self, msg, lane=NORMAL, instance=None):
         """
-        Put msg over all of the sockets
+        Queue msg for all of the sockets, as a message of the given
+        instance (the current one by default)
+        Returns: False if a socket's queue was too full to take it
         """
-        for i, s in enumerate(self.socks):
+        msg.from_uid = self.player
+        msg.instance = self.instance if instance is None else instance
+        data = msg.SerializeToString()
+        queued = True
+        for s in self.socks:
             if s:
-                try:
-                    msg.from_uid = self.node.node_uid
-                    msg.instance = self.instance
-                    s.send(msg.SerializeToString())
-                except sock.error:
-                    print 'lost connection to', i
-                    self.socks[i] = None
-        return True
+                queued = s.send(data, lane) and queued
+        self.send_counts['messages'] += 1
+        return queued
 
-    def _send_message(self, to, msg):
+    def _send_message(self, to, msg, lane=NORMAL, instance=None):
         """
-        Put msg to socket belonging to UID to
+        Put msg to socket belonging to UID to, as a message of the given
+        instance (the current one by default)
+        Returns: False if the socket's queue was too full to take it
         """
-        try:
-            msg.from_uid = self.node.node_uid
-            msg.instance = self.instance
-            self.socks[to].send(msg.SerializeToString())
-        except sock.error:
-            print 'lost connection'
+        if not self.socks[to]:
+            return False
+        msg.from_uid = self.player
+        msg.instance = self.instance if instance is None else instance
+        self.send_counts['messages'] += 1
+        return self.socks[to].send(msg.SerializeToString(), lane)
 
 
     def get_messages(self):
@@ -218,133 +545,524 @@ class PartTimeNetworkLayer(NetworkLayer):
         Get accepted messages from all of the players
         """
         self.do_paxos()
+        self.flush()
         inbox = self.inbox
         self.inbox = []
         return map(Message.deserialize, inbox)
 
     def _get_messages(self):
         """
-        Read from all of the sockets
+        Read from the sockets that have data. Messages for instances too
+        far ahead of the current one are held back until it catches up.
         """
+        received, self.held = self.held, []
+        for s in self.poller.ready():
+            if s is self.persister:
+                s.clear()
+                continue
+            for data in self._read_all(s, self.socks.index(s)):
+                msg = pxb.msg()
+                msg.ParseFromString(data)
+                received.append((s, msg))
+
         msgs = []
-        for s in self.socks:
-            if s:
-                try:
-                    data = s.recv(1024)
-                    while data:
-                        msg = pxb.msg()
-                        msg.ParseFromString(data)
-                        if msg.instance > self.instance:
-                            print "OLD"
-                        msgs.append((s,msg))
-                        data = s.recv(1024)
-                except IOError:
+        for s, msg in received:
+            if msg.type in POSITIONAL or \
+               msg.instance >= self.instance + self.max_open:
+                # the sender is at least this far along
+                if msg.instance > self.peer_instance.get(msg.from_uid, 0):
+                    self.peer_instance[msg.from_uid] = msg.instance
+            if msg.type not in INSTANCE_FREE:
+                # votes from an instance we have finished would be
+                # counted against this one
+                if msg.instance < self.instance:
                     continue
+                if msg.instance >= self.instance + self.max_open:
+                    self.held.append((s, msg))
+                    continue
+            msgs.append((s,msg))
         return msgs
 
+    def _node(self, instance, old=None):
+        """
+        Returns the Paxos node of an open instance, creating it if needed
+        with the leadership state of `old', the current node by default.
+        """
+        node = self.nodes.get(instance)
+        if node is None:
+            old = old or self.node
+            node = paxos.functional.HeartbeatNode(self.messenger(instance), self.player, self.quorum_size, old.leader_uid)
+            node.next_hb = time.time()
+            if instance in self.restored:
+                node.recover(*self.restored.pop(instance))
+            if self.multi_paxos:
+                self._inherit(node, old)
+            self.nodes[instance] = node
+        return node
+
+    def _inherit(self, node, old):
+        """
+        Give a node the leadership state of the node of an earlier
+        instance. A leader's promises are for every later instance, so it
+        keeps the proposal id it was given for as long as it leads.
+        """
+        node.next_proposal_number = max(node.next_proposal_number, old.next_proposal_number)
+        node.leader = old.leader
+        node.proposal_id = old.proposal_id
+        node.leader_uid = old.leader_uid
+        node.leader_proposal_id = old.leader_proposal_id
+        node._tlast_hb = old._tlast_hb
+        node.next_hb = getattr(old, 'next_hb', node.next_hb)
+
+    def _leading(self):
+        """
+        Returns True if this node should propose rather than forward
+        requests to the leader. Classic Paxos leaders run their own
+        prepare round for every instance, so they lead for that purpose
+        while it is in flight.
+        """
+        if self.node.leader:
+            return True
+        return not self.multi_paxos and self.node.leader_uid == self.player
+
+    def _propose(self, instance):
+        """
+        Propose a value in an open instance: a value a promise reported
+        as accepted there under an earlier leader, or otherwise the
+        messages in the outbox. With Multi-Paxos, leadership won in an
+        earlier instance lets this go straight to the accept round.
+        """
+        node = self._node(instance)
+        if node.proposed_value is not None:
+            # already proposing a value adopted in the prepare round
+            self.recovered.pop(instance, None)
+            return
+        if instance in self.recovered:
+            value = self.recovered.pop(instance)[1]
+        else:
+            value = self.outbox.take()
+            self.proposed[instance] = value
+        if self.multi_paxos:
+            node.set_proposal(value)
+        else:
+            node.proposed_value = value
+            node.prepare()
+
+    def _deliver(self):
+        """
+        Deliver the values of resolved instances in instance order, and
+        move the current instance past them. Nothing is delivered while a
+        snapshot waits to be restored into the game, since the values
+        after it have to be applied on top of it.
+        """
+        if self.snapshot_data is not None:
+            return
+        logged = []
+        if self.instance in self.decided:
+            self.instance_since = time.time()
+        while self.instance in self.decided:
+            value = self.decided.pop(self.instance)
+            self.inbox.extend(value)
+            self.history[self.instance] = value
+            if self.instance > self.logged:
+                logged.append((LOG_DECIDED, self.instance, value))
+            old = self.nodes.pop(self.instance)
+            if old.persistance_required:
+                # a promise holds for every later instance too, so its
+                # reply still waits for the disk (see _persist)
+                if self.persister is None:
+                    old.persisted()
+                else:
+                    self.finished[self.instance] = old
+            self.recovered.pop(self.instance, None)
+            # if another proposal won the instance ours has to go again
+            mine = self.proposed.pop(self.instance, None)
+            if mine is not None and mine != value:
+                self.outbox.requeue(mine)
+            self.instance += 1
+            if self.instance in self.nodes:
+                self.node = self.nodes[self.instance]
+                if self.multi_paxos:
+                    self._inherit(self.node, old)
+            else:
+                self.node = self._node(self.instance, old)
+        self.next_instance = max(self.next_instance, self.instance)
+        if logged and self.persister is not None:
+            # nothing waits for these to be on the disk
+            self.persister.submit(logged)
+            self.logged = self.instance - 1
+        self._prune_history()
+
+    def _prune_history(self):
+        """
+        Forget the resolved values that are neither among the latest
+        `history' nor after the last snapshot of the game.
+        """
+        floor = self.instance - self.history_size
+        if self.game_snapshot is not None:
+            floor = min(floor, self.game_snapshot[0])
+        while self.history_start < floor:
+            self.history.pop(self.history_start, None)
+            self.history_start += 1
+
+    def _catch_up(self):
+        """
+        Ask the player furthest ahead for the values resolved since the
+        current instance, if it has stayed unresolved for a while although
+        that player is past it, or messages are being held back because
+        they are too far ahead.
+        """
+        if not self.peer_instance:
+            return
+        uid = max(self.peer_instance, key=self.peer_instance.get)
+        if self.peer_instance[uid] <= self.instance:
+            return
+        now = time.time()
+        if now - self.catchup_sent < self.catchup_after:
+            return
+        if now - self.instance_since < self.catchup_after and not self.held:
+            return
+        msg = pxb.msg()
+        msg.type = pxb.CATCHUP
+        msg.takes_snapshot = self.takes_snapshot
+        self._send_message(uid, msg, BULK)
+        self.catchup_sent = now
+        self.catchups += 1
+
+    def _serve(self, to, start, takes_snapshot):
+        """
+        Start sending a player that fell behind the values resolved from
+        instance `start' on, or if they are no longer kept and the player
+        can restore one, the last snapshot of the game and the values
+        after it.
+        """
+        if start >= self.instance:
+            return
+        if start < self.history_start:
+            if not takes_snapshot or self.game_snapshot is None:
+                print self.player, "can't catch up player", to, "from", start
+                return
+            instance, data = self.game_snapshot
+            msg = pxb.msg()
+            msg.type = pxb.SNAPSHOT
+            msg.snapshot = data
+            self._send_message(to, msg, BULK, instance)
+            start = instance
+        self.serving[to] = start
+
+    def _send_values(self):
+        """
+        Queue the next few runs of resolved values for each player being
+        caught up, as long as their queues have room, so that a long
+        catch-up is spread over frames rather than holding up this one.
+        """
+        for to, start in self.serving.items():
+            s = self.socks[to]
+            sent = 0
+            while s and start < self.instance and sent < CATCHUP_PER_FRAME \
+                  and start >= self.history_start and s.has_room():
+                end = min(start + CATCHUP_CHUNK, self.instance)
+                msg = pxb.msg()
+                msg.type = pxb.VALUES
+                for i in range(start, end):
+                    value = self.history[i]
+                    msg.counts.append(len(value))
+                    msg.values.extend(value)
+                if not self._send_message(to, msg, BULK, start):
+                    break
+                start = end
+                sent += 1
+                self.served += 1
+            if not s or start >= self.instance or start < self.history_start:
+                del self.serving[to]
+            else:
+                self.serving[to] = start
+
+    def _receive_values(self, msg):
+        """
+        Take the values of a run of instances sent to catch us up.
+        """
+        instance = msg.instance
+        i = 0
+        for count in msg.counts:
+            if instance >= self.instance and instance not in self.decided:
+                self.decided[instance] = tuple(msg.values[i:i + count])
+            i += count
+            instance += 1
+
+    def _receive_snapshot(self, msg):
+        """
+        Skip to the instance a snapshot of the game sent to catch us up was
+        taken before. The game is restored from it by the next call to
+        snapshot, and the values after it are delivered after that.
+        """
+        instance = msg.instance
+        if instance <= self.instance or not self.takes_snapshot:
+            return
+        old = self.node
+        # everything before the snapshot is in it; whether moves we
+        # proposed there made it in can no longer be told
+        for pending in (self.nodes, self.decided, self.proposed,
+                        self.recovered, self.persisting, self.finished):
+            for i in [i for i in pending if i < instance]:
+                del pending[i]
+        self.instance = instance
+        self.node = self._node(instance, old)
+        self.next_instance = max(self.next_instance, instance)
+        self.inbox = []
+        self.snapshot_data = msg.snapshot
+        self.instance_since = time.time()
+        self.transfers += 1
+
+    def _persist(self):
+        """
+        Send the promises and accepts of nodes whose state is on the disk,
+        and hand the persister the state of nodes with replies waiting on
+        it, including those of instances resolved since. Without a
+        persister replies are sent right away.
+        """
+        if self.persister is None:
+            for node in self.nodes.values():
+                if node.persistance_required:
+                    node.persisted()
+            return
+        flushed = self.persister.flushed()
+        waiting = []
+        records = []
+        for instance, node in self.nodes.items() + self.finished.items():
+            if not node.persistance_required:
+                continue
+            state = (node.promised_id, node.accepted_id, node.accepted_value)
+            ticket, saved = self.persisting.get(instance, (None, None))
+            if saved != state:
+                # the state changed since it was last handed over
+                waiting.append(instance)
+                records.append((LOG_ACCEPTOR, instance) + state)
+                self.persisting[instance] = (None, state)
+            elif ticket <= flushed:
+                node.persisted()
+                del self.persisting[instance]
+                self.finished.pop(instance, None)
+        if records:
+            ticket = self.persister.submit(records)
+            for instance in waiting:
+                self.persisting[instance] = (ticket,
+                                             self.persisting[instance][1])
+
+    def _recover(self, records):
+        """
+        Rebuild what a player logged before it restarted: the last
+        snapshot of the game, the values resolved after it, and the
+        promise and accept state of open instances.
+        Returns: the resolved values after the snapshot, by instance
+        """
+        decided = {}
+        for record in records:
+            kind, instance = record[:2]
+            if kind == LOG_SNAPSHOT:
+                self.snapshot_instance = instance
+                self.snapshot_data = record[2]
+            elif kind == LOG_DECIDED:
+                decided[instance] = record[2]
+            elif kind == LOG_ACCEPTOR:
+                self.restored[instance] = record[2:]
+                if record[2] > self.promised_id:
+                    self.promised_id = record[2]
+        if decided:
+            self.logged = max(decided)
+        return dict((i, v) for i, v in decided.items()
+                    if i >= self.snapshot_instance)
+
+    def snapshot(self, game):
+        """
+        Every `snapshot_every' instances, take a snapshot of the game to
+        send to players that fall too far behind, and with a durable_dir
+        replace the log with the snapshot followed by the state of the
+        instances after it. The log is rewritten by the persister, so
+        this only costs packing the game. A snapshot sent by another
+        player to catch us up is restored into the game here, and then
+        taken as our own.
+        """
+        self.takes_snapshot = True
+        if self.snapshot_data is not None:
+            game.restore(self.snapshot_data)
+            self.snapshot_data = None
+        elif self.instance - self.snapshot_instance < self.snapshot_every:
+            return False
+        data = game.snapshot()
+        self.game_snapshot = (self.instance, data)
+        self.snapshot_instance = self.instance
+        self._prune_history()
+        if self.persister is None:
+            return True
+        records = [(LOG_SNAPSHOT, self.instance, data)]
+        for i in sorted(self.decided):
+            records.append((LOG_DECIDED, i, self.decided[i]))
+        for i in sorted(self.nodes):
+            node = self.nodes[i]
+            if node.promised_id is not None:
+                records.append((LOG_ACCEPTOR, i, node.promised_id,
+                                node.accepted_id, node.accepted_value))
+        self.persister.compact(records)
+        return True
+
+    def restore(self, game):
+        """
+        Restore the game from the snapshot recovered from the log, if
+        there was one.
+        """
+        self.takes_snapshot = True
+        if self.snapshot_data is None:
+            return False
+        game.restore(self.snapshot_data)
+        self.game_snapshot = (self.snapshot_instance, self.snapshot_data)
+        self.snapshot_data = None
+        return True
+
+    def catchup_stats(self):
+        """
+        Returns a dictionary of the number of times we asked to be caught
+        up, the snapshots of the game we were sent, the catch-up messages
+        of values we sent, the players we are catching up now and the
+        resolved values kept for them.
+        """
+        return {'requests': self.catchups,
+                'snapshots': self.transfers,
+                'sent': self.served,
+                'serving': len(self.serving),
+                'history': len(self.history)}
+
+    def persist_stats(self):
+        """
+        Returns the statistics of the persister, as described in
+        Persister.stats, or None if promises and accepts are not logged.
+        """
+        if self.persister is None:
+            return None
+        return self.persister.stats()
+
+    def batch_stats(self):
+        """
+        Returns the statistics of the batches taken from the outbox, to
+        be proposed or forwarded to the leader, as described in
+        Batcher.stats.
+        """
+        return self.outbox.stats()
+
+    def wait(self, timeout):
+        """
+        Block until there may be messages to get, `timeout' seconds have
+        passed, or the next heartbeat is due.
+        """
+        due = self.outbox.due()
+        if due is not None and not self._leading():
+            # moves are forwarded to the leader without waiting, unless
+            # a player's queue is backed up
+            due = 0 if self.urgent or not self.congested() else None
+        if due is not None and self.next_instance < self.instance + self.window:
+            timeout = 0 if self.urgent else min(timeout, due)
+        if self.node.leader:
+            next_hb = getattr(self.node, 'next_hb', 0)
+            timeout = max(0, min(timeout, next_hb - time.time()))
+        NetworkLayer.wait(self, timeout)
+
     def start(self):
         """
         Start up the TCP connections between all of the players for messaging. This is
         handled through the network util functions. We return the player number of the
-        player who we set up. 4 players must join to continue.
+        player who we set up. All players must join to continue.
         """
-        if (self.HOST):
-            self.player, self.socks, self.addrs = establish_tcp_connections(self.HOST)
-        else:
-            self.player, self.socks, self.addrs = coordinate_tcp_connections()
+        self._connect()
         self.call_part_time_parliament_to_order()
         return self.player
 
     def stop(self):
+        self.flush()
         self.running = False
+        if self.persister is not None:
+            self.poller.unregister(self.persister)
+            self.persister.close()
+            self.persister = None
 
     def call_part_time_parliament_to_order(self):
         """
         Initialize Paxos algorithm, with self as Node # uid
         """
-        import paxos.functional
         def status(*args):
-            print self.node.node_uid, args
+            print self.player, args
         class MyMessenger(paxos.functional.HeartbeatMessenger):
-            def __init__(_self): return super(MyMessenger,_self).__init__()
+            def __init__(_self, instance):
+                super(MyMessenger,_self).__init__()
+                _self.instance = instance
+
             def send_prepare(_self, proposal_id):
                 '''
                 Broadcasts a Prepare message to all Acceptors
                 '''
                 status("Preparing", proposal_id)
-                msg = pxb.msg()
-                msg.type = pxb.PREPARE
-                msg.proposal_id = cPickle.dumps(proposal_id)
-                self._broadcast_message(msg)
+                self._broadcast_message(paxos_msg(pxb.PREPARE, proposal_id),
+                                        instance=_self.instance)
 
             def send_promise(_self, proposer_uid, proposal_id, previous_id, accepted_value):
                 '''
                 Sends a Promise message to the specified Proposer
                 '''
                 status("Promising", proposal_id, accepted_value)
-                msg = pxb.msg()
-                msg.type = pxb.PROMISE
-                msg.proposal_id = cPickle.dumps(proposal_id)
-                if previous_id:
-                    msg.previous_id = cPickle.dumps(previous_id)
-                msg.value = cPickle.dumps(accepted_value)
-                self._send_message(proposer_uid, msg)
+                if self.multi_paxos:
+                    # the promise covers every later instance, so the
+                    # proposer has to hear what we accepted in those too,
+                    # before it counts this promise
+                    for i in sorted(self.nodes):
+                        node = self.nodes[i]
+                        if i > _self.instance and node.accepted_id is not None:
+                            msg = paxos_msg(pxb.PROMISE, proposal_id,
+                                            node.accepted_id, node.accepted_value)
+                            self._send_message(proposer_uid, msg, instance=i)
+                msg = paxos_msg(pxb.PROMISE, proposal_id, previous_id,
+                                accepted_value)
+                self._send_message(proposer_uid, msg, instance=_self.instance)
 
             def send_accept(_self, proposal_id, proposal_value):
                 '''
                 Broadcasts an Accept! message to all Acceptors
                 '''
                 status("Accept!ing", proposal_id, proposal_value)
-                msg = pxb.msg()
-                msg.type = pxb.ACCEPT
-                msg.proposal_id = cPickle.dumps(proposal_id)
-                msg.value = cPickle.dumps(proposal_value)
-                self._broadcast_message(msg)
+                msg = paxos_msg(pxb.ACCEPT, proposal_id, value=proposal_value)
+                self._broadcast_message(msg, URGENT, _self.instance)
 
             def send_accepted(_self, proposal_id, accepted_value):
                 '''
                 Broadcasts an Accepted message to all Learners
                 '''
                 status("Accepting", proposal_id, accepted_value)
-                msg = pxb.msg()
-                msg.type = pxb.ACCEPTED
-                msg.proposal_id = cPickle.dumps(proposal_id)
-                msg.value = cPickle.dumps(accepted_value)
-                self._broadcast_message(msg)
+                msg = paxos_msg(pxb.ACCEPTED, proposal_id, value=accepted_value)
+                self._broadcast_message(msg, URGENT, _self.instance)
 
             def on_resolution(_self, proposal_id, value):
                 '''
                 Called when a resolution is reached
                 '''
-                status("Accepted", proposal_id, value)
+                status("Accepted", _self.instance, proposal_id, value)
                 for v in value:
-                    v = Message.deserialize(v)
-                    if (v.pos, v.direction) in message_dict:
-                        print "Time elapsed for accept", time.time() - message_dict[(v.pos, v.direction)]
-                self.inbox.extend(value)
-                self.incr_instance = True
+                    if v in message_dict:
+                        print "Time elapsed for accept", time.time() - message_dict[v]
+                self.decided[_self.instance] = value
 
             def send_prepare_nack(_self, to_uid, proposal_id, promised_id):
                 '''
                 Sends a Prepare Nack message for the proposal to the specified node
                 '''
                 status("Prepare Nack", proposal_id, promised_id)
-                msg = pxb.msg()
-                msg.type = pxb.NACK_PREPARE
-                msg.proposal_id = cPickle.dumps(proposal_id)
-                msg.previous_id = cPickle.dumps(promised_id)
-                self._send_message(to_uid, msg)
+                msg = paxos_msg(pxb.NACK_PREPARE, proposal_id, promised_id)
+                self._send_message(to_uid, msg, instance=_self.instance)
 
             def send_accept_nack(_self, to_uid, proposal_id, promised_id):
                 '''
                 Sends a Accept! Nack message for the proposal to the specified node
                 '''
                 status("Accept Nack", proposal_id, promised_id)
-                msg = pxb.msg()
-                msg.type = pxb.NACK_ACCEPT
-                msg.proposal_id = cPickle.dumps(proposal_id)
-                msg.previous_id = cPickle.dumps(promised_id)
-                self._send_message(to_uid, msg)
+                msg = paxos_msg(pxb.NACK_ACCEPT, proposal_id, promised_id)
+                self._send_message(to_uid, msg, instance=_self.instance)
 
             def on_leadership_acquired(_self):
                 '''
@@ -367,10 +1085,8 @@ class PartTimeNetworkLayer(NetworkLayer):
                 Sends a heartbeat message to all nodes
                 '''
                 status("My heart still beats", leader_proposal_id)
-                msg = pxb.msg()
-                msg.type = pxb.HEARTBEAT
-                msg.proposal_id = cPickle.dumps(leader_proposal_id)
-                self._broadcast_message(msg)
+                msg = paxos_msg(pxb.HEARTBEAT, leader_proposal_id)
+                self._broadcast_message(msg, BULK)
 
             def schedule(_self, msec_delay, func_obj):
                 '''
@@ -385,6 +1101,8 @@ class PartTimeNetworkLayer(NetworkLayer):
                 '''
                 Called when loss of leadership is detected
                 '''
+                # batches we proposed go back in the outbox if another
+                # proposal wins their instance (see _deliver)
                 status("I'm not the leader :(")
 
             def on_leadership_change(_self, prev_leader_uid, new_leader_uid):
@@ -394,67 +1112,159 @@ class PartTimeNetworkLayer(NetworkLayer):
                 '''
                 status("Leader change", prev_leader_uid, new_leader_uid)
 
-        self.messenger = MyMessenger()
-        self.node = paxos.functional.HeartbeatNode(self.messenger, self.player, len(self.socks)/2 + 1)
+        self.messenger = MyMessenger
+        self.quorum_size = quorum_size(len(self.socks))
         self.inbox = []
-        self.outbox = []
-        self.instance = 1
-        self.incr_instance = False
+        self.outbox = Batcher(self.batch_size, self.batch_delay)
+        # whether the outbox holds a kill or exit
+        self.urgent = False
+        # the writer of the durable log, the ticket and state of each
+        # instance whose replies wait for it, the nodes of resolved
+        # instances among those, and the state recovered from the log by
+        # instance
+        self.persister = None
+        self.persisting = {}
+        self.finished = {}
+        self.restored = {}
+        # the instance the last snapshot of the game was taken before, a
+        # recovered snapshot not yet restored, and the last instance whose
+        # value is in the log
+        self.snapshot_instance = 1
+        self.snapshot_data = None
+        self.logged = 0
+        # the highest proposal id promised in any instance, which with
+        # Multi-Paxos holds for every later instance too
+        self.promised_id = None
+        # resolved values waiting for an earlier instance to be resolved
+        self.decided = {}
+        if self.durable_dir:
+            log = DurableLog(self.durable_dir, 'acceptor-%d' % self.player,
+                             group_commit=True)
+            self.decided = self._recover(log.recovered)
+            self.persister = Persister(log)
+            self.poller.register(self.persister)
+        # the lowest instance not yet delivered, its node, and the nodes
+        # of every open instance
+        self.instance = self.snapshot_instance
+        self.node = paxos.functional.HeartbeatNode(self.messenger(self.instance), self.player, self.quorum_size)
+        if self.instance in self.restored:
+            self.node.recover(*self.restored.pop(self.instance))
+        if self.promised_id:
+            # proposals have to outnumber what was promised before
+            self.node.next_proposal_number = self.promised_id.number + 1
+        self.nodes = {self.instance: self.node}
+        # the next instance to propose in while leading
+        self.next_instance = self.instance
+        # the batches proposed from our outbox, and the values reported
+        # by promises as accepted in later instances, by instance
+        self.proposed = {}
+        self.recovered = {}
+        # messages for instances too far ahead, as (socket, message) pairs
+        self.held = []
+        # the values of recently resolved instances by instance, from
+        # history_start on, and the last snapshot of the game as
+        # (instance, data), kept for players that fall behind
+        self.history = {}
+        self.history_start = self.instance
+        self.game_snapshot = None
+        # whether the game loop restores snapshots, the furthest instance
+        # each player is known to have reached, when the current instance
+        # started and when we last asked to be caught up
+        self.takes_snapshot = False
+        self.peer_instance = {}
+        self.instance_since = time.time()
+        self.catchup_after = CATCHUP_AFTER
+        self.catchup_sent = 0
+        self.catchups = 0
+        self.transfers = 0
+        self.served = 0
+        # the next instance to send each player being caught up
+        self.serving = {}
+        # replay the values resolved after the snapshot
+        self._deliver()
 
         def do_paxos(self):
             """
             Main Paxos loop
             """
             for s,msg in self._get_messages():
-                if msg.proposal_id:
-                    proposal_id = paxos.functional.ProposalID._make(cPickle.loads(str(msg.proposal_id)))
+                if msg.type == pxb.CATCHUP:
+                    self._serve(msg.from_uid, msg.instance, msg.takes_snapshot)
+                    continue
+                elif msg.type == pxb.VALUES:
+                    self._receive_values(msg)
+                    continue
+                elif msg.type == pxb.SNAPSHOT:
+                    self._receive_snapshot(msg)
+                    continue
+                elif msg.type not in INSTANCE_FREE and msg.instance < self.instance:
+                    # skipped over by a snapshot read earlier in this loop
+                    continue
+                proposal_id, previous_id = paxos_ids(msg)
+                if msg.type in INSTANCE_FREE:
+                    node = self.node
+                else:
+                    node = self._node(msg.instance)
+                if proposal_id:
+                    node.next_proposal_number = max(node.next_proposal_number, proposal_id.number + 1)
                     self.node.next_proposal_number = max(self.node.next_proposal_number, proposal_id.number + 1)
-                if msg.previous_id:
-                        previous_id = paxos.functional.ProposalID._make(cPickle.loads(str(msg.previous_id)))
+                if self.multi_paxos and self.promised_id > node.promised_id:
+                    node.promised_id = self.promised_id
 
                 if msg.type == pxb.PREPARE:
-                    self.node.recv_prepare(msg.from_uid, proposal_id)
+                    node.recv_prepare(msg.from_uid, proposal_id)
                 elif msg.type == pxb.PROMISE:
-                    previous_id = None
-                    accepted_value = cPickle.loads(str(msg.value))
-                    self.node.recv_promise(msg.from_uid, proposal_id, previous_id, accepted_value)
+                    accepted_value = paxos_value(msg)
+                    if self.multi_paxos and previous_id and accepted_value is not None:
+                        best = self.recovered.get(msg.instance)
+                        if best is None or previous_id > best[0]:
+                            self.recovered[msg.instance] = (previous_id, accepted_value)
+                    node.recv_promise(msg.from_uid, proposal_id, previous_id, accepted_value)
                 elif msg.type == pxb.ACCEPT:
-                    self.node.recv_accept_request(msg.from_uid, proposal_id, cPickle.loads(str(msg.value)))
+                    node.recv_accept_request(msg.from_uid, proposal_id, paxos_value(msg))
                 elif msg.type == pxb.ACCEPTED:
-                    self.node.recv_accepted(msg.from_uid, proposal_id, cPickle.loads(str(msg.value)))
+                    node.recv_accepted(msg.from_uid, proposal_id, paxos_value(msg))
                 elif msg.type == pxb.NACK_PREPARE:
-                    self.node.recv_prepare_nack(msg.from_uid, proposal_id, previous_id)
+                    node.recv_prepare_nack(msg.from_uid, proposal_id, previous_id)
                 elif msg.type == pxb.NACK_ACCEPT:
-                    self.node.recv_accept_nack(msg.from_uid, proposal_id, previous_id)
+                    node.recv_accept_nack(msg.from_uid, proposal_id, previous_id)
                 elif msg.type == pxb.HEARTBEAT:
-                    self.node.recv_heartbeat(msg.from_uid, proposal_id)
+                    node.recv_heartbeat(msg.from_uid, proposal_id)
                 elif msg.type == pxb.REQUEST:
-                    if self.node.leader:
-                        self.outbox.extend(cPickle.loads(str(msg.value)))
+                    if self.node.leader or self.node.leader_uid == self.player:
+                        self.outbox.add(msg.values)
                     else:
                         status("Dropping request")
                 else:
                     raise NotImplementedError
 
-            if not self.incr_instance:
-                if self.outbox:
-                    if self.node.leader and not self.node.proposed_value:
-                        self.node.proposed_value = self.outbox
-                        self.node.prepare()
-                    elif not self.node.leader:
-                        msg = pxb.msg()
-                        msg.type = pxb.REQUEST
-                        msg.value = cPickle.dumps(self.outbox)
-                        self.outbox = []
-                        self._broadcast_message(msg)
-                self.node.persisted()
-                if self.node.leader and self.node.next_hb <= time.time():
-                    self.node.pulse()
-            else:
-                self.node = paxos.functional.HeartbeatNode(self.messenger, self.player, len(self.socks)/2 + 1, self.node.leader_uid)
-                self.node.next_hb = time.time()
-                self.instance += 1
-                self.incr_instance = False
+                if node.promised_id > self.promised_id:
+                    self.promised_id = node.promised_id
+
+            self._deliver()
+            self._catch_up()
+            if self.serving:
+                self._send_values()
+            if self._leading():
+                while self.next_instance < self.instance + self.window and \
+                      (self.next_instance in self.recovered or
+                       self.outbox and (self.urgent or self.outbox.ready())):
+                    self._propose(self.next_instance)
+                    self.next_instance += 1
+            elif self.outbox and self.node.leader_uid != self.player and \
+                 (self.urgent or not self.congested()):
+                # the leader batches the moves it is forwarded, so they
+                # go right away; they can wait for a backed up player's
+                # queue to drain, kills and exits cannot
+                while self.outbox:
+                    msg = paxos_msg(pxb.REQUEST, value=self.outbox.take())
+                    self._broadcast_message(msg,
+                                            URGENT if self.urgent else BULK)
+            if not self.outbox:
+                self.urgent = False
+            self._persist()
+            if self.node.leader and self.node.next_hb <= time.time():
+                self.node.pulse()
 
         self.paxos = do_paxos
         if self.player == 1:
@@ -462,3 +1272,226 @@ class PartTimeNetworkLayer(NetworkLayer):
 
     def do_paxos(self):
         return self.paxos(self)
+
+class ProcessNetworkLayer(NetworkLayer):
+    """
+    Runs another network layer in a worker process, so that the network
+    and Paxos work runs on its own core and keeps running while a frame is
+    slow. The worker passes the messages the layer delivers to the game
+    through one SharedRing and broadcasts the messages the game sends
+    through another, so the game loop only copies messages in and out of
+    shared memory. The statistics of the layer are fetched from the
+    worker over a pipe.
+
+    The worker delivers messages ahead of the game applying them, so it
+    cannot tell which instance a snapshot of the game belongs to:
+    snapshot and restore do nothing, the layer is never caught up from a
+    snapshot, and a durable log is never compacted.
+    """
+
+    # the statistics methods passed through to the worker's layer
+    STATS = ('send_stats', 'persist_stats', 'batch_stats', 'catchup_stats')
+
+    def __init__(self, layer_class, *args, **kwargs):
+        """
+        Args:
+            layer_class - the NetworkLayer class to run in the worker,
+                e.g. NaiveNetworkLayer or PartTimeNetworkLayer
+            args, kwargs - the arguments to create it with
+        Keyword args:
+            ring_size - the size in bytes of each ring
+            poll - how long in seconds the worker sleeps when there is
+                nothing to do
+        Raises:
+            ValueError if snapshots of the game are asked for, which a
+            layer in a worker cannot take
+        """
+        if kwargs.get('snapshot_every'):
+            raise ValueError("a layer in a worker process can't take "
+                             "snapshots of the game")
+        ring_size = kwargs.pop('ring_size', 1 << 20)
+        self.poll = kwargs.pop('poll', .001)
+        self.layer_class = layer_class
+        self.args = args
+        self.kwargs = kwargs
+        # messages from the network to the game and from the game out
+        self.inbound = SharedRing(ring_size)
+        self.outbound = SharedRing(ring_size)
+        self.running = multiprocessing.RawValue('b', 1)
+        self.process = None
+        # messages waiting for room in the outbound ring
+        self.unsent = collections.deque()
+        # the pipe to ask the worker for statistics, and their last
+        # values, sent by the worker as it stops
+        self.control = None
+        self.final_stats = None
+        # These get initialized in start
+        self.player = None
+        self.n_players = None
+        self.board_size = None
+
+    def broadcast_message(self, msg):
+        """
+        Hand a message to the worker to broadcast. If the outbound ring is
+        full, the message waits, after any already waiting, and is handed
+        over by a later call or flush, so that no message, and in
+        particular no kill or exit, is lost.
+        Return:
+            True, since the message will be broadcast.
+        """
+        self.unsent.append(msg.serialize(Message.STRUCT))
+        self._hand_over()
+        return True
+
+    def flush(self):
+        """
+        Hand the worker the messages waiting for room in the ring.
+        """
+        self._hand_over()
+
+    def _hand_over(self):
+        """
+        Move waiting messages into the outbound ring, in order, until it
+        is full.
+        Returns: True if no messages are left waiting.
+        """
+        unsent = self.unsent
+        while unsent and self.outbound.put(unsent[0]):
+            unsent.popleft()
+        return not unsent
+
+    def get_messages(self):
+        """
+        Get the messages the worker has received.
+        """
+        return map(Message.deserialize, self.inbound.get_all())
+
+    def start(self):
+        """
+        Start the worker, which sets up the network layer. Blocks until
+        the game is supposed to begin and returns the local player number.
+        """
+        conn, worker_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=self._work,
+                                               args=(worker_conn,))
+        self.process.daemon = True
+        self.process.start()
+        started = conn.recv()
+        if isinstance(started, Exception):
+            conn.close()
+            self.process.join(1)
+            raise started
+        self.player, self.n_players, self.board_size = started
+        self.control = conn
+        return self.player
+
+    def stop(self, timeout=1):
+        """
+        Stop the worker, which stops the network layer, once it has been
+        handed every message still waiting, waiting at most `timeout'
+        seconds for room in the ring.
+        """
+        if self.process:
+            deadline = time.time() + timeout
+            while not self._hand_over() and time.time() < deadline and \
+                  self.process.is_alive():
+                time.sleep(self.poll)
+        self.running.value = 0
+        if self.control:
+            if self.control.poll(timeout):
+                self.final_stats = self.control.recv()
+            self.control.close()
+            self.control = None
+        if self.process:
+            self.process.join(timeout)
+
+    def _stats(self, name):
+        """
+        Returns what the method `name' of the worker's layer returns, or
+        None if the layer has no such method or the worker has gone.
+        """
+        if self.final_stats is not None:
+            return self.final_stats.get(name)
+        if self.control is None:
+            return None
+        try:
+            self.control.send(name)
+            if self.control.poll(1):
+                return self.control.recv()
+        except (IOError, EOFError):
+            pass
+        return None
+
+    def send_stats(self):
+        """
+        Returns the send statistics of the worker's layer, as described in
+        NetworkLayer.send_stats.
+        """
+        return self._stats('send_stats') or NetworkLayer.send_stats(self)
+
+    def persist_stats(self):
+        """
+        Returns the persister statistics of the worker's layer, or None.
+        """
+        return self._stats('persist_stats')
+
+    def batch_stats(self):
+        """
+        Returns the batch statistics of the worker's layer, or None.
+        """
+        return self._stats('batch_stats')
+
+    def catchup_stats(self):
+        """
+        Returns the catch-up statistics of the worker's layer, or None.
+        """
+        return self._stats('catchup_stats')
+
+    def _work(self, conn):
+        """
+        The main loop of the worker process.
+        """
+        layer = self.layer_class(*self.args, **self.kwargs)
+        player = layer.start()
+        # calling restore would tell the layer the game takes snapshots
+        if getattr(layer, 'snapshot_data', None) is not None:
+            conn.send(ValueError("a layer in a worker process can't restore "
+                                 "the snapshot of the game in its log"))
+            layer.stop()
+            return
+        conn.send((player, layer.n_players, layer.board_size))
+
+        def stats(name):
+            method = getattr(layer, name, None)
+            return method() if method else None
+
+        # messages waiting for room in the inbound ring
+        pending = []
+        while self.running.value:
+            if conn.poll():
+                name = conn.recv()
+                conn.send(stats(name))
+
+            sent = self.outbound.get_all()
+            for data in sent:
+                layer.broadcast_message(Message.deserialize(data))
+
+            pending.extend(msg.serialize(Message.STRUCT)
+                           for msg in layer.get_messages())
+            delivered = 0
+            for data in pending:
+                if not self.inbound.put(data):
+                    break
+                delivered += 1
+            received = bool(pending)
+            del pending[:delivered]
+
+            if not sent and not received:
+                layer.wait(self.poll)
+
+        # broadcast what the game sent before stopping us
+        for data in self.outbound.get_all():
+            layer.broadcast_message(Message.deserialize(data))
+        layer.stop()
+        conn.send(dict((name, stats(name)) for name in self.STATS))
+        conn.close()
@@ -1,76 +1,837 @@
 """
 network_utils.py
 
-This contains the utility classes and functions for network
-operations. We defined two different socket types that are used in the
-network layers. These are the SelfLoopSocket and WrappedSocket, which
-are used for getting your own moves and getting an individual
-message. The failure rate is one of the arguments to WrappedSocket and
-can be defined in the class. The functions establish_tcp_connections
-and coordinate_tcp_connections are used for the initial setup of the
-TCP connections for the game.
+This contains the utility classes and functions for network operations.
+We defined two different socket types that are used in the network
+layers. These are the LoopbackSocket and WrappedSocket, which are used
+for getting your own moves and getting an individual message. The
+failure rate is one of the arguments to WrappedSocket and can be
+defined in the class. The functions establish_tcp_connections and
+coordinate_tcp_connections are used for the initial setup of the TCP
+connections for the game. The coordinator asks every player for the
+newest protocol version it speaks and tells them all to play the oldest
+of those, which decides the wire format of game messages. The function
+local_connections builds the same fully connected network between
+players in a single process, which is used for benchmarking the network
+layers. SharedRing is a queue of messages in shared memory for passing
+messages between the game and a network layer running in another
+process. Poller tells the network layers which of their sockets have
+data waiting, so that idle sockets cost nothing. Batcher holds the
+messages waiting to be proposed and decides when enough of them have
+gathered to go out as one batch. Persister writes records to a durable
+log from a background thread and tells the network layer when they are
+safely on the disk.
 """
 
-import sys, random, struct
+import sys, os, time, random, struct, ctypes, multiprocessing, select, errno
+import threading, fcntl
 import socket as sock
+from collections import deque
 import player_pb2 as pb
 from game_utils import Message, Direction
+from timers import Histogram, monotonic
 
 N_PLAYERS = 4
+BOARD_SIZE = (600, 600)
 PORT = 2620
 LOCAL_ADDR = sock.gethostbyname(sock.gethostname())
+# the newest protocol version this player speaks
+PROTO_VERSION = Message.STRUCT
+# starts a player's reply telling the coordinator its version; a game
+# message's length prefix can never start with these bytes, so the
+# coordinator can tell a reply from a player that sent none
+VERSION_MAGIC = 'PXVN'
+# how long in seconds the coordinator waits, once everyone has joined,
+# for the versions of players that have not sent one; players older than
+# the version negotiation never do, and only speak protocol buffers
+VERSION_WAIT = 2.0
 
-class SelfLoopSocket(object):
+# the length prefix of each message on the wire
+FRAME_HEADER = struct.Struct('!Q')
+
+# send priorities, highest first: messages in a higher lane are written
+# before any queued in a lower one
+URGENT, NORMAL, BULK = range(3)
+
+class LoopbackSocket(object):
+    """
+    Stands in for the WrappedSocket connecting a player to itself. Sent
+    messages are kept as they are in a deque and handed back by recv, so
+    messages to ourselves are never framed, copied or written to a
+    socket.
+    """
     def __init__(self):
-        self.msgs = ''
+        self.msgs = deque()
+        self.depths = [0, 0, 0]
+        self.refused = 0
+        self.closed = False
 
-    def send(self, msg):
-        self.msgs += msg
+    def fileno(self):
+        return None
 
-    def recv(self, buf_len):
-        if buf_len < len(self.msgs):
-            buf = self.msgs[:buf_len]
-            self.msgs = self.msgs[buf_len:]
-            return buf
-        else:
-            buf = self.msgs
-            self.msgs = ''
-            return buf
+    def pending(self):
+        return bool(self.msgs)
+
+    def send(self, msg, lane=NORMAL):
+        self.msgs.append(msg)
+        return True
+
+    def has_room(self, size=0):
+        return True
+
+    def queued(self):
+        return 0
+
+    def flush(self):
+        return 0
+
+    def recv(self, buf_len=None):
+        """
+        Returns the next message. Raises an IOError if there is none, like
+        a WrappedSocket with nothing to read.
+        """
+        if not self.msgs:
+            raise sock.error(errno.EAGAIN, 'no messages')
+        return self.msgs.popleft()
 
 class WrappedSocket(object):
     """
     Like a socket, but reads always return an individual message (or nothing)
+
+    Reads go into a receive buffer, and every complete message in it is
+    split off at once, so one recv can deliver many messages. The start of
+    a message that has not fully arrived stays in the buffer until the
+    rest does.
+
+    Sends are queued and go out together, in one send call, when the
+    socket is flushed. Whatever the socket does not take stays queued for
+    the next flush. There is a queue for each send priority, and the
+    normal and bulk queues together hold at most `max_queued' bytes; sends
+    that do not fit are refused, so a slow player backs up its own queue
+    rather than the game. Urgent messages are always queued.
     """
-    def __init__(self, socket, failprob=0):
+    def __init__(self, socket, failprob=0, buf_size=65536,
+                 max_queued=1 << 18):
         self.socket = socket
         self.failprob = failprob
+        self.buf = bytearray(buf_size)
+        self.view = memoryview(self.buf)
+        # the buffered bytes that have not been split into messages yet
+        self.start = 0
+        self.end = 0
+        self.msgs = deque()
+        self.closed = False
+        # headers and messages waiting for the next flush, by priority
+        self.lanes = ([], [], [])
+        self.depths = [0, 0, 0]
+        self.max_queued = max_queued
+        # the rest of a message the socket only took part of
+        self.unsent = ''
+        self.refused = 0
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def pending(self):
+        """
+        Returns True if messages have been read but not yet returned.
+        """
+        return bool(self.msgs)
 
-    def send(self, msg):
+    def send(self, msg, lane=NORMAL):
+        """
+        Queue a message to be sent by the next flush.
+        Args:
+            msg - the message
+            lane - the priority to send it with: URGENT, NORMAL or BULK
+        Returns: False if the queue is too full to take the message.
+        """
+        size = FRAME_HEADER.size + len(msg)
+        if lane != URGENT and not self.has_room(size):
+            self.refused += 1
+            return False
         if random.random() > self.failprob:
-            self.socket.send(struct.pack("!Q", len(msg)) + msg)
-
-    def recv(self, buf_len):
-        data = self.socket.recv(8)
-        if not data: return
-        assert len(data) == 8
-        msglen = struct.unpack("!Q", data)[0]
-        data = self.socket.recv(msglen)
-        assert len(data) == msglen
+            self.lanes[lane].append(FRAME_HEADER.pack(len(msg)))
+            self.lanes[lane].append(msg)
+            self.depths[lane] += size
+        return True
+
+    def has_room(self, size=0):
+        """
+        Returns True if a normal or bulk message of `size' bytes would be
+        queued.
+        """
+        return self.depths[NORMAL] + self.depths[BULK] + size <= self.max_queued
+
+    def queued(self):
+        """
+        Returns the number of bytes waiting to be sent.
+        """
+        return len(self.unsent) + sum(self.depths)
+
+    def flush(self):
+        """
+        Send the queued messages, highest priority first, with one send
+        call.
+        Returns: the number of bytes sent.
+        """
+        if not self.unsent and not any(self.depths):
+            return 0
+        pieces = [self.unsent]
+        for lane in self.lanes:
+            pieces.extend(lane)
+        data = ''.join(pieces)
+        try:
+            n = self.socket.send(data)
+        except sock.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            n = 0
+        if n < len(self.unsent):
+            self.unsent = self.unsent[n:]
+            return n
+
+        # take the messages that were written off the queues, keeping
+        # any the socket did not take at all where they are
+        left = n - len(self.unsent)
+        self.unsent = ''
+        for p, lane in enumerate(self.lanes):
+            i = 0
+            while i < len(lane) and left > 0:
+                size = len(lane[i]) + len(lane[i + 1])
+                if size > left:
+                    self.unsent = (lane[i] + lane[i + 1])[left:]
+                    left = 0
+                else:
+                    left -= size
+                self.depths[p] -= size
+                i += 2
+            del lane[:i]
+        return n
+
+    def recv(self, buf_len=None):
+        """
+        Returns the next message, or None if the connection has been
+        closed. Raises an IOError if no whole message has arrived.
+        """
+        if not self.msgs and not self.closed:
+            self._fill()
+        if self.msgs:
+            return self.msgs.popleft()
+        if self.closed:
+            return None
+        raise sock.error(errno.EAGAIN, 'no whole message')
+
+    def _fill(self):
+        """
+        Read once from the socket into the buffer and split off the
+        messages that are complete.
+        """
+        if self.end == len(self.buf):
+            self._make_room(0)
+        try:
+            n = self.socket.recv_into(self.view[self.end:])
+        except sock.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.closed = True
+            raise
+        if n == 0:
+            self.closed = True
+            return
+        self.end += n
+
+        buf, start, end = self.buf, self.start, self.end
+        header = FRAME_HEADER.size
+        while end - start >= header:
+            msglen, = FRAME_HEADER.unpack_from(buf, start)
+            if end - start - header < msglen:
+                if header + msglen > len(buf) - start:
+                    self.start = start
+                    self._make_room(header + msglen)
+                    return
+                break
+            start += header
+            self.msgs.append(self.view[start:start + msglen].tobytes())
+            start += msglen
+
+        if start == end:
+            start = end = 0
+        self.start, self.end = start, end
+
+    def _make_room(self, frame_len):
+        """
+        Move the partial message at the start of the buffer to the front
+        so that reads can continue after it, growing the buffer if the
+        whole message will not fit.
+        """
+        pending = self.buf[self.start:self.end]
+        size = len(self.buf)
+        while size < frame_len:
+            size *= 2
+        if size != len(self.buf):
+            self.buf = bytearray(size)
+            self.view = memoryview(self.buf)
+        self.buf[:len(pending)] = pending
+        self.start, self.end = 0, len(pending)
+
+class Batcher(object):
+    """
+    The messages waiting to be proposed, taken out in batches. A batch is
+    ready once `max_size' messages are waiting or once the oldest of them
+    has waited out the deadline. The deadline follows the load: a batch
+    only waits for more messages if, at the rate they have been arriving,
+    it would fill up within `max_delay', and then only for as long as
+    that takes, so the denser the arrivals the shorter the wait. While
+    messages arrive slower than that, as they do in a game sending a move
+    or two a frame, a batch is ready as soon as it has a message. Batches
+    are tuples, so a batch that has been proposed does not change when
+    more messages arrive.
+    """
+    # the weight of the latest time between messages in the average
+    ALPHA = .2
+
+    def __init__(self, max_size=64, max_delay=.005, clock=monotonic):
+        """
+        Args:
+            max_size - the most messages in a batch
+            max_delay - the longest the oldest message may wait for more
+                to join its batch, in seconds
+            clock - the function returning the current time in seconds
+        """
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.clock = clock
+        self.msgs = []
+        # when each waiting message arrived
+        self.arrivals = []
+        # the average time between messages, and when the last arrived
+        self.gap = None
+        self.last = None
+        self.batches = 0
+        self.sizes = [0] * (max_size + 1)
+        self.waits = Histogram()
+
+    def __len__(self):
+        return len(self.msgs)
+
+    def add(self, msgs):
+        """
+        Add a sequence of serialized messages to the end of the queue.
+        """
+        if not msgs:
+            return
+        now = self.clock()
+        if self.last is not None:
+            gap = (now - self.last) / len(msgs)
+            if self.gap is None:
+                self.gap = gap
+            else:
+                self.gap += self.ALPHA * (gap - self.gap)
+        self.last = now
+        self.msgs.extend(msgs)
+        self.arrivals.extend([now] * len(msgs))
+
+    def append(self, msg):
+        self.add((msg,))
+
+    def requeue(self, batch):
+        """
+        Put the messages of a batch back at the front of the queue, to be
+        taken before any other.
+        """
+        now = self.clock()
+        self.msgs[:0] = batch
+        self.arrivals[:0] = [now] * len(batch)
+
+    def deadline(self):
+        """
+        Returns how long the oldest message may wait, in seconds: the
+        time the batch takes to fill up at the average rate messages have
+        been arriving, or 0 if that is longer than `max_delay'.
+        """
+        if self.gap is None:
+            return 0.0
+        fill = self.gap * (self.max_size - len(self.msgs))
+        if fill > self.max_delay:
+            return 0.0
+        return fill
+
+    def due(self):
+        """
+        Returns the seconds until a batch is ready, 0 if one is ready now,
+        or None if there are no messages.
+        """
+        if not self.msgs:
+            return None
+        if len(self.msgs) >= self.max_size:
+            return 0.0
+        waited = self.clock() - self.arrivals[0]
+        return max(0.0, self.deadline() - waited)
+
+    def ready(self):
+        """
+        Returns True if a batch is ready to be taken.
+        """
+        return self.due() == 0.0
+
+    def take(self):
+        """
+        Remove and return the oldest batch of up to `max_size' messages,
+        whether or not it is ready.
+        """
+        n = min(len(self.msgs), self.max_size)
+        batch = tuple(self.msgs[:n])
+        if n:
+            self.waits.record(self.clock() - self.arrivals[0])
+            self.sizes[n] += 1
+            self.batches += 1
+        del self.msgs[:n]
+        del self.arrivals[:n]
+        return batch
+
+    def stats(self):
+        """
+        Returns a dictionary of the number of batches taken, their mean,
+        median and largest number of messages, the mean, median, 99th
+        percentile and longest time in seconds the oldest message of a
+        batch waited, the current deadline and the messages waiting.
+        """
+        messages = sum(n * count for n, count in enumerate(self.sizes))
+        median = largest = 0
+        seen = 0
+        for n, count in enumerate(self.sizes):
+            if count:
+                largest = n
+                if seen <= self.batches // 2 < seen + count:
+                    median = n
+                seen += count
+        return {'batches': self.batches,
+                'mean_size': float(messages) / self.batches if self.batches else 0.0,
+                'median_size': median,
+                'max_size': largest,
+                'mean_wait': self.waits.mean(),
+                'median_wait': self.waits.percentile(50),
+                'p99_wait': self.waits.percentile(99),
+                'max_wait': self.waits.max,
+                'deadline': self.deadline(),
+                'waiting': len(self.msgs)}
+
+class _Compaction(object):
+    """
+    A compaction queued in a Persister, with the records to replace the
+    log with.
+    """
+    __slots__ = ('records',)
+
+    def __init__(self, records):
+        self.records = records
+
+class Persister(object):
+    """
+    Writes records to a durable log from a background thread, so that the
+    network layer never waits on the disk. Records handed over together
+    with submit, and any others that arrive while the thread is busy, are
+    written with a single group commit. Each submit returns a ticket, and
+    flushed returns the highest ticket whose records are all on the disk.
+    The thread writes a byte to a pipe after each commit, so a Poller
+    watching the persister wakes up when records have been flushed.
+    Compactions are queued the same way and happen in order with the
+    records around them.
+    """
+    def __init__(self, log, clock=monotonic):
+        """
+        Args:
+            log - the log to write to, a paxos.durable.DurableLog or any
+                object with the same append, commit and close methods
+            clock - the function returning the current time in seconds
+        """
+        self.log = log
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.queue = []
+        # when the oldest queued record was submitted
+        self.oldest = None
+        self.submitted = 0
+        self.done = 0
+        self.error = None
+        self.running = True
+        self.commits = 0
+        self.records = 0
+        self.compactions = 0
+        # how long each commit took, and how long its oldest record waited
+        # from being submitted until it was on the disk
+        self.commit_times = Histogram()
+        self.lags = Histogram()
+        self.wake_r, self.wake_w = os.pipe()
+        for fd in (self.wake_r, self.wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def fileno(self):
+        return self.wake_r
+
+    def clear(self):
+        """
+        Empty the wakeup pipe.
+        """
+        try:
+            while os.read(self.wake_r, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def submit(self, records):
+        """
+        Queue records to be written.
+        Returns: the ticket of the records
+        """
+        with self.cond:
+            if not self.queue:
+                self.oldest = self.clock()
+            self.queue.extend(records)
+            self.submitted += 1
+            self.cond.notify()
+            return self.submitted
+
+    def compact(self, records):
+        """
+        Queue the replacement of everything in the log, including records
+        queued before, with `records' (see DurableLog.compact).
+        Returns: the ticket of the compaction
+        """
+        return self.submit((_Compaction(records),))
+
+    def flushed(self):
+        """
+        Returns: the highest ticket whose records are on the disk. Raises the
+            error the thread stopped with, if it failed to write.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.done
+
+    def pending(self):
+        """
+        Returns: True if there are submitted records not yet on the disk.
+        """
+        return self.done < self.submitted
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                records, self.queue = self.queue, []
+                ticket = self.submitted
+                oldest = self.oldest
+            start = self.clock()
+            try:
+                written = 0
+                for record in records:
+                    if isinstance(record, _Compaction):
+                        self.log.compact(record.records)
+                        self.compactions += 1
+                    else:
+                        self.log.append(record)
+                        written += 1
+                self.log.commit()
+            except Exception as e:
+                # raised in the network layer by the next flushed call
+                self.error = e
+                return
+            now = self.clock()
+            self.commit_times.record(now - start)
+            self.lags.record(now - oldest)
+            self.commits += 1
+            self.records += written
+            self.done = ticket
+            try:
+                os.write(self.wake_w, 'x')
+            except OSError as e:
+                # the pipe is full, so the poller will wake anyway
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+
+    def stats(self):
+        """
+        Returns a dictionary of the number of commits, records written and
+        compactions, the mean records per commit, the mean, median, 99th percentile and
+        longest time in seconds a commit took, and the median, 99th
+        percentile and longest time records waited to be on the disk.
+        """
+        return {'commits': self.commits,
+                'records': self.records,
+                'compactions': self.compactions,
+                'records_per_commit': float(self.records) / self.commits if self.commits else 0.0,
+                'mean_commit': self.commit_times.mean(),
+                'median_commit': self.commit_times.percentile(50),
+                'p99_commit': self.commit_times.percentile(99),
+                'max_commit': self.commit_times.max,
+                'median_lag': self.lags.percentile(50),
+                'p99_lag': self.lags.percentile(99),
+                'max_lag': self.lags.max}
+
+    def close(self):
+        """
+        Write the records still queued, stop the thread and close the log.
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+        self.log.close()
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
+
+class SharedRing(object):
+    """
+    A ring buffer of byte strings in shared memory, for passing messages
+    from one process to another without pickling or locking. There must
+    be exactly one process putting strings in and one taking them out.
+    Each string is stored as its length followed by its bytes, and may
+    wrap around the end of the buffer.
+    """
+    LENGTH = struct.Struct('!I')
+
+    def __init__(self, capacity=1 << 20):
+        """
+        Create a ring of `capacity' bytes. It must be created before the
+        processes using it are forked.
+        """
+        self.capacity = capacity
+        self.buf = multiprocessing.RawArray(ctypes.c_char, capacity)
+        # the total number of bytes ever taken out and put in; only the
+        # consumer writes head and only the producer writes tail
+        self.head = multiprocessing.RawValue(ctypes.c_ulonglong, 0)
+        self.tail = multiprocessing.RawValue(ctypes.c_ulonglong, 0)
+
+    def _write(self, pos, data):
+        i = pos % self.capacity
+        first = min(len(data), self.capacity - i)
+        self.buf[i:i + first] = data[:first]
+        if first < len(data):
+            self.buf[0:len(data) - first] = data[first:]
+
+    def _read(self, pos, n):
+        i = pos % self.capacity
+        first = min(n, self.capacity - i)
+        data = self.buf[i:i + first]
+        if first < n:
+            data += self.buf[0:n - first]
+        return data
+
+    def put(self, data):
+        """
+        Add a string to the ring.
+        Returns: True if it was added, False if the ring is too full.
+        """
+        n = self.LENGTH.size + len(data)
+        tail = self.tail.value
+        if n > self.capacity - (tail - self.head.value):
+            return False
+        self._write(tail, self.LENGTH.pack(len(data)) + data)
+        # publish the string only once all of it is written
+        self.tail.value = tail + n
+        return True
+
+    def get(self):
+        """
+        Returns: the oldest string in the ring, or None if it is empty.
+        """
+        head = self.head.value
+        if head == self.tail.value:
+            return None
+        n, = self.LENGTH.unpack(self._read(head, self.LENGTH.size))
+        data = self._read(head + self.LENGTH.size, n)
+        self.head.value = head + self.LENGTH.size + n
         return data
 
-def establish_tcp_connections(host_ip):
+    def get_all(self):
+        """
+        Returns: a list of every string in the ring, oldest first.
+        """
+        items = []
+        data = self.get()
+        while data is not None:
+            items.append(data)
+            data = self.get()
+        return items
+
+class Poller(object):
+    """
+    Waits for WrappedSockets to have data to read, using epoll where it is
+    available and poll or select elsewhere, so that a network layer only
+    reads from the sockets that have something for it. LoopbackSockets
+    have no file descriptor and are ready whenever they hold messages.
+    """
+    def __init__(self, socks=()):
+        """
+        Create a poller watching the given sockets. None entries, for
+        players that have left, are skipped.
+        """
+        self.socks = {}
+        self.loops = []
+        if hasattr(select, 'epoll'):
+            self.epoll = select.epoll()
+            self.poll = None
+        elif hasattr(select, 'poll'):
+            self.epoll = None
+            self.poll = select.poll()
+        else:
+            self.epoll = self.poll = None
+        for s in socks:
+            if s:
+                self.register(s)
+
+    def register(self, s):
+        """
+        Start watching a socket.
+        """
+        fd = s.fileno()
+        if fd is None:
+            self.loops.append(s)
+            return
+        self.socks[fd] = s
+        if self.epoll:
+            self.epoll.register(fd, select.EPOLLIN)
+        elif self.poll:
+            self.poll.register(fd, select.POLLIN)
+
+    def unregister(self, s):
+        """
+        Stop watching a socket.
+        """
+        if s in self.loops:
+            self.loops.remove(s)
+            return
+        fd = s.fileno()
+        del self.socks[fd]
+        if self.epoll:
+            self.epoll.unregister(fd)
+        elif self.poll:
+            self.poll.unregister(fd)
+
+    def ready(self, timeout=0):
+        """
+        Wait up to `timeout' seconds for sockets to have data to read, or
+        until one does if `timeout' is None.
+        Returns: the list of sockets with data (or an error) to read.
+        """
+        ready = [s for s in self.loops if s.pending()]
+        if ready:
+            timeout = 0
+        if self.epoll:
+            events = self.epoll.poll(-1 if timeout is None else timeout)
+            fds = [fd for fd, event in events]
+        elif self.poll:
+            events = self.poll.poll(None if timeout is None else timeout * 1000)
+            fds = [fd for fd, event in events]
+        elif self.socks:
+            fds = select.select(self.socks.keys(), [], [], timeout)[0]
+        else:
+            fds = []
+            if timeout:
+                time.sleep(timeout)
+        ready.extend(self.socks[fd] for fd in fds)
+        return ready
+
+    def close(self):
+        if self.epoll:
+            self.epoll.close()
+
+def quorum_size(n_players):
+    """
+    Returns the number of players that make up a majority.
+    """
+    return n_players // 2 + 1
+
+def _send_framed(s, data, prefix=''):
+    """
+    Send `data' over the blocking socket s, prefixed with its length and
+    before that `prefix', all in one write.
+    """
+    s.sendall(prefix + FRAME_HEADER.pack(len(data)) + data)
+
+def _recv_exactly(s, n):
+    """
+    Returns the next `n' bytes from the blocking socket s.
+    """
+    data = ''
+    while len(data) < n:
+        chunk = s.recv(n - len(data))
+        if not chunk:
+            raise sock.error(errno.ECONNRESET, 'connection closed')
+        data += chunk
+    return data
+
+def _recv_framed(s):
+    """
+    Returns the next message sent with _send_framed over the blocking
+    socket s.
+    """
+    n, = FRAME_HEADER.unpack(_recv_exactly(s, FRAME_HEADER.size))
+    return _recv_exactly(s, n)
+
+def _player_versions(conns):
+    """
+    Read the version each player replied with after its StartMsg, waiting
+    up to VERSION_WAIT seconds for any not sent yet.
+    Args: conns - the sockets connected to the other players
+    Returns: the list of the newest version each player speaks, or None
+        for players that sent anything else first, or nothing, which
+        predate the negotiation and speak protocol buffers only.
+    """
+    versions = [None] * len(conns)
+    deadline = time.time() + VERSION_WAIT
+    waiting = set(range(len(conns)))
+    while waiting:
+        left = deadline - time.time()
+        if left <= 0:
+            break
+        ready = select.select([conns[i] for i in waiting], [], [], left)[0]
+        for i in list(waiting):
+            conn = conns[i]
+            if conn not in ready:
+                continue
+            # a player may already be sending game messages
+            head = conn.recv(len(VERSION_MAGIC), sock.MSG_PEEK)
+            if head and head != VERSION_MAGIC and \
+               VERSION_MAGIC.startswith(head):
+                # the rest of the reply is still on its way
+                continue
+            waiting.discard(i)
+            if head != VERSION_MAGIC:
+                continue
+            # the whole reply was sent at once, so it can be read here
+            conn.setblocking(1)
+            _recv_exactly(conn, len(VERSION_MAGIC))
+            reply = pb.PlayerIP()
+            reply.ParseFromString(_recv_framed(conn))
+            conn.setblocking(0)
+            versions[i] = reply.proto_version
+    return versions
+
+def establish_tcp_connections(host_ip, proto_version=PROTO_VERSION):
     """
     Connect to `host_ip' and establish the fully connected network
-    of four players.
+    of players. The number of players, the board size and the protocol
+    version of the game are decided by the coordinator.
     Args: host_ip - the address of the game coordinator, or None if
         the local player is the game coordinator.
-    Returns: a tuple of the local player's number, a list of four
-        nonblocking sockets connected to each player, and a list of
-        the four player addresses.
+        proto_version - the newest protocol version this player speaks
+    Returns: a tuple of the local player's number, a list of
+        nonblocking sockets connected to each player, a list of
+        the player addresses, the (width, height) of the board, and
+        the protocol version of the game.
     """
     local_player = 0
-    player_socks = [None] * N_PLAYERS
-    player_addrs = [host_ip] + [None] * (N_PLAYERS - 1)
 
     # connect to coordinator (player 0)
     host_sock = sock.socket(sock.AF_INET, sock.SOCK_STREAM)
@@ -79,11 +840,36 @@ def establish_tcp_connections(host_ip):
 
     # receive a player number and other addresses
     msg = pb.StartMsg()
-    msg_str = host_sock.recv(1024)
+    msg_str = host_sock.recv(65536)
     msg.ParseFromString(msg_str)
     local_player = msg.player_no
     other_players = [(player.player_no, player.IP) for player in msg.players]
 
+    # coordinators that predate these fields always run four players
+    # on the default board
+    n_players = N_PLAYERS
+    if msg.HasField('n_players'):
+        n_players = msg.n_players
+    board_size = BOARD_SIZE
+    if msg.HasField('width') and msg.HasField('height'):
+        board_size = (msg.width, msg.height)
+    ask_version = msg.ask_version
+    if ask_version:
+        # tell the coordinator the newest version we speak; it chooses
+        # the version of the game once everyone has joined
+        reply = pb.PlayerIP()
+        reply.player_no = local_player
+        reply.IP = LOCAL_ADDR
+        reply.proto_version = proto_version
+        _send_framed(host_sock, reply.SerializeToString(), VERSION_MAGIC)
+    else:
+        # coordinators that predate the negotiation offer the newest
+        # version they speak, and use it whatever we answer
+        proto_version = min(msg.proto_version, proto_version)
+
+    player_socks = [None] * n_players
+    player_addrs = [host_ip] + [None] * (n_players - 1)
+
     # record addresses
     player_addrs[0] = host_ip
     for p, addr in other_players:
@@ -92,18 +878,16 @@ def establish_tcp_connections(host_ip):
     # check that we received the proper amount of information
     assert len(other_players) == local_player - 1
 
-    # prep the host socket for return
-    host_sock.setblocking(0)
     player_socks[0] = host_sock
 
     # listen for connections from other players
     listener = sock.socket(sock.AF_INET, sock.SOCK_STREAM)
     listener.setsockopt(sock.SOL_SOCKET, sock.SO_REUSEADDR, 1)
     listener.bind((LOCAL_ADDR, PORT + local_player))
-    listener.listen(N_PLAYERS - local_player)
+    listener.listen(n_players - local_player)
 
     # process incoming connections
-    for p in range(local_player + 1, N_PLAYERS):
+    for p in range(local_player + 1, n_players):
         conn, addr = listener.accept()
         msg_str = conn.recv(1024)
         msg = pb.PlayerIP()
@@ -132,38 +916,54 @@ def establish_tcp_connections(host_ip):
         p_sock.setblocking(0)
         player_socks[p] = p_sock
 
-    # create self loop
-    player_addrs[local_player] = LOCAL_ADDR
-    player_socks[local_player] = SelfLoopSocket()
+    if ask_version:
+        # the version of the game, once everyone has joined
+        start_msg = pb.StartMsg()
+        start_msg.ParseFromString(_recv_framed(host_sock))
+        proto_version = start_msg.proto_version
 
+    # prep the host socket for return
+    host_sock.setblocking(0)
     player_socks = map(WrappedSocket, player_socks)
 
-    return (local_player, player_socks, player_addrs)
+    # create self loop
+    player_addrs[local_player] = LOCAL_ADDR
+    player_socks[local_player] = LoopbackSocket()
+
+    return (local_player, player_socks, player_addrs, board_size,
+            proto_version)
 
-def coordinate_tcp_connections():
+def coordinate_tcp_connections(n_players=N_PLAYERS, board_size=BOARD_SIZE,
+                               proto_version=PROTO_VERSION):
     """
-    Coordinate the creation of the fully connected network of four
-    players, assigning player numbers by connection order.
-    Returns: a tuple of the local player's number, a list of four
-        nonblocking sockets connected to each player, and a list of
-        the four player addresses.
+    Coordinate the creation of the fully connected network of
+    `n_players' players, assigning player numbers by connection order.
+    The protocol version of the game is the oldest of the newest versions
+    each player speaks, `proto_version' for the coordinator.
+    Returns: a tuple of the local player's number, a list of
+        nonblocking sockets connected to each player, a list of
+        the player addresses, the (width, height) of the board, and
+        the protocol version of the game.
     """
     print 'hosting at', LOCAL_ADDR
 
-    player_socks = [None] * N_PLAYERS
-    player_addrs = [None] * N_PLAYERS
+    player_socks = [None] * n_players
+    player_addrs = [None] * n_players
     # Set up the socket for everyone to connect to
     listener = sock.socket(sock.AF_INET, sock.SOCK_STREAM)
     listener.setsockopt(sock.SOL_SOCKET, sock.SO_REUSEADDR, 1)
     listener.bind((LOCAL_ADDR, PORT))
-    listener.listen(N_PLAYERS)
+    listener.listen(n_players)
 
     # Create our start message that we will add to and send along
     start_msg = pb.StartMsg()
-    start_msg.proto_version = 1
+    start_msg.proto_version = proto_version
+    start_msg.ask_version = True
+    start_msg.n_players = n_players
+    start_msg.width, start_msg.height = board_size
 
     # Accept everyone's connections
-    for i in range(1, N_PLAYERS):
+    for i in range(1, n_players):
         conn, addr = listener.accept()
         conn.setblocking(0)
         # Set up the start message for this player and send
@@ -178,13 +978,51 @@ def coordinate_tcp_connections():
 
     listener.close()
 
+    # play the oldest version anyone speaks, and tell everyone who asked
+    versions = [None] + _player_versions(player_socks[1:])
+    proto_version = min([proto_version] +
+                        [Message.PROTOBUF if v is None else v
+                         for v in versions[1:]])
+    final_msg = pb.StartMsg()
+    final_msg.proto_version = proto_version
+    for i in range(1, n_players):
+        if versions[i] is None:
+            continue
+        final_msg.player_no = i
+        conn = player_socks[i]
+        conn.setblocking(1)
+        _send_framed(conn, final_msg.SerializeToString())
+        conn.setblocking(0)
+
+    player_socks = map(WrappedSocket, player_socks)
+
     # create self loop
     player_addrs[0] = LOCAL_ADDR
-    player_socks[0] = SelfLoopSocket()
+    player_socks[0] = LoopbackSocket()
 
-    player_socks = map(WrappedSocket, player_socks)
+    return (0, player_socks, player_addrs, board_size, proto_version)
 
-    return (0, player_socks, player_addrs)
+def local_connections(n_players=N_PLAYERS, board_size=BOARD_SIZE,
+                      proto_version=PROTO_VERSION):
+    """
+    Create the fully connected network of `n_players' players inside
+    this process, using a socket pair for each pair of players, speaking
+    the given protocol version.
+    Returns: a list with, for each player, the same tuple that
+        establish_tcp_connections returns.
+    """
+    player_socks = [[None] * n_players for p in range(n_players)]
+    for p in range(n_players):
+        player_socks[p][p] = LoopbackSocket()
+        for q in range(p + 1, n_players):
+            a, b = sock.socketpair()
+            a.setblocking(0)
+            b.setblocking(0)
+            player_socks[p][q] = WrappedSocket(a)
+            player_socks[q][p] = WrappedSocket(b)
+    addrs = ['localhost'] * n_players
+    return [(p, player_socks[p], list(addrs), board_size, proto_version)
+            for p in range(n_players)]
 
 if __name__ == '__main__':
     if len(sys.argv) > 1:
@@ -30,16 +30,28 @@ Design Approach:
 * Toggle writes between two different files
 * Include a monotonically incrementing serial number in each write to
   allow determination of the most recent version
-* md5sum the entire content of the data to be written and prefix the write
-  with the digest
+* Checksum the entire content of the data to be written (CRC32 by default,
+  MD5 in files written before the format was versioned) and store the
+  checksum with the data
+* Tag each write with a format version so files in older formats still load
 * fsync() after each write
 
+The DurableLog class is an append-only alternative for state that changes a
+little at a time, such as the records of an Acceptor's promises and accepts.
+Each record is checksummed and appended to a single log file, and in group
+commit mode many records share one fsync. Recovery scans the log and cuts
+off the incomplete tail left by a write that was interrupted. Compaction
+atomically replaces the log with a shorter one, such as a snapshot of the
+state followed by the records after it.
+
 '''
 
 import os
 import os.path
 import hashlib
+import mmap
 import struct
+import zlib
 
 try:
     import cPickle as pickle
@@ -70,10 +82,33 @@ if _fsync is None:
 
 # File format
 #
-#  0:  md5sum of file content
+# Both the files of DurableObjectHandler and the records of DurableLog use
+# the same record format. Version 2 records start with a magic string:
+#
+#  0:  'PXDR'
+#  4:  format version (2)
+#  5:  checksum type (see CHECKSUMS)
+#  6:  unused
+#  8:  serial_number
+# 16:  pickle_length
+# 24:  checksum of the header and the pickle data
+# 24 + checksum size: pickle_data
+#
+# Version 1 records, written before the format was versioned, are still read:
+#
+#  0:  md5sum of the rest of the record
 # 16:  serial_number
 # 24:  pickle_length
 # 32+: pickle_data
+#
+# A version 1 record whose md5sum starts with the magic string is misread as
+# a version 2 record, but then fails its checksum, so the chance of it being
+# taken for a corrupted record is 1 in 2**32.
+
+MAGIC          = 'PXDR'
+VERSION        = 2
+HEADER         = struct.Struct('>4sBBxxQQ')
+V1_HEADER      = struct.Struct('>16sQQ')
 
 class DurabilityFailure (Exception):
     pass
@@ -90,6 +125,167 @@ class HashMismatch (FileCorrupted):
 class FileTruncated (FileCorrupted):
     pass
 
+class UnknownFormat (FileCorrupted):
+    pass
+
+
+# Checksums are functions from a list of strings (or buffers) to a digest
+# string of a fixed size. MD5 is what version 1 records used; CRC32 and
+# Adler-32 are several times faster and are enough to detect torn and
+# corrupted writes. Other checksums may be added to CHECKSUMS under unused
+# type numbers below 256.
+#
+MD5     = 1
+CRC32   = 2
+ADLER32 = 3
+
+def _md5( buffers ):
+    m = hashlib.md5()
+    for b in buffers:
+        m.update( b )
+    return m.digest()
+
+def _crc32( buffers ):
+    crc = 0
+    for b in buffers:
+        crc = zlib.crc32(b, crc)
+    return struct.pack('>I', crc & 0xffffffff)
+
+def _adler32( buffers ):
+    adler = 1
+    for b in buffers:
+        adler = zlib.adler32(b, adler)
+    return struct.pack('>I', adler & 0xffffffff)
+
+# checksum type -> (digest size, checksum function)
+CHECKSUMS = { MD5     : (16, _md5),
+              CRC32   : (4,  _crc32),
+              ADLER32 : (4,  _adler32) }
+
+
+def _find_writev():
+    '''
+    Returns a function writing a list of strings to a file descriptor with a
+    single writev call and returning the number of bytes written, or None if
+    there is no writev.
+    '''
+    if hasattr(os, 'writev'):
+        return os.writev
+    try:
+        import ctypes, ctypes.util
+    except ImportError:
+        return None
+
+    class iovec (ctypes.Structure):
+        _fields_ = [('iov_base', ctypes.c_char_p), ('iov_len', ctypes.c_size_t)]
+
+    try:
+        libc   = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        writev = libc.writev
+    except (OSError, AttributeError, TypeError):
+        return None
+    writev.argtypes = [ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_int]
+    writev.restype  = ctypes.c_ssize_t
+
+    def _writev( fd, buffers ):
+        # the iovecs point at the strings themselves, nothing is copied
+        iov = (iovec * len(buffers))(*[(b, len(b)) for b in buffers])
+        n   = writev(fd, iov, len(buffers))
+        if n < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return n
+    return _writev
+
+_writev = _find_writev()
+
+# the most buffers passed to one writev call (the usual IOV_MAX)
+IOV_MAX = 1024
+
+# writes shorter than this are joined and written with os.write, since
+# copying them costs less than building the writev call
+JOIN_BELOW = 1 << 14
+
+
+def write_all( fd, buffers ):
+    '''
+    Writes the list of strings to fd one after another. Unless they are short
+    they are not joined first, where writev is available.
+    '''
+    for i in range(0, len(buffers), IOV_MAX):
+        chunk = buffers[i : i + IOV_MAX]
+        total = sum(len(b) for b in chunk)
+
+        if _writev is not None and total >= JOIN_BELOW:
+            written = _writev(fd, chunk)
+        else:
+            written = 0
+
+        if written < total:
+            data = ''.join(chunk)
+            while written < total:
+                written += os.write(fd, data[written:])
+
+
+def encode_record( serial_number, pyobject, checksum=CRC32 ):
+    '''
+    Returns: the list of strings making up the record for pyobject
+    '''
+    size, func  = CHECKSUMS[checksum]
+    data_pickle = pickle.dumps(pyobject, pickle.HIGHEST_PROTOCOL)
+    header      = HEADER.pack(MAGIC, VERSION, checksum, serial_number,
+                              len(data_pickle))
+
+    return [header, func([header, data_pickle]), data_pickle]
+
+
+def decode_record( data, offset=0 ):
+    '''
+    Decodes the record starting at offset in data, which may be a string or
+    an mmap, in either version of the format.
+
+    Returns: (serial_number, unpickled_object, offset_past_the_record) or raises
+             a FileCorrupted exception
+    '''
+    if data[offset : offset + 4] == MAGIC:
+        if offset + HEADER.size > len(data):
+            raise FileTruncated()
+
+        magic, version, checksum, serial_number, pickle_length = \
+            HEADER.unpack_from(data, offset)
+
+        if version != VERSION or checksum not in CHECKSUMS:
+            raise UnknownFormat()
+
+        size, func = CHECKSUMS[checksum]
+        start      = offset + HEADER.size + size
+        end        = start + pickle_length
+
+        if end > len(data):
+            raise FileTruncated()
+
+        digest = func([buffer(data, offset, HEADER.size),
+                       buffer(data, start, pickle_length)])
+
+        if not digest == data[offset + HEADER.size : start]:
+            raise HashMismatch()
+
+    else:
+        if offset + V1_HEADER.size > len(data):
+            raise FileTruncated()
+
+        md5hash, serial_number, pickle_length = V1_HEADER.unpack_from(data, offset)
+
+        start = offset + V1_HEADER.size
+        end   = start + pickle_length
+
+        if end > len(data):
+            raise FileTruncated()
+
+        if not _md5([buffer(data, offset + 16, 16 + pickle_length)]) == md5hash:
+            raise HashMismatch()
+
+    return serial_number, pickle.loads(data[start : end]), end
 
 
 def read( fd ):
@@ -97,60 +293,62 @@ def read( fd ):
     Returns: (serial_number, unpickled_object) or raises a FileCorrupted exception
     '''
     os.lseek(fd, 0, os.SEEK_SET)
-        
-    md5hash       = os.read(fd, 16)
-    data1         = os.read(fd, 8)
-    data2         = os.read(fd, 8)
-    
-    if ( (not md5hash or len(md5hash) != 16) or
-         (not data1   or len(data1)   !=  8) or
-         (not data2   or len(data2)   !=  8) ):
-        raise FileTruncated()
-    
-    serial_number = struct.unpack('>Q', data1)[0]
-    pickle_length = struct.unpack('>Q', data2)[0]
 
-    data3         = os.read(fd, pickle_length)
+    data = os.read(fd, os.fstat(fd).st_size)
 
-    if not data3 or len(data3) != pickle_length:
-        raise FileTruncated()
+    serial_number, obj, end = decode_record( data )
 
-    m = hashlib.md5()
-    m.update( data1 )
-    m.update( data2 )
-    m.update( data3 )
-    
-    if not m.digest() == md5hash:
-        raise HashMismatch()
-    
-    return serial_number, pickle.loads(data3)
-    
+    return serial_number, obj
 
-    
-def write( fd, serial_number, pyobject ):
+
+def write( fd, serial_number, pyobject, checksum=CRC32 ):
     os.lseek(fd, 0, os.SEEK_SET)
 
-    data_pickle = pickle.dumps(pyobject, pickle.HIGHEST_PROTOCOL)
-    data_serial = struct.pack('>Q', serial_number)
-    data_length = struct.pack('>Q', len(data_pickle))
+    write_all(fd, encode_record(serial_number, pyobject, checksum))
 
-    m = hashlib.md5()
-    m.update( data_serial )
-    m.update( data_length )
-    m.update( data_pickle )
+    _fsync(fd)
 
-    os.write(fd, ''.join([m.digest(), data_serial, data_length, data_pickle]))
 
-    _fsync(fd)
+def decode_records( data, serial_number=1 ):
+    '''
+    Decodes the log records at the start of data, stopping at the first one
+    that is truncated, fails its checksum, or is out of sequence. Such a
+    record is the tail of a write that did not complete.
+
+    Returns: (list_of_unpickled_objects, length_of_the_intact_records)
+    '''
+    objects = []
+    offset  = 0
+
+    while offset < len(data):
+        try:
+            serial, obj, end = decode_record( data, offset )
+        except FileCorrupted:
+            break
+
+        if serial != serial_number:
+            break
+
+        objects.append( obj )
+        offset         = end
+        serial_number += 1
+
+    return objects, offset
 
 
 class DurableObjectHandler (object):
     
-    def __init__(self, dirname, object_id):
+    def __init__(self, dirname, object_id, checksum=CRC32):
         '''
         Throws UnrecoverableFailure if both files are corrupted
+
+        checksum is the type of checksum new saves are written with (see
+        CHECKSUMS). Files written with any checksum, or in the unversioned
+        format, are read.
         '''
         
+        self.checksum = checksum
+
         if not os.path.isdir(dirname):
             raise Exception('Invalid directory: ' + dirname)
 
@@ -228,6 +426,191 @@ class DurableObjectHandler (object):
         self.fd_next = self.fd_a if self.fd_next == self.fd_b else self.fd_b
         self.recovered = None
     
-        write( fd, serial, obj )
+        write( fd, serial, obj, self.checksum )
 
         
+
+
+
+class DurableLog (object):
+    '''
+    An append-only write-ahead log of objects, such as the promise and accept
+    records of Acceptors. Where DurableObjectHandler rewrites the whole state
+    on every save, the log only writes the record that changed it.
+
+    Each appended object is written as a checksummed record at the end of a
+    single file. Without group commit every append is written and flushed to
+    the disk before it returns. With group commit appended records are held
+    in memory until commit() writes them all with a single writev and a single
+    fsync, so a batch of promises and accepts costs one disk flush. Records
+    appended since the last commit are lost if the application fails.
+
+    On recovery the log is scanned from the start and stops at the first
+    record that is incomplete or corrupted. That tail can only be left by a
+    write that was interrupted, so it is cut off and later records are
+    appended in its place. The recovered objects are available, in the order
+    they were appended, from the 'recovered' attribute.
+
+    The log only grows until compact() replaces its records with fewer,
+    such as a snapshot of the state they built up.
+    '''
+
+    def __init__(self, dirname, log_id, group_commit=False, checksum=CRC32):
+        '''
+        Throws Exception if dirname is not a directory
+
+        checksum is the type of checksum new records are written with (see
+        CHECKSUMS). Records written with any checksum, or in the unversioned
+        format, are read.
+        '''
+        if not os.path.isdir(dirname):
+            raise Exception('Invalid directory: ' + dirname)
+
+        self.dirname      = dirname
+        self.fn           = os.path.join(dirname, str(log_id) + '.wal')
+        self.group_commit = group_commit
+        self.checksum     = checksum
+        self.pending      = []
+        self.records      = 0
+        self.syncs        = 0
+        self.compactions  = 0
+
+        sync_dir = not os.path.exists(self.fn)
+
+        bin_flag = 0 if not hasattr(os, 'O_BINARY') else os.O_BINARY
+
+        self.fd = os.open(self.fn, os.O_CREAT | os.O_RDWR | bin_flag)
+
+        if sync_dir and hasattr(os, 'O_DIRECTORY'):
+            fdd = os.open(dirname, os.O_DIRECTORY | os.O_RDONLY)
+            os.fsync(fdd)
+            os.close(fdd)
+
+        self.recover()
+
+
+    def recover(self):
+        '''
+        Discards any records appended but not committed.
+
+        Returns: the list of objects in the log
+        '''
+        size = os.fstat(self.fd).st_size
+
+        if size:
+            # the log is decoded in place rather than read into memory
+            data = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ)
+            try:
+                self.recovered, self.length = decode_records( data )
+            finally:
+                data.close()
+        else:
+            self.recovered, self.length = [], 0
+
+        if self.length < size:
+            os.ftruncate(self.fd, self.length)
+            _fsync(self.fd)
+
+        os.lseek(self.fd, self.length, os.SEEK_SET)
+
+        self.records = len(self.recovered)
+        self.serial  = self.records + 1
+        self.pending = []
+
+        return self.recovered
+
+
+    def close(self):
+        '''
+        Commits any pending records and closes the log
+        '''
+        if self.fd is not None:
+            self.commit()
+            os.close(self.fd)
+            self.fd = None
+
+
+    def append(self, obj):
+        '''
+        Adds obj to the end of the log. Unless the log uses group commit the
+        record is on the disk when this method returns.
+
+        Returns: the serial number of the record
+        '''
+        serial = self.serial
+
+        self.serial += 1
+        self.pending.extend( encode_record(serial, obj, self.checksum) )
+
+        if not self.group_commit:
+            self.commit()
+
+        return serial
+
+
+    def commit(self):
+        '''
+        Writes every pending record to the log and flushes them to the disk
+        with a single fsync.
+
+        Returns: the number of records written
+        '''
+        if not self.pending:
+            return 0
+
+        buffers = self.pending
+        n       = self.serial - 1 - self.records
+
+        self.pending = []
+
+        write_all(self.fd, buffers)
+
+        _fsync(self.fd)
+
+        self.length  += sum(len(b) for b in buffers)
+        self.records += n
+        self.syncs   += 1
+
+        return n
+
+
+    def compact(self, objects):
+        '''
+        Replaces everything in the log with objects, such as a snapshot of
+        the state the earlier records built up followed by the records still
+        needed on top of it. Pending records are committed to the old log
+        first. The new log is written to a temporary file which is renamed
+        over the old one, so a failure at any point leaves either the old
+        log or the new one.
+        '''
+        self.commit()
+
+        tmp      = self.fn + '.tmp'
+        bin_flag = 0 if not hasattr(os, 'O_BINARY') else os.O_BINARY
+        fd       = os.open(tmp, os.O_CREAT | os.O_TRUNC | os.O_RDWR | bin_flag)
+
+        buffers = []
+        for serial, obj in enumerate(objects):
+            buffers.extend( encode_record(serial + 1, obj, self.checksum) )
+
+        try:
+            write_all(fd, buffers)
+            _fsync(fd)
+            os.rename(tmp, self.fn)
+        except:
+            os.close(fd)
+            raise
+
+        if hasattr(os, 'O_DIRECTORY'):
+            fdd = os.open(self.dirname, os.O_DIRECTORY | os.O_RDONLY)
+            os.fsync(fdd)
+            os.close(fdd)
+
+        os.close(self.fd)
+
+        self.fd           = fd
+        self.length       = sum(len(b) for b in buffers)
+        self.records      = len(objects)
+        self.serial       = self.records + 1
+        self.syncs       += 1
+        self.compactions += 1
@@ -19,7 +19,7 @@ _sym_db = _symbol_database.Default()
 DESCRIPTOR = _descriptor.FileDescriptor(
   name='paxosmsg.proto',
   package='Paxosmsg',
-  serialized_pb=_b('\n\x0epaxosmsg.proto\x12\x08Paxosmsg\"\x80\x01\n\x03msg\x12\x1c\n\x04type\x18\x01 \x02(\x0e\x32\x0e.Paxosmsg.type\x12\x10\n\x08\x66rom_uid\x18\x02 \x02(\x05\x12\x13\n\x0bproposal_id\x18\x03 \x01(\t\x12\x13\n\x0bprevious_id\x18\x04 \x01(\t\x12\r\n\x05value\x18\x05 \x01(\t\x12\x10\n\x08instance\x18\x06 \x02(\x05*\x86\x01\n\x04type\x12\x0b\n\x07PREPARE\x10\x01\x12\x0b\n\x07PROMISE\x10\x02\x12\n\n\x06\x41\x43\x43\x45PT\x10\x03\x12\x0c\n\x08\x41\x43\x43\x45PTED\x10\x04\x12\x10\n\x0cNACK_PREPARE\x10\x05\x12\x0f\n\x0bNACK_ACCEPT\x10\x06\x12\r\n\tHEARTBEAT\x10\x07\x12\x0b\n\x07REQUEST\x10\x08\x12\x0b\n\x07REFUSAL\x10\t')
+  serialized_pb=_b('\n\x0epaxosmsg.proto\x12\x08Paxosmsg\"\xbf\x02\n\x03msg\x12\x1c\n\x04type\x18\x01 \x02(\x0e\x32\x0e.Paxosmsg.type\x12\x10\n\x08\x66rom_uid\x18\x02 \x02(\x05\x12\x13\n\x0bproposal_id\x18\x03 \x01(\t\x12\x13\n\x0bprevious_id\x18\x04 \x01(\t\x12\r\n\x05value\x18\x05 \x01(\t\x12\x10\n\x08instance\x18\x06 \x02(\x05\x12\x17\n\x0fproposal_number\x18\x07 \x01(\r\x12\x14\n\x0cproposal_uid\x18\x08 \x01(\r\x12\x17\n\x0fprevious_number\x18\t \x01(\r\x12\x14\n\x0cprevious_uid\x18\n \x01(\r\x12\x0e\n\x06values\x18\x0b \x03(\x0c\x12\x11\n\thas_value\x18\x0c \x01(\x08\x12\x12\n\x06\x63ounts\x18\r \x03(\rB\x02\x10\x01\x12\x10\n\x08snapshot\x18\x0e \x01(\x0c\x12\x16\n\x0etakes_snapshot\x18\x0f \x01(\x08*\xad\x01\n\x04type\x12\x0b\n\x07PREPARE\x10\x01\x12\x0b\n\x07PROMISE\x10\x02\x12\n\n\x06\x41\x43\x43\x45PT\x10\x03\x12\x0c\n\x08\x41\x43\x43\x45PTED\x10\x04\x12\x10\n\x0cNACK_PREPARE\x10\x05\x12\x0f\n\x0bNACK_ACCEPT\x10\x06\x12\r\n\tHEARTBEAT\x10\x07\x12\x0b\n\x07REQUEST\x10\x08\x12\x0b\n\x07REFUSAL\x10\t\x12\x0b\n\x07\x43\x41TCHUP\x10\n\x12\n\n\x06VALUES\x10\x0b\x12\x0c\n\x08SNAPSHOT\x10\x0c')
 )
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
@@ -65,11 +65,23 @@ _TYPE = _descriptor.EnumDescriptor(
       name='REFUSAL', index=8, number=9,
       options=None,
       type=None),
+    _descriptor.EnumValueDescriptor(
+      name='CATCHUP', index=9, number=10,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='VALUES', index=10, number=11,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='SNAPSHOT', index=11, number=12,
+      options=None,
+      type=None),
   ],
   containing_type=None,
   options=None,
-  serialized_start=160,
-  serialized_end=294,
+  serialized_start=351,
+  serialized_end=524,
 )
 _sym_db.RegisterEnumDescriptor(_TYPE)
 
@@ -83,6 +95,9 @@ NACK_ACCEPT = 6
 HEARTBEAT = 7
 REQUEST = 8
 REFUSAL = 9
+CATCHUP = 10
+VALUES = 11
+SNAPSHOT = 12
 
 
 
@@ -135,6 +150,69 @@ _MSG = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='proposal_number', full_name='Paxosmsg.msg.proposal_number', index=6,
+      number=7, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='proposal_uid', full_name='Paxosmsg.msg.proposal_uid', index=7,
+      number=8, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='previous_number', full_name='Paxosmsg.msg.previous_number', index=8,
+      number=9, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='previous_uid', full_name='Paxosmsg.msg.previous_uid', index=9,
+      number=10, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='values', full_name='Paxosmsg.msg.values', index=10,
+      number=11, type=12, cpp_type=9, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='has_value', full_name='Paxosmsg.msg.has_value', index=11,
+      number=12, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='counts', full_name='Paxosmsg.msg.counts', index=12,
+      number=13, type=13, cpp_type=3, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='snapshot', full_name='Paxosmsg.msg.snapshot', index=13,
+      number=14, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='takes_snapshot', full_name='Paxosmsg.msg.takes_snapshot', index=14,
+      number=15, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -147,7 +225,7 @@ _MSG = _descriptor.Descriptor(
   oneofs=[
   ],
   serialized_start=29,
-  serialized_end=157,
+  serialized_end=348,
 )
 
 _MSG.fields_by_name['type'].enum_type = _TYPE
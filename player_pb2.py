@@ -18,7 +18,7 @@ _sym_db = _symbol_database.Default()
 DESCRIPTOR = _descriptor.FileDescriptor(
   name='player.proto',
   package='Player',
-  serialized_pb=_b('\n\x0cplayer.proto\x12\x06Player\")\n\x08PlayerIP\x12\x11\n\tplayer_no\x18\x01 \x02(\r\x12\n\n\x02IP\x18\x02 \x02(\t\"W\n\x08StartMsg\x12\x15\n\rproto_version\x18\x01 \x02(\r\x12\x11\n\tplayer_no\x18\x02 \x02(\r\x12!\n\x07players\x18\x03 \x03(\x0b\x32\x10.Player.PlayerIP\"\x81\x01\n\x07GameMsg\x12\r\n\x05mtype\x18\x01 \x02(\r\x12\x11\n\tplayer_no\x18\x02 \x02(\r\x12%\n\x03pos\x18\x03 \x01(\x0b\x32\x18.Player.GameMsg.Position\x12\x0b\n\x03\x64ir\x18\x04 \x01(\r\x1a \n\x08Position\x12\t\n\x01x\x18\x01 \x02(\x02\x12\t\n\x01y\x18\x02 \x02(\x02')
+  serialized_pb=_b('\n\x0cplayer.proto\x12\x06Player\"@\n\x08PlayerIP\x12\x11\n\tplayer_no\x18\x01 \x02(\r\x12\n\n\x02IP\x18\x02 \x02(\t\x12\x15\n\rproto_version\x18\x03 \x01(\r\"\x9e\x01\n\x08StartMsg\x12\x15\n\rproto_version\x18\x01 \x02(\r\x12\x11\n\tplayer_no\x18\x02 \x02(\r\x12!\n\x07players\x18\x03 \x03(\x0b\x32\x10.Player.PlayerIP\x12\x11\n\tn_players\x18\x04 \x01(\r\x12\r\n\x05width\x18\x05 \x01(\r\x12\x0e\n\x06height\x18\x06 \x01(\r\x12\x13\n\x0b\x61sk_version\x18\x07 \x01(\x08\"\x8f\x01\n\x07GameMsg\x12\r\n\x05mtype\x18\x01 \x02(\r\x12\x11\n\tplayer_no\x18\x02 \x02(\r\x12%\n\x03pos\x18\x03 \x01(\x0b\x32\x18.Player.GameMsg.Position\x12\x0b\n\x03\x64ir\x18\x04 \x01(\r\x12\x0c\n\x04tick\x18\x05 \x01(\r\x1a \n\x08Position\x12\t\n\x01x\x18\x01 \x02(\x02\x12\t\n\x01y\x18\x02 \x02(\x02')
 )
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
@@ -46,6 +46,13 @@ _PLAYERIP = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='proto_version', full_name='Player.PlayerIP.proto_version', index=2,
+      number=3, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -58,7 +65,7 @@ _PLAYERIP = _descriptor.Descriptor(
   oneofs=[
   ],
   serialized_start=24,
-  serialized_end=65,
+  serialized_end=88,
 )
 
 
@@ -90,6 +97,34 @@ _STARTMSG = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='n_players', full_name='Player.StartMsg.n_players', index=3,
+      number=4, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='width', full_name='Player.StartMsg.width', index=4,
+      number=5, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='height', full_name='Player.StartMsg.height', index=5,
+      number=6, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='ask_version', full_name='Player.StartMsg.ask_version', index=6,
+      number=7, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -101,8 +136,8 @@ _STARTMSG = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=67,
-  serialized_end=154,
+  serialized_start=91,
+  serialized_end=249,
 )
 
 
@@ -138,8 +173,8 @@ _GAMEMSG_POSITION = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=254,
-  serialized_end=286,
+  serialized_start=363,
+  serialized_end=395,
 )
 
 _GAMEMSG = _descriptor.Descriptor(
@@ -177,6 +212,13 @@ _GAMEMSG = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='tick', full_name='Player.GameMsg.tick', index=4,
+      number=5, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -188,8 +230,8 @@ _GAMEMSG = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=157,
-  serialized_end=286,
+  serialized_start=252,
+  serialized_end=395,
 )
 
 _STARTMSG.fields_by_name['players'].message_type = _PLAYERIP
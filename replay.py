@@ -0,0 +1,416 @@
+"""
+replay.py
+
+Records games to compact binary replay files and plays them back.
+
+A ReplayWriter set as a GameState's recorder appends a fixed-size record
+for every advance, move and kill applied to the game (and the exit
+messages seen by the game loop), with its time, or its tick in tick
+mode. Every so often it also writes a checkpoint holding a snapshot of
+the whole game, and when it is closed it writes an index of the
+checkpoints at the end of the file.
+
+A ReplayReader memory-maps a replay file, binary searches the index for
+the last checkpoint before a given time, restores it and replays the
+records after it, so any point of a game can be reached without playing
+the game from the start. Each checkpoint also carries the number of
+messages applied so far and a running CRC of them, which lets two
+players' replays of the same game be compared checkpoint by checkpoint
+to find the first message they disagree on.
+
+File layout (all fields big-endian):
+
+    header       'LCRP', version, players, width, height, speed,
+                 tick rate (0 if none), start time
+    records      advance, move, kill, exit and checkpoint records
+    index        (time, messages, crc, offset) of every checkpoint
+    trailer      index offset, number of index entries, 'LCRX'
+
+A file whose writer never got to close it has no index; the reader
+rebuilds it by scanning the records.
+
+Usage:
+    python replay.py info FILE
+    python replay.py play FILE [UNTIL [SPEED]]
+    python replay.py diff FILE FILE
+"""
+
+import sys, time, mmap, struct, zlib
+
+from game_utils import GameState, Direction
+
+MAGIC = 'LCRP'
+INDEX_MAGIC = 'LCRX'
+VERSION = 1
+
+HEADER = struct.Struct('!4sHHIIIId')
+INDEX_ENTRY = struct.Struct('!dIIQ')
+TRAILER = struct.Struct('!QI4s')
+
+# record kinds
+ADVANCE, MOVE, KILL, EXIT, CHECKPOINT = range(1, 6)
+
+# every record starts with its kind and the time it was applied at
+RECORDS = {ADVANCE: struct.Struct('!Bd'),
+           MOVE: struct.Struct('!BdHddB'),
+           KILL: struct.Struct('!BdH'),
+           EXIT: struct.Struct('!BdH'),
+           # followed by a snapshot of `length' bytes
+           CHECKPOINT: struct.Struct('!BdIII')}
+
+# what goes into the message CRC; times are left out in real-time mode
+# because every player applies messages at different times
+_DIGEST_MOVE = struct.Struct('!BHddB')
+_DIGEST_PLAYER = struct.Struct('!BH')
+_DIGEST_TICK = struct.Struct('!d')
+
+_directions = tuple(Direction)
+
+class ReplayWriter(object):
+    """
+    Records a game to a replay file. Creating the writer sets it as the
+    game's recorder and writes a first checkpoint, so it should be created
+    after the game is started.
+    """
+    def __init__(self, path, game, checkpoint_messages=256,
+                 checkpoint_frames=600):
+        """
+        Args:
+            path - the file to write the replay to
+            game - the started GameState to record
+            checkpoint_messages - write a checkpoint every this many
+                messages. All players checkpoint at the same messages,
+                which is what lets their replays be diffed.
+            checkpoint_frames - also write a checkpoint every this many
+                frames, to bound the time taken to seek
+        """
+        self.file = open(path, 'wb')
+        self.game = game
+        self.checkpoint_messages = checkpoint_messages
+        self.checkpoint_frames = checkpoint_frames
+        self.tick_mode = bool(game.tick_rate)
+        self.messages = 0
+        self.digest = 0
+        self.frames = 0
+        self.index = []
+        self.now = game.now()
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(game.state),
+                                    game.width, game.height, game.speed,
+                                    game.tick_rate or 0, game.start_time))
+        game.recorder = self
+        self.checkpoint()
+
+    def _message(self, digest_bytes, when):
+        """
+        Add a message to the running CRC and checkpoint if it is time to.
+        """
+        if self.tick_mode:
+            digest_bytes += _DIGEST_TICK.pack(when)
+        self.digest = zlib.crc32(digest_bytes, self.digest) & 0xffffffff
+        self.messages += 1
+        if self.messages % self.checkpoint_messages == 0:
+            self.checkpoint()
+
+    def advance(self, when):
+        self.now = when
+        self.file.write(RECORDS[ADVANCE].pack(ADVANCE, when))
+        self.frames += 1
+        if self.frames % self.checkpoint_frames == 0:
+            self.checkpoint()
+
+    def move(self, player, pos, direction, when):
+        self.file.write(RECORDS[MOVE].pack(MOVE, when, player, pos[0], pos[1],
+                                           direction.value))
+        self._message(_DIGEST_MOVE.pack(MOVE, player, pos[0], pos[1],
+                                        direction.value), when)
+
+    def kill(self, player):
+        self.file.write(RECORDS[KILL].pack(KILL, self.now, player))
+        self._message(_DIGEST_PLAYER.pack(KILL, player), self.now)
+
+    def exit(self, player):
+        """
+        Record an exit message from the given player.
+        """
+        self.file.write(RECORDS[EXIT].pack(EXIT, self.now, player))
+        self._message(_DIGEST_PLAYER.pack(EXIT, player), self.now)
+
+    def checkpoint(self):
+        """
+        Write a snapshot of the game and add it to the index.
+        """
+        data = self.game.snapshot()
+        offset = self.file.tell()
+        self.file.write(RECORDS[CHECKPOINT].pack(CHECKPOINT, self.now,
+                                                 self.messages, self.digest,
+                                                 len(data)))
+        self.file.write(data)
+        self.index.append((self.now, self.messages, self.digest, offset))
+
+    def close(self):
+        """
+        Write the index and stop recording.
+        """
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(TRAILER.pack(index_offset, len(self.index),
+                                     INDEX_MAGIC))
+        self.file.close()
+        if self.game.recorder is self:
+            self.game.recorder = None
+
+class ReplayReader(object):
+    """
+    Reads a replay file written by ReplayWriter.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.n_players, width, height, self.speed,
+         tick_rate, self.start_time) = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError('%s is not a replay file' % path)
+        if version != VERSION:
+            raise ValueError('unsupported replay version %d' % version)
+        self.size = (width, height)
+        self.tick_rate = tick_rate or None
+
+        self.end = len(self.data)
+        self.entries = None
+        if self.end >= HEADER.size + TRAILER.size:
+            index_offset, count, magic = TRAILER.unpack_from(
+                self.data, self.end - TRAILER.size)
+            if magic == INDEX_MAGIC and \
+               index_offset + count * INDEX_ENTRY.size == self.end - TRAILER.size:
+                self.end = index_offset
+                self.index_offset = index_offset
+                self.count = count
+        if self.end == len(self.data):
+            # the writer did not finish, so rebuild the index
+            self.entries = [(fields[1], fields[2], fields[3], offset)
+                            for kind, offset, fields in self.records()
+                            if kind == CHECKPOINT]
+            self.count = len(self.entries)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def entry(self, i):
+        """
+        Returns the i-th index entry, a tuple of the time, the number of
+        messages applied, the message CRC and the offset of a checkpoint.
+        """
+        if self.entries is not None:
+            return self.entries[i]
+        return INDEX_ENTRY.unpack_from(self.data,
+                                       self.index_offset + i * INDEX_ENTRY.size)
+
+    def seek(self, when):
+        """
+        Returns the number of the last checkpoint at or before `when', or
+        of the first checkpoint if they are all later.
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0] <= when:
+                lo = mid + 1
+            else:
+                hi = mid
+        return max(lo - 1, 0)
+
+    def records(self, offset=HEADER.size):
+        """
+        Yields the (kind, offset, fields) of every record from `offset' to
+        the end of the records. A truncated last record is ignored.
+        """
+        data = self.data
+        end = self.end
+        while offset < end:
+            kind = ord(data[offset])
+            record = RECORDS.get(kind)
+            if record is None or offset + record.size > end:
+                return
+            fields = record.unpack_from(data, offset)
+            yield kind, offset, fields
+            offset += record.size
+            if kind == CHECKPOINT:
+                offset += fields[4]
+
+    def snapshot(self, offset):
+        """
+        Returns the snapshot of the checkpoint at `offset'.
+        """
+        start = offset + RECORDS[CHECKPOINT].size
+        length = RECORDS[CHECKPOINT].unpack_from(self.data, offset)[4]
+        return self.data[start:start + length]
+
+    def new_game(self):
+        """
+        Returns a GameState set up like the recorded one.
+        """
+        return GameState(self.size, self.speed, self.tick_rate, self.n_players)
+
+    def play(self, until=None, speed=None, game=None):
+        """
+        Replay the game.
+        Args:
+            until - the time (or tick) to stop at, or None to play to the end
+            speed - how many times faster than real time to play, or None to
+                play as fast as possible
+            game - the GameState to replay into, by default a new one
+        Returns:
+            The GameState as it was at `until'.
+        """
+        if game is None:
+            game = self.new_game()
+        start = 0
+        if until is not None and speed is None:
+            start = self.seek(until)
+        offset = self.entry(start)[3]
+        game.restore(self.snapshot(offset))
+
+        # game seconds per unit of recorded time
+        scale = 1.0 / self.tick_rate if self.tick_rate else 1.0
+        first = None
+        wall_start = time.time()
+        for kind, offset, fields in self.records(offset):
+            when = fields[1]
+            if kind == ADVANCE:
+                # messages applied after the last advance before `until'
+                # are part of the state at `until'
+                if until is not None and when > until:
+                    break
+                if speed:
+                    if first is None:
+                        first = when
+                    delay = (when - first) * scale / speed - \
+                            (time.time() - wall_start)
+                    if delay > 0:
+                        time.sleep(delay)
+                game.advance(when)
+            elif kind == MOVE:
+                player, x, y, d = fields[2:]
+                game.move(player, (x, y), _directions[d], when)
+            elif kind == KILL:
+                game.kill(fields[2])
+        return game
+
+    def messages(self, i=0):
+        """
+        Yields the (number, time, digest bytes) of every message from the
+        i-th checkpoint on, where the digest bytes are what went into the
+        message CRC.
+        """
+        n = self.entry(i)[1]
+        for kind, offset, fields in self.records(self.entry(i)[3]):
+            if kind == MOVE:
+                player, x, y, d = fields[2:]
+                digest_bytes = _DIGEST_MOVE.pack(MOVE, player, x, y, d)
+            elif kind in (KILL, EXIT):
+                digest_bytes = _DIGEST_PLAYER.pack(kind, fields[2])
+            else:
+                continue
+            if self.tick_rate:
+                digest_bytes += _DIGEST_TICK.pack(fields[1])
+            yield n, fields[1], digest_bytes
+            n += 1
+
+def describe(digest_bytes):
+    """
+    Returns a readable description of a message from its digest bytes.
+    """
+    kind = ord(digest_bytes[0])
+    if kind == MOVE:
+        kind, player, x, y, d = _DIGEST_MOVE.unpack_from(digest_bytes)
+        text = 'move player %d at (%g, %g) %s' % (player, x, y,
+                                                  _directions[d].name)
+        rest = digest_bytes[_DIGEST_MOVE.size:]
+    else:
+        kind, player = _DIGEST_PLAYER.unpack_from(digest_bytes)
+        text = '%s player %d' % ('kill' if kind == KILL else 'exit', player)
+        rest = digest_bytes[_DIGEST_PLAYER.size:]
+    if rest:
+        text += ' on tick %d' % _DIGEST_TICK.unpack(rest)
+    return text
+
+def diff(a, b):
+    """
+    Find the first message on which two replays of the same game differ.
+    The checkpoints both replays took after the same number of messages
+    are binary searched for the last one where the message CRCs agree, and
+    the messages are compared one by one from there.
+    Args:
+        a, b - ReplayReaders
+    Returns:
+        None if the replays agree, otherwise a tuple of the message number
+        and the (time, digest bytes) of that message in each replay, or
+        None for a replay that ended before it.
+    """
+    b_entries = {}
+    for j in range(b.count):
+        b_entries.setdefault(b.entry(j)[1], j)
+    common = [(i, b_entries[a.entry(i)[1]]) for i in range(a.count)
+              if a.entry(i)[1] in b_entries]
+
+    # once the replays differ their CRCs never agree again
+    lo, hi = 0, len(common)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        i, j = common[mid]
+        if a.entry(i)[2] == b.entry(j)[2]:
+            lo = mid + 1
+        else:
+            hi = mid
+    i, j = common[lo - 1] if lo else (0, 0)
+
+    a_messages = a.messages(i)
+    b_messages = b.messages(j)
+    while True:
+        m = next(a_messages, None)
+        n = next(b_messages, None)
+        if m is None and n is None:
+            return None
+        if m is None or n is None or m[2] != n[2]:
+            number = (m or n)[0]
+            return (number, m and m[1:], n and n[1:])
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('info', 'play', 'diff'):
+        print __doc__
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == 'info':
+        replay = ReplayReader(sys.argv[2])
+        print 'Players:', replay.n_players
+        print 'Board:', replay.size
+        print 'Tick rate:', replay.tick_rate
+        print 'Checkpoints:', replay.count
+        last = replay.entry(replay.count - 1)
+        print 'Messages at last checkpoint:', last[1]
+
+    elif command == 'play':
+        replay = ReplayReader(sys.argv[2])
+        until = float(sys.argv[3]) if len(sys.argv) > 3 else None
+        speed = float(sys.argv[4]) if len(sys.argv) > 4 else None
+        start = time.time()
+        game = replay.play(until, speed)
+        print 'Replayed in', time.time() - start, 'sec'
+        print 'Players left:', game.players_left
+        print 'Checksum:', game.checksum()
+
+    else:
+        result = diff(ReplayReader(sys.argv[2]), ReplayReader(sys.argv[3]))
+        if result is None:
+            print 'The replays agree'
+        else:
+            number, mine, theirs = result
+            print 'The replays diverge at message', number
+            for path, m in ((sys.argv[2], mine), (sys.argv[3], theirs)):
+                if m is None:
+                    print '   ', path + ': ended'
+                else:
+                    print '   ', path + ':', describe(m[1]), 'at', m[0]
@@ -0,0 +1,89 @@
+"""
+test_backpressure.py
+
+Checks that a NaiveNetworkLayer whose queue to a slow player refuses a
+move still sends it to that player later, in order, rather than losing
+it.
+"""
+
+import sys, os, unittest
+
+# the tests live one directory below the game modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from network_layers import NaiveNetworkLayer
+from network_utils import local_connections, FRAME_HEADER
+from game_utils import Message, Direction
+
+N_PLAYERS = 2
+N_MOVES = 5
+
+class quiet(object):
+    """
+    Context manager that silences the debugging output of the layers.
+    """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+class BackpressureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.layers = [NaiveNetworkLayer(connection=c)
+                       for c in local_connections(N_PLAYERS)]
+        with quiet():
+            for layer in self.layers:
+                layer.start()
+
+    def tearDown(self):
+        for layer in self.layers:
+            layer.stop()
+            for s in layer.socks:
+                # the loopback to ourselves has no socket to close
+                if hasattr(getattr(s, 'socket', None), 'close'):
+                    s.socket.close()
+
+    def move(self, i):
+        return Message.move(0, (float(i), 1.0), Direction.east)
+
+    def test_refused_moves_are_sent_later(self):
+        sender = self.layers[0]
+        # the queue to player 1 only has room for two moves at a time
+        size = FRAME_HEADER.size + len(
+            self.move(0).serialize(sender.proto_version))
+        sender.socks[1].max_queued = 2 * size
+        results = [sender.broadcast_message(self.move(i))
+                   for i in range(N_MOVES)]
+        self.assertEqual(results, [True, True, False, False, False])
+        self.assertTrue(sender.congested())
+        got = []
+        with quiet():
+            for r in range(100):
+                for layer in self.layers:
+                    msgs = layer.get_messages()
+                    if layer is self.layers[1]:
+                        got.extend(m.pos[0] for m in msgs)
+                if len(got) == N_MOVES:
+                    break
+        self.assertEqual(got, [float(i) for i in range(N_MOVES)])
+        self.assertFalse(sender.congested())
+
+    def test_kills_go_ahead_of_the_backlog(self):
+        sender = self.layers[0]
+        sender.socks[1].max_queued = 0
+        self.assertFalse(sender.broadcast_message(self.move(0)))
+        self.assertTrue(sender.broadcast_message(Message.kill(0)))
+        with quiet():
+            for r in range(10):
+                sender.flush()
+                msgs = self.layers[1].get_messages()
+                if msgs:
+                    break
+        self.assertEqual([m.mtype for m in msgs], [Message.Type.kill])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+test_batcher.py
+
+Checks that the Batcher only holds messages back while they arrive fast
+enough to fill a batch within its longest delay, and then for less time
+the faster they arrive.
+"""
+
+import sys, os, unittest
+
+# the tests live one directory below the game modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from network_utils import Batcher
+
+class Clock(object):
+    """
+    A clock that only moves when told to.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def arrive(batcher, clock, gap, n):
+    """
+    Add `n' messages to the batcher, `gap' seconds apart.
+    """
+    for i in range(n):
+        clock.now += gap
+        batcher.append('move')
+
+class BatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.batcher = Batcher(max_size=64, max_delay=.005, clock=self.clock)
+
+    def test_first_message_is_ready(self):
+        self.batcher.append('move')
+        self.assertTrue(self.batcher.ready())
+
+    def test_sparse_messages_are_not_held(self):
+        # one move a frame at 60 frames a second
+        arrive(self.batcher, self.clock, 1 / 60., 10)
+        self.batcher.take()
+        arrive(self.batcher, self.clock, 1 / 60., 1)
+        self.assertEqual(self.batcher.deadline(), 0.0)
+        self.assertTrue(self.batcher.ready())
+
+    def test_denser_messages_wait_less(self):
+        deadlines = []
+        for gap in (50e-6, 20e-6, 5e-6):
+            arrive(self.batcher, self.clock, gap, 20)
+            self.batcher.take()
+            arrive(self.batcher, self.clock, gap, 1)
+            deadlines.append(self.batcher.deadline())
+            self.assertFalse(self.batcher.ready())
+            self.batcher.take()
+        self.assertTrue(0 < deadlines[2] < deadlines[1] < deadlines[0] <= .005)
+
+    def test_full_batch_is_ready(self):
+        arrive(self.batcher, self.clock, 1e-6, 64)
+        self.assertTrue(self.batcher.ready())
+        self.assertEqual(len(self.batcher.take()), 64)
+
+if __name__ == '__main__':
+    unittest.main()
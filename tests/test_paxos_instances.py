@@ -0,0 +1,101 @@
+"""
+test_paxos_instances.py
+
+Checks that a PartTimeNetworkLayer does not count votes left over from
+an instance it has finished against the instance it is working on.
+"""
+
+import sys, os, unittest
+
+# the tests live one directory below the game modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import paxosmsg_pb2 as pxb
+from network_layers import PartTimeNetworkLayer
+from network_utils import local_connections
+from game_utils import Message, Direction
+
+N_PLAYERS = 3
+VOTES = (pxb.PROMISE, pxb.ACCEPT, pxb.ACCEPTED)
+
+class quiet(object):
+    """
+    Context manager that silences the debugging output of the layers.
+    """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+class OldVotesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.layers = [PartTimeNetworkLayer(connection=c)
+                       for c in local_connections(N_PLAYERS)]
+        self.delivered = [[] for layer in self.layers]
+        # the raw messages each player received, with who sent them
+        self.received = [[] for layer in self.layers]
+        for i, layer in enumerate(self.layers):
+            def read_all(s, j, read_all=layer._read_all, log=self.received[i]):
+                msgs = read_all(s, j)
+                log.extend((j, data) for data in msgs)
+                return msgs
+            layer._read_all = read_all
+        with quiet():
+            for layer in self.layers:
+                layer.start()
+
+    def tearDown(self):
+        for layer in self.layers:
+            layer.stop()
+            for s in layer.socks:
+                # the loopback to ourselves has no socket to close
+                if hasattr(getattr(s, 'socket', None), 'close'):
+                    s.socket.close()
+
+    def run_rounds(self, n):
+        with quiet():
+            for r in range(n):
+                for i, layer in enumerate(self.layers):
+                    for m in layer.get_messages():
+                        self.delivered[i].append(m.pos)
+
+    def commit(self, player, x, max_rounds=500):
+        """
+        Broadcast a move and run rounds until every player delivered it.
+        """
+        pos = (float(x), 1.0)
+        self.layers[player].broadcast_message(
+            Message.move(player, pos, Direction.east))
+        for r in range(max_rounds):
+            self.run_rounds(1)
+            if all(pos in delivered for delivered in self.delivered):
+                break
+
+    def test_old_votes_are_ignored(self):
+        self.run_rounds(200)
+        self.commit(1, 0)
+        for delivered in self.delivered:
+            self.assertIn((0.0, 1.0), delivered)
+        # the votes player 2 took part in while deciding the first move
+        old = [(j, data) for j, data in self.received[2]
+               if pxb.msg.FromString(data).type in VOTES]
+        self.assertTrue(old)
+        self.commit(0, 1)
+        # they arrive again, late, once later moves have been decided
+        for j, data in old:
+            self.layers[j].socks[2].send(data)
+            self.layers[j].flush()
+        self.commit(1, 2)
+        self.commit(0, 3)
+        # every player delivered the same moves in the same order, though
+        # some may not have delivered the latest yet
+        n = min(len(delivered) for delivered in self.delivered)
+        for delivered in self.delivered[1:]:
+            self.assertEqual(delivered[:n], self.delivered[0][:n])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+test_persistence.py
+
+Checks that a PartTimeNetworkLayer logging to disk only sends a promise
+or accept once its record is on the disk, even when the instance it was
+for is resolved before then.
+"""
+
+import sys, os, time, shutil, tempfile, threading, unittest
+
+# the tests live one directory below the game modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import paxosmsg_pb2 as pxb
+from network_layers import PartTimeNetworkLayer
+from network_utils import local_connections
+from game_utils import Message, Direction
+
+N_PLAYERS = 3
+REPLIES = (pxb.PROMISE, pxb.ACCEPTED)
+
+class quiet(object):
+    """
+    Context manager that silences the debugging output of the layers.
+    """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+class GatedLog(object):
+    """
+    Wraps a DurableLog so that commits wait until the gate is opened.
+    """
+    def __init__(self, log):
+        self.log = log
+        self.gate = threading.Event()
+
+    def append(self, record):
+        self.log.append(record)
+
+    def commit(self):
+        self.gate.wait()
+        self.log.commit()
+
+    def compact(self, records):
+        self.log.compact(records)
+
+    def close(self):
+        self.log.close()
+
+class ReplyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirs = [tempfile.mkdtemp() for i in range(N_PLAYERS)]
+        self.layers = [PartTimeNetworkLayer(connection=c, durable_dir=d)
+                       for c, d in zip(local_connections(N_PLAYERS),
+                                       self.dirs)]
+        self.delivered = [[] for layer in self.layers]
+        with quiet():
+            for layer in self.layers:
+                layer.start()
+        # player 2's records never reach the disk until the gate opens
+        slow = self.layers[2]
+        self.log = slow.persister.log = GatedLog(slow.persister.log)
+        # the promises and accepts player 2 sends
+        self.sent = []
+        def send_message(to, msg, *args, **kwargs):
+            self.sent.append(msg.type)
+            return send(to, msg, *args, **kwargs)
+        def broadcast_message(msg, *args, **kwargs):
+            self.sent.append(msg.type)
+            return broadcast(msg, *args, **kwargs)
+        send, broadcast = slow._send_message, slow._broadcast_message
+        slow._send_message = send_message
+        slow._broadcast_message = broadcast_message
+
+    def tearDown(self):
+        self.log.gate.set()
+        for layer in self.layers:
+            layer.stop()
+            for s in layer.socks:
+                # the loopback to ourselves has no socket to close
+                if hasattr(getattr(s, 'socket', None), 'close'):
+                    s.socket.close()
+        for d in self.dirs:
+            shutil.rmtree(d)
+
+    def run_rounds(self, n):
+        with quiet():
+            for r in range(n):
+                # give the disk time to keep up
+                time.sleep(.001)
+                for i, layer in enumerate(self.layers):
+                    for m in layer.get_messages():
+                        self.delivered[i].append(m.pos)
+
+    def test_replies_wait_for_the_disk(self):
+        # let a leader get elected
+        self.run_rounds(200)
+        pos = (0.0, 1.0)
+        self.layers[1].broadcast_message(Message.move(1, pos, Direction.east))
+        for r in range(500):
+            self.run_rounds(1)
+            if all(pos in delivered for delivered in self.delivered):
+                break
+        # the other two players resolved the instance, and player 2
+        # learned of it, while its promise and accept were not on the disk
+        self.assertIn(pos, self.delivered[2])
+        self.assertTrue(self.layers[2].persister.pending())
+        self.assertFalse([t for t in self.sent if t in REPLIES])
+        self.log.gate.set()
+        for r in range(200):
+            self.run_rounds(1)
+            if pxb.PROMISE in self.sent:
+                break
+        self.assertIn(pxb.PROMISE, self.sent)
+
+if __name__ == '__main__':
+    unittest.main()
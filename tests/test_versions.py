@@ -0,0 +1,150 @@
+"""
+test_versions.py
+
+Checks that the players agree on the protocol version of the game when
+they do not all speak the same versions: the coordinator plays the
+oldest of them and tells everyone, including players that are older
+than the version negotiation itself.
+"""
+
+import sys, os, time, struct, threading, unittest
+import socket as sock
+
+# the tests live one directory below the game modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import player_pb2 as pb
+import network_utils
+from network_utils import coordinate_tcp_connections, \
+    establish_tcp_connections, LOCAL_ADDR, PORT
+from game_utils import Message, Direction
+
+def legacy_join(host_ip):
+    """
+    Join the way players did before the version negotiation: take the
+    StartMsg and set up the connections to the other players without
+    answering the coordinator, and speak protocol buffers.
+    Returns: the player number and the sockets connected to each player.
+    """
+    host_sock = sock.create_connection((host_ip, PORT))
+    msg = pb.StartMsg()
+    msg.ParseFromString(host_sock.recv(65536))
+    local_player = msg.player_no
+    socks = [None] * msg.n_players
+    socks[0] = host_sock
+    listener = sock.socket(sock.AF_INET, sock.SOCK_STREAM)
+    listener.setsockopt(sock.SOL_SOCKET, sock.SO_REUSEADDR, 1)
+    listener.bind((LOCAL_ADDR, PORT + local_player))
+    listener.listen(msg.n_players)
+    for p in range(local_player + 1, msg.n_players):
+        conn, addr = listener.accept()
+        hello = pb.PlayerIP()
+        hello.ParseFromString(conn.recv(1024))
+        socks[hello.player_no] = conn
+    listener.close()
+    for player in msg.players:
+        p_sock = sock.create_connection((player.IP, PORT + player.player_no))
+        hello = pb.PlayerIP()
+        hello.player_no = local_player
+        hello.IP = LOCAL_ADDR
+        p_sock.send(hello.SerializeToString())
+        socks[player.player_no] = p_sock
+    return local_player, socks
+
+def recv_message(s):
+    """
+    Returns the next game message on the blocking socket s, read with
+    the framing of players older than the version negotiation.
+    """
+    def recv_exactly(n):
+        data = ''
+        while len(data) < n:
+            data += s.recv(n - len(data))
+        return data
+    n, = struct.unpack('!Q', recv_exactly(8))
+    return Message.deserialize(recv_exactly(n))
+
+class VersionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wait = network_utils.VERSION_WAIT
+        network_utils.VERSION_WAIT = .5
+        self.results = {}
+        self.threads = []
+
+    def tearDown(self):
+        network_utils.VERSION_WAIT = self.wait
+        for result in self.results.values():
+            for s in result[1]:
+                s = getattr(s, 'socket', s)
+                if hasattr(s, 'close'):
+                    s.close()
+
+    def spawn(self, name, func, *args):
+        def run():
+            self.results[name] = func(*args)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        # give the player time to start listening before the next joins
+        time.sleep(.2)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+    def test_newest_version_is_played(self):
+        self.spawn('coordinator', coordinate_tcp_connections, 3, (600, 600),
+                   Message.STRUCT)
+        self.spawn('first', establish_tcp_connections, LOCAL_ADDR,
+                   Message.STRUCT)
+        self.spawn('second', establish_tcp_connections, LOCAL_ADDR,
+                   Message.STRUCT)
+        self.join()
+        for name in ('coordinator', 'first', 'second'):
+            self.assertEqual(self.results[name][4], Message.STRUCT)
+
+    def test_oldest_version_is_played(self):
+        self.spawn('coordinator', coordinate_tcp_connections, 3, (600, 600),
+                   Message.STRUCT)
+        self.spawn('new', establish_tcp_connections, LOCAL_ADDR,
+                   Message.STRUCT)
+        self.spawn('old', establish_tcp_connections, LOCAL_ADDR,
+                   Message.PROTOBUF)
+        self.join()
+        for name in ('coordinator', 'new', 'old'):
+            self.assertEqual(self.results[name][4], Message.PROTOBUF)
+
+    def test_legacy_player_is_sent_protocol_buffers(self):
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                self.spawn('coordinator', coordinate_tcp_connections, 3,
+                           (600, 600), Message.STRUCT)
+                self.spawn('new', establish_tcp_connections, LOCAL_ADDR,
+                           Message.STRUCT)
+                self.spawn('legacy', legacy_join, LOCAL_ADDR)
+                self.join()
+            finally:
+                sys.stdout = stdout
+        coordinator = self.results['coordinator']
+        new = self.results['new']
+        legacy_player, legacy_socks = self.results['legacy']
+        self.assertEqual(coordinator[4], Message.PROTOBUF)
+        self.assertEqual(new[4], Message.PROTOBUF)
+        # the first thing the legacy player hears is a game message it
+        # can decode, from the coordinator and from the other player
+        move = Message.move(0, (1.0, 2.0), Direction.east)
+        for sender, version in ((coordinator, coordinator[4]),
+                                (new, new[4])):
+            s = sender[1][legacy_player]
+            s.send(move.serialize(version))
+            s.flush()
+        for i in (0, new[0]):
+            got = recv_message(legacy_socks[i])
+            self.assertEqual((got.player, got.pos), (0, (1.0, 2.0)))
+
+if __name__ == '__main__':
+    unittest.main()
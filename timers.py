@@ -0,0 +1,320 @@
+"""
+timers.py
+
+Frame timing for the game loop: a monotonic clock, a frame pacer that
+holds the loop to a target frame rate without burning a core, and cheap
+per-phase frame timers.
+
+The pacer sleeps until shortly before each frame is due and spins for
+the rest, since sleep can wake up a millisecond or more late. When no
+input or network traffic has arrived for a while it drops to a lower
+idle frame rate, and goes back to the full rate as soon as there is.
+
+Per-phase frame timers. Each phase of a frame (reading the network,
+handling local events, updating the game, drawing and pushing the frame
+to the screen) is timed with one clock read and recorded in a fixed-size
+histogram, so the timers can be left on in production games and show
+whether slow frames come from the network layer or from drawing.
+
+The histograms use HDR-style log-linear buckets: times are kept in
+microseconds, exactly below 32 usec and to within 1/16 of their value
+above that, in a fixed array of counters that never grows.
+"""
+
+import sys, time
+
+def _monotonic_clock():
+    """
+    Returns a function returning the time in seconds from a clock that
+    never goes backwards, or time.time if there is none.
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if not sys.platform.startswith('linux'):
+        return time.time
+    try:
+        import ctypes, ctypes.util
+    except ImportError:
+        return time.time
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    CLOCK_MONOTONIC = 1
+    t = timespec()
+    ref = ctypes.byref(t)
+
+    def monotonic():
+        if clock_gettime(CLOCK_MONOTONIC, ref):
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = _monotonic_clock()
+
+# each power of two is split into 2**SUB_BITS buckets
+SUB_BITS = 4
+SUB_COUNT = 1 << SUB_BITS
+# enough buckets for times up to about a minute
+N_BUCKETS = 24 * SUB_COUNT
+
+def bucket(usec):
+    """
+    Returns the histogram bucket of a time in microseconds.
+    """
+    if usec < 2 * SUB_COUNT:
+        return usec
+    shift = usec.bit_length() - SUB_BITS - 1
+    return min(shift * SUB_COUNT + (usec >> shift), N_BUCKETS - 1)
+
+def bucket_floor(i):
+    """
+    Returns the smallest time in microseconds that falls in bucket i.
+    """
+    if i < 2 * SUB_COUNT:
+        return i
+    shift = i // SUB_COUNT - 1
+    return (i - shift * SUB_COUNT) << shift
+
+class Histogram(object):
+    """
+    A fixed-size histogram of durations.
+    """
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.reset()
+
+    def reset(self):
+        """
+        Forget every recorded duration.
+        """
+        for i in range(N_BUCKETS):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """
+        Add a duration in seconds to the histogram.
+        """
+        self.counts[bucket(max(int(seconds * 1e6), 0))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        """
+        Returns the mean duration in seconds.
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """
+        Returns the p-th percentile (0-100) of the durations in seconds, to
+        within the precision of the buckets.
+        """
+        if not self.count:
+            return 0.0
+        rank = min(self.count - 1, int(self.count * p / 100.0))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen > rank:
+                return min(bucket_floor(i) / 1e6, self.max)
+        return self.max
+
+class FrameTimers(object):
+    """
+    Times the phases of each frame of the game loop. Call start_frame at
+    the top of the loop, mark at the end of each phase with the name of
+    the phase, and end_frame at the end of the loop. The time from the
+    previous mark (or the start of the frame) is recorded under the name
+    of the phase, and the time of the whole frame under 'frame'.
+    """
+    PHASES = ('network', 'events', 'update', 'render', 'flip')
+
+    def __init__(self, phases=PHASES, dump_every=None, out=None,
+                 clock=monotonic):
+        """
+        Args:
+            phases - the names of the phases, in the order they run
+            dump_every - if given, print a report of the frames of the
+                last `dump_every' seconds that often, and start over
+            out - the file to print reports to, stdout by default
+            clock - the function returning the current time in seconds
+        """
+        self.phases = tuple(phases) + ('frame',)
+        self.histograms = dict((phase, Histogram()) for phase in self.phases)
+        self.dump_every = dump_every
+        self.out = out
+        self.clock = clock
+        self.frame_start = self.last = self.last_dump = clock()
+
+    def start_frame(self):
+        self.frame_start = self.last = self.clock()
+
+    def mark(self, phase):
+        now = self.clock()
+        self.histograms[phase].record(now - self.last)
+        self.last = now
+
+    def end_frame(self):
+        now = self.clock()
+        self.histograms['frame'].record(now - self.frame_start)
+        if self.dump_every and now - self.last_dump >= self.dump_every:
+            self.last_dump = now
+            self.dump()
+            self.reset()
+
+    def reset(self):
+        """
+        Forget every recorded frame.
+        """
+        for h in self.histograms.values():
+            h.reset()
+
+    def stats(self):
+        """
+        Returns a dictionary from each phase name (and 'frame') to a
+        dictionary of the number of frames recorded and the mean, 50th,
+        99th percentile and max times in seconds.
+        """
+        stats = {}
+        for phase in self.phases:
+            h = self.histograms[phase]
+            stats[phase] = {'count': h.count,
+                            'mean': h.mean(),
+                            'p50': h.percentile(50),
+                            'p99': h.percentile(99),
+                            'max': h.max}
+        return stats
+
+    def report(self):
+        """
+        Returns a table of the phase timings in microseconds.
+        """
+        lines = ['%-8s %8s %8s %8s %8s %8s' %
+                 ('phase', 'frames', 'mean', 'p50', 'p99', 'max')]
+        stats = self.stats()
+        for phase in self.phases:
+            s = stats[phase]
+            lines.append('%-8s %8d %8.0f %8.0f %8.0f %8.0f' %
+                         (phase, s['count'], 1e6 * s['mean'], 1e6 * s['p50'],
+                          1e6 * s['p99'], 1e6 * s['max']))
+        return '\n'.join(lines)
+
+    def dump(self):
+        """
+        Print the report.
+        """
+        out = self.out or sys.stdout
+        out.write(self.report() + '\n')
+        out.flush()
+
+class FramePacer(object):
+    """
+    Holds a loop to a target frame rate. Call wait at the end of every
+    frame; it returns when the next frame is due.
+    """
+    def __init__(self, rate=60, idle_rate=30, idle_after=2.0, spin=.001,
+                 clock=monotonic, sleep=time.sleep):
+        """
+        Args:
+            rate - the target frame rate
+            idle_rate - the frame rate after `idle_after' seconds without
+                activity, or None to always run at `rate'
+            idle_after - the seconds without activity before going idle
+            spin - how long before a frame is due to stop sleeping and
+                spin instead
+            clock - the function returning the current time in seconds
+            sleep - the function to sleep with
+        """
+        self.rate = rate
+        self.idle_rate = idle_rate
+        self.idle_after = idle_after
+        self.spin = spin
+        self.clock = clock
+        self.sleep = sleep
+        self.intervals = Histogram()
+        self.reset()
+
+    def reset(self):
+        """
+        Start pacing from now and forget the frame statistics.
+        """
+        now = self.clock()
+        self.start = self.deadline = self.last = self.last_active = now
+        self.frames = 0
+        self.idle_frames = 0
+        self.busy = 0.0
+        self.min_interval = float('inf')
+        self.intervals.reset()
+
+    def idle(self):
+        """
+        Returns True if the pacer is running at the idle rate.
+        """
+        return bool(self.idle_rate) and \
+            self.clock() - self.last_active >= self.idle_after
+
+    def wait(self, active=True, sleep=None):
+        """
+        Wait until the next frame is due.
+        Args:
+            active - whether there was input or network traffic this frame
+            sleep - the function to sleep with this time instead of the
+                pacer's own, e.g. one that does work while it waits
+        """
+        now = self.clock()
+        self.busy += now - self.last
+        if active:
+            self.last_active = now
+        if self.idle_rate and now - self.last_active >= self.idle_after:
+            period = 1.0 / self.idle_rate
+            self.idle_frames += 1
+        else:
+            period = 1.0 / self.rate
+        self.deadline += period
+        # after a long frame start over rather than rush to catch up
+        if self.deadline < now:
+            self.deadline = now
+
+        remaining = self.deadline - now
+        if remaining > self.spin:
+            (sleep or self.sleep)(remaining - self.spin)
+        now = self.clock()
+        while now < self.deadline:
+            now = self.clock()
+
+        # self.last is when the frame that just ended started
+        if self.frames:
+            interval = now - self.last
+            self.intervals.record(interval)
+            if interval < self.min_interval:
+                self.min_interval = interval
+        self.frames += 1
+        self.last = now
+
+    def stats(self):
+        """
+        Returns a dictionary of the number of frames, the effective frame
+        rate, the highest and lowest frame rates between two frames, the
+        fraction of the time spent working rather than waiting, and the
+        number of frames run at the idle rate.
+        """
+        elapsed = self.last - self.start
+        fastest = self.min_interval if self.intervals.count else 0.0
+        return {'frames': self.frames,
+                'rate': self.frames / elapsed if elapsed else 0.0,
+                'max_rate': 1 / fastest if fastest else 0.0,
+                'min_rate': 1 / self.intervals.max if self.intervals.max else 0.0,
+                'busy': self.busy / elapsed if elapsed else 0.0,
+                'idle_frames': self.idle_frames}